@@ -1,46 +1,62 @@
-import io
 import base64
 import logging
 from PIL import Image
 import time
 import numpy as np
 import queue
+import uuid
 from pathlib import Path
 from streamlit_chat import message
 from streamlit.logger import get_logger
 
-import pydub
 import streamlit as st
-from lib.speak import ChatGPTWithEmotion, ChatGPTFeature, Audio, system_text
-from lib.transcript import AudioTranscriber
+from lib.speak import (
+    ChatGPTWithEmotion,
+    ChatGPTFeature,
+    Audio,
+    concat_wav,
+    delivery_available,
+    get_audio_server,
+    get_conversation_store,
+    load_manifest,
+    synthesize_stream,
+    system_text,
+    warm_up,
+)
+from lib.transcript import AudioTranscriber, FrameIngestor
 from streamlit_webrtc import WebRtcMode, webrtc_streamer
 from streamlit.runtime.scriptrunner import add_script_run_ctx
 
 # stremlit session state
-AUDIO_BUFFER = "audio_buffer"
-BOT_MESSAGES = "bot_messages"
-USR_MESSAGES = "usr_messages"
+INGESTOR = "ingestor"
+SESSION_ID = "session_id"
 GENERATED_INDEX = "generated_index"
 READ_INDEX = "read_index"
 SPEAKER_ID = "speaker_id"
 MODE_INDEX = "mode_index"
 EMOTIONS = "emotions"
 FEATURE_INDEX = "feature_index"
-HISTORY = "history"
 VISIBILITY = "visibility"
-RERUNED = "reruned"
+SPEECH = "speech"
+
+# chat モードで表示する直近のターン数
+CHAT_WINDOW = 20
+# 発話を待つあいだ、この間隔でStreamlitに制御を返す（再実行や停止を受け付けるため）
+LISTEN_INTERVAL = 1.0
 
 logger = get_logger("streamlit_webrtc")
 logger.setLevel(logging.INFO)
 
 
 def session_init():
-    if AUDIO_BUFFER not in st.session_state:
-        st.session_state[AUDIO_BUFFER] = pydub.AudioSegment.empty()
-    if BOT_MESSAGES not in st.session_state:
-        st.session_state[BOT_MESSAGES] = []
-    if USR_MESSAGES not in st.session_state:
-        st.session_state[USR_MESSAGES] = []
+    if INGESTOR not in st.session_state:
+        st.session_state[INGESTOR] = FrameIngestor()
+    if SESSION_ID not in st.session_state:
+        # URLに残しておき、再読み込みしても同じ会話を続ける
+        params = st.experimental_get_query_params()
+        session_id = params.get("session", [uuid.uuid4().hex])[0]
+        st.experimental_set_query_params(session=session_id)
+        st.session_state[SESSION_ID] = session_id
     if EMOTIONS not in st.session_state:
         st.session_state[EMOTIONS] = None
     if SPEAKER_ID not in st.session_state:
@@ -49,14 +65,13 @@ def session_init():
         st.session_state[MODE_INDEX] = 0
     if FEATURE_INDEX not in st.session_state:
         st.session_state[FEATURE_INDEX] = 0
-    if HISTORY not in st.session_state:
-        st.session_state[HISTORY] = []
     if GENERATED_INDEX not in st.session_state:
-        st.session_state[GENERATED_INDEX] = None
+        count = get_conversation_store().count(st.session_state[SESSION_ID])
+        st.session_state[GENERATED_INDEX] = count or None
     if READ_INDEX not in st.session_state:
         st.session_state[READ_INDEX] = None
-    if RERUNED not in st.session_state:
-        st.session_state[RERUNED] = False
+    if SPEECH not in st.session_state:
+        st.session_state[SPEECH] = None
     if VISIBILITY not in st.session_state:
         st.session_state.visibility = "visible"
         st.session_state.disabled = False
@@ -78,89 +93,119 @@ class WebRTCRecorder:
         )
         logger.debug("audio_receiver_size: {}".format(self.audio_receiver_size))
 
+    # VADで発話が区切れるまで待ち、区切れた発話を返す
+    # フレームの受信とVADはセッションごとの裏のスレッドで行い、ここでは発話が届くまで眠って待つ
     def listen(self):
         self.status_box = st.empty()
+        ingestor = st.session_state[INGESTOR]
 
-        if not self.webrtc_ctx.state.playing:
-            return
+        if not self.webrtc_ctx.state.playing or not self.webrtc_ctx.audio_receiver:
+            # 話している途中で止められたら、そこまでを1つの発話にする
+            ingestor.stop()
+            return ingestor.get(timeout=0)
 
-        self.status_box.info("Loading...")
+        ingestor.start(self.webrtc_ctx.audio_receiver)
         logger.info("listening to user voice")
+        # 表示する文言は受信の状態が変わったときだけ選び直す
+        # 描き直しは毎回行い、そのたびにStreamlitが再実行や停止を受け付けられるようにする
+        status = {}
+
+        def tick(receiving):
+            if status.get("receiving") != receiving:
+                status["receiving"] = receiving
+                status["show"] = self.status_box.info if receiving else self.status_box.warning
+                status["text"] = "何か聞いてね！" if receiving else "No frame arrived."
+            status["show"](status["text"])
 
-        while True:
-            if self.webrtc_ctx.audio_receiver:
-                try:
-                    audio_frames = self.webrtc_ctx.audio_receiver.get_frames(timeout=1)
-                except queue.Empty:
-                    self.status_box.warning("No frame arrived.")
-                    continue
-
-                self.status_box.info("何か聞いてね！")
-
-                sound_chunk = pydub.AudioSegment.empty()
-                for audio_frame in audio_frames:
-                    sound = pydub.AudioSegment(
-                        data=audio_frame.to_ndarray().tobytes(),
-                        sample_width=audio_frame.format.bytes,
-                        frame_rate=audio_frame.sample_rate,
-                        channels=len(audio_frame.layout.channels),
-                    )
-                    sound_chunk += sound
-
-                if len(sound_chunk) > 0:
-                    st.session_state[AUDIO_BUFFER] += sound_chunk
-            else:
-                break
-
-    def generate(self, feature):
-        audio_buffer = st.session_state[AUDIO_BUFFER]
+        return ingestor.wait(LISTEN_INTERVAL, tick)
+
+    def generate(self, feature, speaker_id, utterance, face=None):
         ts = AudioTranscriber()
         chat = ChatGPTWithEmotion(self.max_token_size)
-        history = st.session_state[HISTORY][-6:]  # 最新6件
-        st.session_state[HISTORY] = history
+        store = get_conversation_store()
+        session_id = st.session_state[SESSION_ID]
+        # 予算を超えた古いターンは ChatGPT 側で要約にまとめられる
+        history = store.history(session_id)
 
-        if not self.webrtc_ctx.state.playing and len(audio_buffer) > 0:
+        if utterance is not None:
             st.info("（考え中...）")
             try:
-                # create wev
-                wav_bytes = io.BytesIO()
-                audio_buffer.export(wav_bytes, format="wav")
-                # transcript
-                user_text = ts.listen(wav_bytes)
-                st.session_state[USR_MESSAGES].append(user_text)
+                # transcript (PCMのまま渡す)
+                user_text = ts.listen(utterance, st.session_state[INGESTOR].sample_rate)
                 logger.info("user text: {}".format(user_text))
             except Exception as e:
                 st.error(f"Error while transcripting: {e}")
                 logger.error("while transcripting: {}".format(e))
 
             try:
-                # generate text
+                # generate text (文ごとに表示・音声合成しながら生成する)
                 system = system_text(feature)
-                generated, history, emotions = chat.generate(system, user_text, history)
+                stream = chat.generate_stream(system, user_text, history)
+                speech = self.__speak(stream, speaker_id, face)
+                generated, history, emotions = (
+                    stream.text,
+                    stream.history,
+                    stream.params,
+                )
+                st.session_state[SPEECH] = speech
                 logger.info("generated: {}".format(generated))
                 logger.info("emotions: {}".format(emotions))
-                st.session_state[BOT_MESSAGES].append(generated)
-                st.session_state[GENERATED_INDEX] = len(st.session_state[BOT_MESSAGES])
-                st.session_state[READ_INDEX] = len(st.session_state[BOT_MESSAGES]) - 1
+                turn = store.append(session_id, user_text, generated, emotions, history)
+                st.session_state[GENERATED_INDEX] = turn
+                st.session_state[READ_INDEX] = turn - 1
             except Exception as e:
                 st.error(f"Error while generating: {e}")
                 logger.error("while generating: {}".format(e))
 
             st.session_state[EMOTIONS] = emotions
-            st.session_state[AUDIO_BUFFER] = pydub.AudioSegment.empty()
             return (generated, emotions)
         else:
             return (None, None)
 
-    def __background_play(self, wav_content):
+    # 文ごとに表示しながら音声にする。配信サーバにブラウザから届くなら合成は裏で続け、配信URLを返す
+    # face があれば、感情パラメータが届いた時点で表情を切り替える
+    def __speak(self, stream, speaker_id, face=None):
+        text_box = st.empty()
+        sentences = []
+        shown = []
+
+        def show(sentence):
+            sentences.append(sentence)
+            text_box.info("".join(sentences))
+            if face is not None and stream.params is not None and not shown:
+                face.image(get_image(stream.params), width=500)
+                shown.append(stream.params)
+        audio = Audio(speaker_id)
+        if delivery_available():
+            server = get_audio_server()
+            reply = server.open()
+            pending = queue.Queue()
+            reply.synthesize(iter(pending.get, None), audio)
+            try:
+                for sentence in stream.sentences():
+                    pending.put(sentence)
+                    show(sentence)
+            finally:
+                pending.put(None)
+            return server.url(reply)
+
+        wavs = []
+        for sentence, wav in synthesize_stream(stream.sentences(), audio):
+            wavs.append(wav)
+            show(sentence)
+        return concat_wav(wavs)
+
+    # speech は配信URL、またはWAVのバイト列
+    def __background_play(self, speech):
         audio_placeholder = st.empty()
-        audio_str = "data:audio/ogg;base64,%s" % (
-            base64.b64encode(wav_content).decode()
-        )
+        if isinstance(speech, str):
+            audio_str = speech
+        else:
+            audio_str = "data:audio/wav;base64,%s" % (base64.b64encode(speech).decode())
         audio_html = (
             """
             <audio autoplay=True>
-            <source src="%s" type="audio/ogg" autoplay=True>
+            <source src="%s" autoplay=True>
             Your browser does not support the audio element.
             </audio>
             """
@@ -170,20 +215,21 @@ class WebRTCRecorder:
         audio_placeholder.markdown(audio_html, unsafe_allow_html=True)
 
     def audio_play(self, speaker_id):
-        if (
-            len(st.session_state[BOT_MESSAGES]) == 0
-            or st.session_state[READ_INDEX] is None
-            or self.webrtc_ctx.state.playing
-        ):
+        if st.session_state[READ_INDEX] is None:
+            return
+        turn = get_conversation_store().latest(st.session_state[SESSION_ID])
+        if turn is None:
             return
-        read_index = st.session_state[GENERATED_INDEX] - 1
-        logger.debug("now plaing on index: {}".format(read_index))
-        text = st.session_state[BOT_MESSAGES][read_index]
-        # play audio
-        speaker = Audio(speaker_id)
-        speaker.transform(text)
-        wav_bytes = speaker.get_wav()
-        self.__background_play(wav_bytes)
+        logger.debug("now plaing on turn: {}".format(turn.turn))
+        text = turn.bot_text
+        # play audio (ストリーミング中に合成済みならそれを使う)
+        speech = st.session_state[SPEECH]
+        if not speech:
+            speaker = Audio(speaker_id)
+            speaker.transform(text)
+            speech = speaker.get_wav()
+        st.session_state[SPEECH] = None
+        self.__background_play(speech)
         st.session_state[READ_INDEX] = st.session_state[GENERATED_INDEX]
 
 
@@ -221,30 +267,29 @@ def get_image(emotions: dict):
     return emotion_image_path(max_emotion_str)
 
 
+# 全件ではなく直近 CHAT_WINDOW ターンだけを読んで描画する
 def chat_view():
-    if len(st.session_state[USR_MESSAGES]) == 0:
+    turns = get_conversation_store().turns(st.session_state[SESSION_ID], limit=CHAT_WINDOW)
+    if not turns:
         return
 
     container = st.container()
-    if st.session_state[BOT_MESSAGES]:
-        with container:
-            for i in range(len(st.session_state[BOT_MESSAGES])):
-                message(
-                    st.session_state[USR_MESSAGES][i],
-                    is_user=True,
-                    key=str(i) + "_usr",
-                )
-                message(st.session_state[BOT_MESSAGES][i], key=str(i))
+    with container:
+        if turns[0].turn > 1:
+            st.caption("これより前の {} 件は省略しています".format(turns[0].turn - 1))
+        for t in turns:
+            message(t.user_text, is_user=True, key="{}_usr".format(t.turn))
+            message(t.bot_text, key=str(t.turn))
 
 
+# 表情の画像を描いた場所を返す（生成中に差し替えられるように）
 def image_view():
     emotions = st.session_state[EMOTIONS]
     gen_index = st.session_state[GENERATED_INDEX]
-    logger.debug("bot messages: {}".format(st.session_state[BOT_MESSAGES]))
-    if gen_index is None:
-        text = ""
-    else:
-        text = st.session_state[BOT_MESSAGES][gen_index - 1]
+    latest = None
+    if gen_index is not None:
+        latest = get_conversation_store().latest(st.session_state[SESSION_ID])
+    text = "" if latest is None else latest.bot_text
 
     image = get_image(emotions)
     col1, col2, col3 = st.columns([1, 6, 1])
@@ -252,9 +297,11 @@ def image_view():
         st.write("")
     with col2:
         st.write("")
-        st.image(image, caption=text, width=500)
+        face = st.empty()
+        face.image(image, caption=text, width=500)
     with col3:
         st.write("")
+    return face
 
 
 def voice_options():
@@ -335,12 +382,21 @@ def feautre_option():
     return feature
 
 
+# プロセスごとに1回だけ、モデルの読み込みと決まり文句の合成を済ませる
+@st.cache_resource
+def warm_up_voices(speaker_id):
+    speakers, _ = load_manifest()
+    return warm_up(sorted(set(speakers) | {speaker_id}))
+
+
 def app():
     image = Image.open("images/zunda-icon.png")
     st.set_page_config(page_title="michat - DEMO", page_icon=image)
     st.title("michat")
 
     session_init()
+    report = warm_up_voices(st.session_state[SPEAKER_ID])
+    logger.debug("warm-up: {:.2f}s".format(report["total"]))
 
     with st.sidebar:
         view_mode = mode_options()
@@ -350,37 +406,22 @@ def app():
     logger.debug("speaker id: {}".format(speaker_id))
     logger.debug("feature: {}".format(feature))
 
+    face = None
     if view_mode == "chat":
         chat_view()
     elif view_mode == "image":
-        image_view()
+        face = image_view()
 
     webrtc = WebRTCRecorder()
     logger.debug("max token size: {}".format(webrtc.max_token_size))
     logger.debug("session_state: {}".format(st.session_state))
     logger.debug("player state: {}".format(webrtc.webrtc_ctx.state))
-    webrtc.listen()  # busy loop here
-    generated, emotions = webrtc.generate(feature)
-
     generated_index = st.session_state[GENERATED_INDEX]
     read_index = st.session_state[READ_INDEX]
     logger.debug("generated_index: {}".format(generated_index))
     logger.debug("read_index: {}".format(read_index))
 
-    # re-reder view
-    # TODO: are there any other good way??
-    if (
-        generated_index is not None
-        and read_index is not None
-        and generated_index > read_index
-        and not st.session_state[RERUNED]
-    ):
-        st.session_state[RERUNED] = True
-        st.experimental_rerun()
-        # not excecuted here
-    else:
-        st.session_state[RERUNED] = False
-
+    # 前のターンの返答を再生してから、次の発話を聞く
     if (
         generated_index is not None
         and read_index is not None
@@ -388,6 +429,12 @@ def app():
     ):
         webrtc.audio_play(speaker_id)
 
+    utterance = webrtc.listen()
+    generated, emotions = webrtc.generate(feature, speaker_id, utterance, face)
+    if generated is not None:
+        # re-reder view (再生は次の実行で行う)
+        st.experimental_rerun()
+
 
 if __name__ == "__main__":
     app()
@@ -0,0 +1,73 @@
+import json
+import sys
+from argparse import ArgumentParser
+from pathlib import Path
+
+from lib.bench import Benchmark, compare, format_summary
+from lib.speak import llm_backend_names, setup_log
+
+
+def main():
+    progname = Path(__file__).name
+    parser = ArgumentParser(description=progname)
+    parser.add_argument(
+        "-s", "--scenario", help="code path to drive", choices=Benchmark.scenarios, default="webrtc"
+    )
+    parser.add_argument("-n", "--turns", help="measured turns", type=int, default=20)
+    parser.add_argument("--warmup", help="turns excluded from the results", type=int, default=2)
+    parser.add_argument(
+        "--no-stream", help="generate the whole reply before synthesis", action="store_true"
+    )
+    parser.add_argument("--stt-latency", help="seconds per recognition", type=float, default=0.3)
+    parser.add_argument("--llm-latency", help="seconds to the first token", type=float, default=0.5)
+    parser.add_argument("--chunk-delay", help="seconds per streamed chunk", type=float, default=0.02)
+    parser.add_argument("--tts-latency", help="seconds per synthesis", type=float, default=0.1)
+    parser.add_argument(
+        "--tts-per-char", help="additional synthesis seconds per character", type=float, default=0.005
+    )
+    parser.add_argument("--voicevox", help="synthesize with the real VOICEVOX core", action="store_true")
+    parser.add_argument(
+        "--llm-backend", help="ChatGPT client", choices=llm_backend_names(), default="openai"
+    )
+    parser.add_argument("--no-memory", help="skip tracemalloc", action="store_true")
+    parser.add_argument("-o", "--output", help="write the results as JSON")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument(
+        "--tolerance", help="allowed slowdown against the baseline", type=float, default=0.1
+    )
+    parser.add_argument("-L", "--log-file", help="log output file", default="stdout")
+    parser.add_argument("-l", "--log-level", help="logger level", default="WARNING")
+    args = parser.parse_args()
+
+    setup_log(log_file=args.log_file, log_level=args.log_level)
+
+    bench = Benchmark(
+        args.scenario,
+        turns=args.turns,
+        warmup=args.warmup,
+        stream=not args.no_stream,
+        stt_latency=args.stt_latency,
+        llm_latency=args.llm_latency,
+        chunk_delay=args.chunk_delay,
+        tts_latency=args.tts_latency,
+        tts_per_char=args.tts_per_char,
+        voicevox=args.voicevox,
+        llm_backend=args.llm_backend,
+        trace_memory=not args.no_memory,
+    )
+    result = bench.run()
+    print(format_summary(result))
+    if args.output:
+        Path(args.output).write_text(json.dumps(result, ensure_ascii=False, indent=2))
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        regressions = compare(result, baseline, args.tolerance)
+        for name, key, previous, current in regressions:
+            print("regression: {} {} {:.3f} -> {:.3f}".format(name, key, previous, current))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
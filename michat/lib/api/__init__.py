@@ -0,0 +1 @@
+from .api import Limiter, Overloaded, SessionStore, VoiceService, create_app
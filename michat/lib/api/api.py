@@ -0,0 +1,366 @@
+import asyncio
+import io
+import json
+import logging
+import threading
+import uuid
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+
+from ..speak import (
+    Audio,
+    AudioStream,
+    ChatGPTFeature,
+    ChatGPTWithEmotion,
+    encode,
+    encoder_available,
+    split_sentences,
+    system_text,
+    warm_up,
+)
+from ..speak.delivery import formats, read_pcm
+from ..speak.wav import wav_stream_header
+from ..transcript import AudioTranscriber
+
+default_speaker_id = 3
+max_sessions = 1024
+max_clips = 256
+
+logger = logging.getLogger(__name__)
+
+
+class Overloaded(Exception):
+    def __init__(self, name):
+        super().__init__("{} queue is full".format(name))
+        self.name = name
+
+
+# 同時に処理する数と待たせる数を制限する。待ちが溢れたら Overloaded にする
+class Limiter:
+    def __init__(self, name, concurrency, max_queue):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.__semaphore = None
+
+    @property
+    def saturated(self):
+        return self.active >= self.concurrency and self.waiting >= self.max_queue
+
+    @property
+    def stats(self):
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+            "concurrency": self.concurrency,
+            "max_queue": self.max_queue,
+        }
+
+    # 溢れていたら、レスポンスを返し始める前に 503 で断る
+    def check(self):
+        if self.saturated:
+            self.rejected += 1
+            raise Overloaded(self.name)
+
+    async def acquire(self):
+        if self.__semaphore is None:
+            self.__semaphore = asyncio.Semaphore(self.concurrency)
+        self.check()
+        self.waiting += 1
+        try:
+            await self.__semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+        self.__semaphore.release()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *args):
+        self.release()
+
+
+# セッションごとの会話履歴（古いものから捨てる）
+class SessionStore:
+    def __init__(self, capacity=max_sessions):
+        self.__histories = OrderedDict()
+        self.__capacity = capacity
+        self.__lock = threading.Lock()
+
+    def get(self, session):
+        with self.__lock:
+            history = self.__histories.get(session)
+            if history is not None:
+                self.__histories.move_to_end(session)
+            return history
+
+    def put(self, session, history):
+        with self.__lock:
+            self.__histories[session] = history
+            self.__histories.move_to_end(session)
+            while len(self.__histories) > self.__capacity:
+                self.__histories.popitem(last=False)
+
+
+class ChatRequest(BaseModel):
+    user_text: str
+    feature: str = ChatGPTFeature.ZUNDAMON.name
+    session: Optional[str] = None
+    history: Optional[List[dict]] = None
+
+
+class TTSRequest(BaseModel):
+    text: str
+    speaker_id: int = default_speaker_id
+    format: str = "wav"
+
+
+def event(name, data):
+    return "event: {}\ndata: {}\n\n".format(name, json.dumps(data, ensure_ascii=False))
+
+
+def feature_of(name):
+    try:
+        return ChatGPTFeature[name.upper()]
+    except KeyError:
+        raise HTTPException(400, "unknown feature: {}".format(name))
+
+
+def audio_format(name):
+    if name != "wav" and (name not in formats or not encoder_available()):
+        raise HTTPException(400, "unsupported audio format: {}".format(name))
+    return name
+
+
+# 1つのプロセスで複数のクライアントを捌く音声対話API
+class VoiceService:
+    def __init__(
+        self,
+        chat=None,
+        audio_factory=Audio,
+        transcriber_factory=AudioTranscriber,
+        llm_concurrency=8,
+        tts_concurrency=1,
+        stt_concurrency=2,
+        max_queue=16,
+        warmup_speakers=(default_speaker_id,),
+    ):
+        # ChatGPTとEnginePoolはリクエスト間で共有し、Audio/Transcriberはリクエストごとに作る
+        self.chat = chat or ChatGPTWithEmotion(512)
+        self.audio_factory = audio_factory
+        self.transcriber_factory = transcriber_factory
+        self.llm = Limiter("llm", llm_concurrency, max_queue)
+        self.tts = Limiter("tts", tts_concurrency, max_queue)
+        self.stt = Limiter("stt", stt_concurrency, max_queue)
+        self.sessions = SessionStore()
+        self.clips = OrderedDict()
+        self.__clips_lock = threading.Lock()
+        self.warmup_speakers = warmup_speakers
+        self.warmup = None
+        self.ready = False
+
+    @property
+    def limiters(self):
+        return [self.llm, self.tts, self.stt]
+
+    def warm_up(self):
+        self.warmup = warm_up(self.warmup_speakers, audio_factory=self.audio_factory)
+        self.ready = True
+        logger.info("voice service is ready")
+
+    def history_of(self, session, history):
+        if history is not None:
+            return history
+        return self.sessions.get(session) or []
+
+    # --- STT ---
+    async def transcribe(self, body, content_type, sample_rate=None, channels=1):
+        if not body:
+            raise HTTPException(400, "empty audio")
+        transcriber = self.transcriber_factory()
+        async with self.stt:
+            if content_type.startswith("audio/wav") or content_type.startswith("audio/x-wav"):
+                return await run_in_threadpool(transcriber.listen, io.BytesIO(body))
+            if sample_rate is None:
+                raise HTTPException(400, "sample_rate is required for raw PCM")
+            return await run_in_threadpool(transcriber.listen, body, sample_rate, channels)
+
+    # --- LLM ---
+    async def sentences(self, feature, user_text, history):
+        # キャッシュの参照や履歴の要約があるので、イベントループの外で呼ぶ
+        stream = await run_in_threadpool(self.chat.generate_stream, system_text(feature), user_text, history)
+        async for sentence in iterate_in_threadpool(stream.sentences()):
+            yield sentence, stream
+        yield None, stream
+
+    # --- TTS ---
+    async def synthesize(self, audio, text):
+        def run():
+            audio.transform(text)
+            return audio.get_wav()
+
+        return await run_in_threadpool(run)
+
+    def clip(self, wav, format):
+        data, content_type = wav, "audio/wav"
+        if format != "wav":
+            data, content_type = encode(wav, format), formats[format][2]
+        clip_id = uuid.uuid4().hex
+        with self.__clips_lock:
+            self.clips[clip_id] = (data, content_type)
+            while len(self.clips) > max_clips:
+                self.clips.popitem(last=False)
+        return clip_id
+
+
+def create_app(service=None, **kwargs):
+    service = service or VoiceService(**kwargs)
+
+    @asynccontextmanager
+    async def lifespan(app):
+        await run_in_threadpool(service.warm_up)
+        yield
+
+    app = FastAPI(title="michat", lifespan=lifespan)
+    app.state.service = service
+
+    @app.exception_handler(Overloaded)
+    async def overloaded(request, e):
+        return JSONResponse({"detail": str(e)}, status_code=503, headers={"Retry-After": "1"})
+
+    @app.get("/healthz")
+    async def healthz():
+        return {"status": "ok"}
+
+    @app.get("/readyz")
+    async def readyz():
+        stats = {limiter.name: limiter.stats for limiter in service.limiters}
+        saturated = [limiter.name for limiter in service.limiters if limiter.saturated]
+        ready = service.ready and not saturated
+        body = {"ready": ready, "saturated": saturated, "queues": stats}
+        if service.warmup is not None:
+            body["warmup_seconds"] = service.warmup["total"]
+        return JSONResponse(body, status_code=200 if ready else 503)
+
+    @app.post("/stt")
+    async def stt(request: Request, sample_rate: Optional[int] = None, channels: int = 1):
+        body = await request.body()
+        content_type = request.headers.get("content-type", "")
+        text = await service.transcribe(body, content_type, sample_rate, channels)
+        return {"text": text}
+
+    @app.post("/chat")
+    async def chat(request: ChatRequest):
+        feature = feature_of(request.feature)
+        session = request.session or uuid.uuid4().hex
+        history = service.history_of(session, request.history)
+        service.llm.check()
+
+        # 枠はストリームの中で取る。本文を読まれずに終わったリクエストが枠を持ち続けないように
+        async def events():
+            try:
+                async with service.llm:
+                    async for sentence, stream in service.sentences(feature, request.user_text, history):
+                        if sentence is not None:
+                            yield event("sentence", {"text": sentence})
+                            continue
+                        service.sessions.put(session, stream.history)
+                        yield event("done", {"text": stream.text, "emotions": stream.params, "session": session})
+            except Exception as e:
+                logger.error("while chatting: {}".format(e))
+                yield event("error", {"detail": str(e)})
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.post("/tts")
+    async def tts(request: TTSRequest):
+        format = audio_format(request.format)
+        audio = service.audio_factory(request.speaker_id)
+        sentences = list(split_sentences([request.text]))
+        if not sentences:
+            raise HTTPException(400, "empty text")
+        service.tts.check()
+
+        async def chunks():
+            async with service.tts:
+                if format == "wav":
+                    header = None
+                    for sentence in sentences:
+                        pcm, sample_rate, channels = read_pcm(await service.synthesize(audio, sentence))
+                        if header is None:
+                            header = wav_stream_header(sample_rate, channels)
+                            yield header
+                        yield pcm
+                    return
+                # エンコーダは1本にして、1つの連続したストリームとして返す
+                stream = AudioStream(format)
+                stream.synthesize(iter(sentences), audio)
+                async for chunk in iterate_in_threadpool(stream.chunks()):
+                    yield chunk
+
+        media_type = "audio/wav" if format == "wav" else formats[format][2]
+        return StreamingResponse(chunks(), media_type=media_type)
+
+    @app.post("/turn")
+    async def turn(
+        request: Request,
+        sample_rate: Optional[int] = None,
+        channels: int = 1,
+        feature: str = ChatGPTFeature.ZUNDAMON.name,
+        speaker_id: int = default_speaker_id,
+        session: Optional[str] = None,
+        format: str = "wav",
+    ):
+        feature = feature_of(feature)
+        format = audio_format(format)
+        body = await request.body()
+        content_type = request.headers.get("content-type", "")
+        user_text = await service.transcribe(body, content_type, sample_rate, channels)
+        session = session or uuid.uuid4().hex
+        history = service.history_of(session, None)
+        audio = service.audio_factory(speaker_id)
+        service.llm.check()
+
+        async def events():
+            yield event("transcript", {"text": user_text})
+            try:
+                async with service.llm:
+                    async for sentence, stream in service.sentences(feature, user_text, history):
+                        if sentence is None:
+                            service.sessions.put(session, stream.history)
+                            yield event("done", {"text": stream.text, "emotions": stream.params, "session": session})
+                            continue
+                        async with service.tts:
+                            wav = await service.synthesize(audio, sentence)
+                        clip_id = await run_in_threadpool(service.clip, wav, format)
+                        yield event("sentence", {"text": sentence, "audio": "/audio/{}".format(clip_id)})
+            except Exception as e:
+                logger.error("while taking a turn: {}".format(e))
+                yield event("error", {"detail": str(e)})
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/audio/{clip_id}")
+    async def clip(clip_id: str):
+        found = service.clips.get(clip_id)
+        if found is None:
+            raise HTTPException(404, "no such audio")
+        data, content_type = found
+        return Response(data, media_type=content_type)
+
+    return app
@@ -0,0 +1 @@
+from .harness import Benchmark, TurnTimer, compare, format_summary, percentiles
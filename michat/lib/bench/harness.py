@@ -0,0 +1,560 @@
+import contextlib
+import datetime
+import importlib
+import importlib.util
+import json
+import logging
+import platform
+import queue
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.request
+from collections import deque
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+
+quantiles = (50, 90, 95, 99)
+metrics = ("stt", "first_text", "first_audio", "total", "memory")
+default_inputs = [
+    "こんにちは",
+    "今日の天気はどうかな？",
+    "おすすめの本を教えて",
+    "明日の予定を一緒に考えてほしいな",
+]
+emotion_reply = '感情パラメーター\n{"喜び": 3, "楽しさ": 2}\nこんにちは！ぼくはずんだもんなのだ。今日もよろしくなのだ♪'
+plain_reply = "こんにちは！ぼくはずんだもんなのだ。今日もよろしくなのだ♪"
+# speaker.py, michat.py, app.py のあるディレクトリ（lib はここから読み込まれる）
+scripts_dir = Path(__file__).resolve().parents[2]
+# マイクやWebRTCから届く1チャンクの長さ（秒）と、発話の前後の無音
+chunk_seconds = 0.02
+lead_seconds = 0.3
+trail_seconds = 1.0
+
+logger = logging.getLogger(__name__)
+
+
+def percentiles(values, qs=quantiles):
+    if not values:
+        return {}
+    a = np.asarray(values, dtype=float)
+    result = {"p{}".format(q): float(np.percentile(a, q)) for q in qs}
+    result["mean"] = float(a.mean())
+    result["max"] = float(a.max())
+    return result
+
+
+# 後ろに足すので、michat パッケージ（リポジトリ直下から読むとき）は michat.py に隠れない
+def add_scripts_dir():
+    if str(scripts_dir) not in sys.path:
+        sys.path.append(str(scripts_dir))
+
+
+# エントリポイントのスクリプトを読み込む。スクリプトと同じく lib をトップレベルのパッケージとして使う
+def entry_point(name):
+    add_scripts_dir()
+    key = "michat_bench_{}".format(name)
+    if key not in sys.modules:
+        spec = importlib.util.spec_from_file_location(key, scripts_dir / "{}.py".format(name))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[key] = module
+        try:
+            with command_line(name, []):
+                spec.loader.exec_module(module)
+        except BaseException:
+            del sys.modules[key]
+            raise
+    return sys.modules[key]
+
+
+# エントリポイントが使うのと同じ lib のモジュール（テストから michat.lib として読まれたときも）
+def lib_module(name):
+    add_scripts_dir()
+    return importlib.import_module("lib.{}".format(name))
+
+
+@contextlib.contextmanager
+def patched(module, **values):
+    saved = {name: getattr(module, name) for name in values}
+    for name, value in values.items():
+        setattr(module, name, value)
+    try:
+        yield module
+    finally:
+        for name, value in saved.items():
+            setattr(module, name, value)
+
+
+@contextlib.contextmanager
+def command_line(name, args):
+    saved = sys.argv
+    sys.argv = ["{}.py".format(name)] + [str(a) for a in args]
+    try:
+        yield
+    finally:
+        sys.argv = saved
+
+
+# ターンの区切り（壁時計）とメモリを記録する。始まりと終わりは別のスレッドから呼ばれることもある
+# 再生は裏で続くので、再生に回したWAVがどのターンのものかも覚えておく
+class TurnTimer:
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.windows = []
+        self.playbacks = []
+        self.__lock = threading.Lock()
+        self.__start = None
+        self.__base = 0
+
+    def begin(self):
+        with self.__lock:
+            self.__end()
+            if self.trace_memory:
+                tracemalloc.reset_peak()
+                self.__base = tracemalloc.get_traced_memory()[0]
+            self.__start = time.time()
+
+    def end(self):
+        with self.__lock:
+            self.__end()
+
+    def play(self):
+        with self.__lock:
+            self.playbacks.append(None if self.__start is None else len(self.windows))
+
+    def __end(self):
+        if self.__start is None:
+            return
+        memory = None
+        if self.trace_memory:
+            memory = (tracemalloc.get_traced_memory()[1] - self.__base) / 1024
+        self.windows.append((self.__start, time.time(), memory))
+        self.__start = None
+
+
+def span_end(span):
+    return span["start"] + span["duration"]
+
+
+# 1ターンの各段の時間を求める。再生以外はターンの間に始まったSpan、再生はそのターンが再生に回したもの
+def turn_sample(window, spans, playbacks):
+    start, end, memory = window
+    inside = [s for s in spans if s["name"] != "playback" and start <= s["start"] <= end] + playbacks
+    sample = {"total": max([end] + [span_end(s) for s in playbacks]) - start}
+    if memory is not None:
+        sample["memory"] = memory
+
+    def first(name, at):
+        values = [at(s) - start for s in inside if s["name"] == name]
+        return min(values) if values else None
+
+    stt = first("transcribe", span_end)
+    # ストリームなら最初のトークン、一括なら生成の終わり
+    first_text = first("generate", lambda s: s["start"] + s["first_token"] if "first_token" in s else span_end(s))
+    # 再生するものは再生の始まり、ブラウザに渡すものは最初の合成の終わり
+    first_audio = first("playback", lambda s: s["start"])
+    if first_audio is None:
+        first_audio = first("synthesis", span_end)
+    for name, value in (("stt", stt), ("first_text", first_text), ("first_audio", first_audio)):
+        if value is not None:
+            sample[name] = value
+    stages = {}
+    for s in inside:
+        stages[s["name"]] = stages.get(s["name"], 0.0) + s["duration"]
+    sample["stages"] = stages
+    return sample
+
+
+# 話した長さが文字数に比例する発話（前後は雑音程度の無音）を、(チャンク, 話し終わったところか) に分ける
+def utterance_chunks(text, sample_rate, channels, chunk):
+    rng = np.random.default_rng(len(text))
+    lead = int(sample_rate * lead_seconds)
+    speech = int(sample_rate * 0.15 * len(text))
+    t = np.arange(speech) / sample_rate
+    samples = np.concatenate(
+        [
+            rng.standard_normal(lead) * 30,
+            np.sin(2 * np.pi * 220 * t) * 8000,
+            rng.standard_normal(int(sample_rate * trail_seconds)) * 30,
+        ]
+    ).astype(np.int16)
+    for i in range(0, len(samples), chunk):
+        yield np.repeat(samples[i : i + chunk], channels), i <= lead + speech < i + chunk
+
+
+class EndOfScript(Exception):
+    pass
+
+
+# sr.Microphone の代わり。ターンごとに発話を1つ返し、返答を再生し終わるまでは無音を返す
+# 読む側を待たせないので、VADや認識は実時間より速く進む
+class ScriptedMicrophone:
+    SAMPLE_RATE = 16000
+    CHUNK = int(SAMPLE_RATE * chunk_seconds)
+
+    def __init__(self, texts, timer, stt, busy):
+        self.stream = self
+        self.__texts = deque(texts)
+        self.__timer = timer
+        self.__stt = stt
+        self.__busy = busy
+        self.__chunks = deque()
+        self.__silence = bytes(self.CHUNK * 2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def read(self, size):
+        if not self.__chunks:
+            if self.__busy():
+                time.sleep(0.001)
+                return self.__silence
+            self.__timer.end()
+            if not self.__texts:
+                raise EndOfScript()
+            self.__stt.text = self.__texts.popleft()
+            self.__chunks.extend(utterance_chunks(self.__stt.text, self.SAMPLE_RATE, 1, self.CHUNK))
+        chunk, end_of_speech = self.__chunks.popleft()
+        if end_of_speech:
+            self.__timer.begin()
+        return chunk.tobytes()
+
+
+# streamlit-webrtc のフレーム（av.AudioFrame）の代わり。ブラウザと同じ 48kHz ステレオ
+class ScriptedFrame:
+    def __init__(self, samples, sample_rate, channels):
+        self.samples = samples
+        self.sample_rate = sample_rate
+        self.layout = SimpleNamespace(channels=[None] * channels)
+
+    def to_ndarray(self):
+        return self.samples.reshape(1, -1)
+
+
+# streamlit-webrtc の audio_receiver の代わり。話し終わったフレームを渡すところでターンを始める
+class ScriptedReceiver:
+    sample_rate = 48000
+    channels = 2
+    batch = 10
+
+    def __init__(self, timer):
+        self.__timer = timer
+        self.__frames = queue.Queue()
+
+    def say(self, text):
+        chunk = int(self.sample_rate * chunk_seconds)
+        for samples, end_of_speech in utterance_chunks(text, self.sample_rate, self.channels, chunk):
+            self.__frames.put((ScriptedFrame(samples, self.sample_rate, self.channels), end_of_speech))
+
+    def get_frames(self, timeout=None):
+        frames = [self.__frames.get(timeout=timeout)]
+        while len(frames) < self.batch and not self.__frames.empty():
+            frames.append(self.__frames.get_nowait())
+        if any(end_of_speech for _, end_of_speech in frames):
+            self.__timer.begin()
+        return [frame for frame, _ in frames]
+
+
+# Streamlitの実行環境なしで WebRTCRecorder を動かすための st の代わり
+class HeadlessStreamlit:
+    def __init__(self, session_state):
+        self.session_state = session_state
+
+    # info, warning, image など描画するだけのものは何もしない
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self
+
+    # WebRTCRecorder は失敗を画面に出して続けるので、ここで止める
+    def error(self, message, *args, **kwargs):
+        raise RuntimeError(message)
+
+
+# STT・LLM・TTSをローカルの代役に差し替えて、speaker.py / michat.py / WebRTCRecorder をそのまま動かす
+# 各段の時間はテレメトリのSpanから取り、ターンは話し終わり（speaker は生成の呼び出し）から数える
+class Benchmark:
+    scenarios = ("speaker", "michat", "webrtc")
+
+    def __init__(
+        self,
+        scenario="webrtc",
+        turns=20,
+        warmup=2,
+        stream=True,
+        stt_latency=0.3,
+        llm_latency=0.5,
+        chunk_delay=0.02,
+        tts_latency=0.1,
+        tts_per_char=0.005,
+        voicevox=False,
+        llm_backend="openai",
+        speaker_id=3,
+        system_text="あなたはずんだもんです。",
+        inputs=default_inputs,
+        trace_memory=True,
+    ):
+        if scenario not in self.scenarios:
+            raise ValueError(
+                "{} is not a valid scenario: {}".format(scenario, ", ".join(self.scenarios))
+            )
+        self.scenario = scenario
+        self.turns = turns
+        self.warmup = warmup
+        self.stream = stream
+        self.stt_latency = stt_latency
+        self.llm_latency = llm_latency
+        self.chunk_delay = chunk_delay
+        self.tts_latency = tts_latency
+        self.tts_per_char = tts_per_char
+        self.voicevox = voicevox
+        self.llm_backend = llm_backend
+        self.speaker_id = speaker_id
+        self.system_text = system_text
+        self.inputs = list(inputs)
+        self.trace_memory = trace_memory
+
+    @property
+    def config(self):
+        return {
+            "scenario": self.scenario,
+            "turns": self.turns,
+            "warmup": self.warmup,
+            "stream": self.stream,
+            "stt_latency": self.stt_latency,
+            "llm_latency": self.llm_latency,
+            "chunk_delay": self.chunk_delay,
+            "tts_latency": None if self.voicevox else self.tts_latency,
+            "tts_per_char": None if self.voicevox else self.tts_per_char,
+            "voicevox": self.voicevox,
+            "llm_backend": self.llm_backend,
+        }
+
+    @property
+    def emotion(self):
+        return self.scenario in ("speaker", "webrtc")
+
+    @property
+    def texts(self):
+        return [self.inputs[i % len(self.inputs)] for i in range(self.warmup + self.turns)]
+
+    def __setup(self, server, workdir):
+        speak = lib_module("speak")
+        stub = lib_module("stub")
+        transcript = lib_module("transcript")
+        timer = self.timer = TurnTimer(self.trace_memory)
+        llm = self.llm = speak.get_llm_backend(self.llm_backend, api_key="bench", api_base=server.url)
+        pool = speak.get_engine_pool() if self.voicevox else stub.FakeEngine(self.tts_latency, self.tts_per_char)
+        self.stt = transcript.get_backend("stub", delay=self.stt_latency)
+
+        # 毎回APIを叩く経路を測るので、応答と音声のキャッシュは使わない
+        def chat(cls):
+            return lambda max_token_size, *args, **kwargs: cls(max_token_size, completion_cache=False, backend=llm)
+
+        class Player(speak.Player):
+            def play(self, wav, utterance=None):
+                timer.play()
+                return super().play(wav, utterance)
+
+        self.chat = chat
+        self.audio = lambda speaker_id, *args, **kwargs: speak.Audio(speaker_id, pool=pool, cache=False)
+        self.player = Player
+        system_file = workdir / "system.txt"
+        system_file.write_text(self.system_text)
+        self.args = ["--file-system", system_file, "--llm-backend", self.llm_backend]
+        self.args += ["-s", self.speaker_id, "--sink", "null", "--no-warmup", "-l", "WARNING"]
+        if self.stream:
+            self.args.append("--stream")
+
+    # speaker.py: 入力ファイルを順に生成・合成・再生する。ターンは生成を呼んでから次の生成を呼ぶまで
+    def run_speaker(self, workdir):
+        speaker = entry_point("speaker")
+        speak = lib_module("speak")
+        timer = self.timer
+
+        class ChatGPTWithEmotion(speak.ChatGPTWithEmotion):
+            def generate(self, *args, **kwargs):
+                timer.begin()
+                return super().generate(*args, **kwargs)
+
+            def generate_stream(self, *args, **kwargs):
+                timer.begin()
+                return super().generate_stream(*args, **kwargs)
+
+        files = []
+        for i, text in enumerate(self.texts):
+            files.append(workdir / "input{}.txt".format(i))
+            files[-1].write_text(text)
+        args = ["--files", ",".join(str(f) for f in files)] + self.args
+        chat = self.chat(ChatGPTWithEmotion)
+        with patched(speaker, ChatGPTWithEmotion=chat, Audio=self.audio, Player=self.player):
+            with command_line("speaker", args):
+                speaker.main()
+        timer.end()
+
+    # michat.py: マイクの代わりに発話を流し、VAD・認識・生成・合成・再生を通す
+    def run_michat(self, workdir):
+        michat = entry_point("michat")
+        speak = lib_module("speak")
+        transcript = lib_module("transcript")
+        players = []
+
+        def player(sink=None):
+            players.append(self.player(sink))
+            return players[-1]
+
+        microphone = ScriptedMicrophone(self.texts, self.timer, self.stt, lambda: players[-1].busy)
+
+        def transcriber(vad=None, backend=None, **kwargs):
+            ts = transcript.VoiceTranscriber(vad, self.stt, **kwargs)
+            ts.default_input = lambda: microphone
+            return ts
+
+        args = ["--vad", "-b", "stub"] + self.args
+        values = dict(ChatGPT=self.chat(speak.ChatGPT), Audio=self.audio, Player=player, VoiceTranscriber=transcriber)
+        try:
+            with patched(michat, **values), command_line("michat", args):
+                michat.main()
+        except EndOfScript:
+            pass
+        finally:
+            for p in players:
+                p.close()
+
+    # WebRTCRecorder: ブラウザと同じフレームを受信スレッドに流し、listen() と generate() をそのまま呼ぶ
+    def run_webrtc(self, workdir):
+        app = entry_point("app")
+        speak = lib_module("speak")
+        transcript = lib_module("transcript")
+        receiver = ScriptedReceiver(self.timer)
+        ingestor = transcript.FrameIngestor()
+        store = speak.ConversationStore(":memory:")
+        server = speak.AudioServer(host="127.0.0.1", port=0, base_url=None).start()
+        session_state = {
+            app.INGESTOR: ingestor,
+            app.SESSION_ID: "bench",
+            app.GENERATED_INDEX: None,
+            app.READ_INDEX: None,
+            app.SPEECH: None,
+            app.EMOTIONS: None,
+        }
+        ctx = SimpleNamespace(state=SimpleNamespace(playing=True), audio_receiver=receiver)
+        values = dict(
+            st=HeadlessStreamlit(session_state),
+            webrtc_streamer=lambda **kwargs: ctx,
+            AudioTranscriber=lambda *args, **kwargs: transcript.AudioTranscriber(backend=self.stt),
+            ChatGPTWithEmotion=self.chat(speak.ChatGPTWithEmotion),
+            Audio=self.audio,
+            get_conversation_store=lambda: store,
+            get_audio_server=lambda: server,
+        )
+        try:
+            with patched(app, **values):
+                recorder = app.WebRTCRecorder()
+                for text in self.texts:
+                    self.stt.text = text
+                    receiver.say(text)
+                    utterance = recorder.listen()
+                    recorder.generate(speak.ChatGPTFeature.ZUNDAMON, self.speaker_id, utterance)
+                    speech = session_state[app.SPEECH]
+                    if isinstance(speech, str):
+                        # 配信する返答は、ブラウザが最後まで受け取るまでをターンに含める
+                        with urllib.request.urlopen(speech) as response:
+                            response.read()
+                    self.timer.end()
+        finally:
+            ingestor.stop(flush=False)
+            server.stop()
+            store.close()
+
+    def run(self):
+        stub = lib_module("stub")
+        telemetry = lib_module("telemetry")
+        reply = emotion_reply if self.emotion else plain_reply
+        with tempfile.TemporaryDirectory() as workdir:
+            workdir = Path(workdir)
+            trace = workdir / "trace.jsonl"
+            with stub.FakeOpenAIServer(reply, delay=self.chunk_delay, latency=self.llm_latency) as server:
+                self.__setup(server, workdir)
+                telemetry.enable(trace)
+                if self.trace_memory:
+                    tracemalloc.start()
+                try:
+                    getattr(self, "run_" + self.scenario)(workdir)
+                finally:
+                    if self.trace_memory:
+                        tracemalloc.stop()
+                    telemetry.disable()
+                    self.llm.close()
+            spans = [json.loads(line) for line in trace.read_text().splitlines()]
+
+        windows = self.timer.windows
+        if len(windows) != len(self.texts):
+            raise RuntimeError("{} turns expected, {} measured".format(len(self.texts), len(windows)))
+        # 再生のSpanは、再生に回した順に1つずつ書かれる
+        playbacks = [[] for _ in windows]
+        played = sorted((s for s in spans if s["name"] == "playback"), key=lambda s: s["start"])
+        for turn, s in zip(self.timer.playbacks, played):
+            if turn is not None:
+                playbacks[turn].append(s)
+        samples = []
+        for i, window in enumerate(windows):
+            sample = turn_sample(window, spans, playbacks[i])
+            logger.debug("turn {}: {}".format(i, sample))
+            if i >= self.warmup:
+                samples.append(sample)
+
+        summary = {}
+        for name in metrics:
+            values = [s[name] for s in samples if name in s]
+            if values:
+                summary[name] = percentiles(values)
+        stages = {}
+        for name in sorted({name for s in samples for name in s["stages"]}):
+            stages[name] = percentiles([s["stages"].get(name, 0.0) for s in samples])
+        return {
+            "created": datetime.datetime.now().isoformat(timespec="seconds"),
+            "environment": {"python": platform.python_version(), "platform": platform.platform()},
+            "config": self.config,
+            "summary": summary,
+            "stages": stages,
+            "turns": samples,
+        }
+
+
+# 基準の結果より遅く（大きく）なった指標を返す
+def compare(result, baseline, tolerance=0.1, keys=("p50", "p95")):
+    regressions = []
+    for name, current in result["summary"].items():
+        previous = baseline.get("summary", {}).get(name)
+        if previous is None:
+            continue
+        for key in keys:
+            if key in current and key in previous and current[key] > previous[key] * (1 + tolerance):
+                regressions.append((name, key, previous[key], current[key]))
+    return regressions
+
+
+def format_summary(result):
+    units = {"memory": "KiB"}
+    lines = ["{:<12} {:>9} {:>9} {:>9} {:>9} {:>9}".format("metric", "p50", "p90", "p95", "p99", "max")]
+    rows = list(result["summary"].items())
+    rows += [("  " + name, values) for name, values in result.get("stages", {}).items()]
+    for name, values in rows:
+        lines.append(
+            "{:<12} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f} {}".format(
+                name,
+                values["p50"],
+                values["p90"],
+                values["p95"],
+                values["p99"],
+                values["max"],
+                units.get(name, "s"),
+            )
+        )
+    return "\n".join(lines)
@@ -1 +1,37 @@
-from .speak import Audio, ChatGPT, ChatGPTWithEmotion, ChatGPTFeature, setup_log, system_text
+from ..startup import lazy_exports
+
+# 使う部分だけを読み込む（openai, voicevox_core などは各モジュールでさらに遅延させている）
+__getattr__, __all__ = lazy_exports(
+    __name__,
+    {
+        ".speak": ["Audio", "ChatGPT", "ChatGPTWithEmotion", "ChatGPTFeature", "setup_log", "system_text"],
+        ".engine": ["EnginePool", "get_engine_pool"],
+        ".stream": [
+            "ChatStream",
+            "EmotionChatStream",
+            "EmotionParser",
+            "prefetch",
+            "split_sentences",
+            "synthesize_stream",
+        ],
+        ".wav": ["concat_wav", "wav_duration", "wav_stream_header"],
+        ".workers": ["PendingQuery", "SynthesisWorkerPool", "get_tts_pool"],
+        ".playback": ["DeviceSink", "NullSink", "Player", "RecordingSink", "get_player", "sink_names"],
+        ".warmup": ["load_manifest", "warm_up"],
+        ".delivery": ["AudioServer", "AudioStream", "delivery_available", "encode", "encoder_available", "get_audio_server"],
+        ".cache": ["CompletionCache", "TTSCache", "get_completion_cache", "get_tts_cache"],
+        ".pipeline": ["BatchPipeline", "numbered_path"],
+        ".history": ["HistoryManager", "count_tokens", "extractive_summary"],
+        ".conversation": ["ConversationStore", "Turn", "get_conversation_store"],
+        ".prompt": ["PromptRegistry", "get_prompt_registry"],
+        ".backend": [
+            "AsyncHTTPBackend",
+            "LLMBackend",
+            "LLMRequestError",
+            "OpenAIBackend",
+            "get_llm_backend",
+            "llm_backend_names",
+            "register_llm_backend",
+        ],
+    },
+)
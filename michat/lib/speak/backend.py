@@ -0,0 +1,328 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from abc import ABCMeta, abstractmethod
+
+from ..startup import lazy_import
+
+aiohttp = lazy_import("aiohttp")
+openai = lazy_import("openai")
+
+default_api_base = "https://api.openai.com/v1"
+# 1回の生成にかける時間の上限（秒）とリトライ回数。どのバックエンドでも同じ既定値を使う
+request_timeout = 30.0
+request_retries = 2
+request_backoff = 0.5
+retry_statuses = {408, 409, 429, 500, 502, 503, 504}
+
+logger = logging.getLogger(__name__)
+
+_backends = {}
+
+
+def register_llm_backend(name):
+    def register(cls):
+        _backends[name] = cls
+        return cls
+
+    return register
+
+
+def llm_backend_names():
+    return sorted(_backends.keys())
+
+
+def get_llm_backend(name, **kwargs):
+    if name not in _backends:
+        raise ValueError(
+            "{} is not a valid LLM backend: {}".format(name, ", ".join(llm_backend_names()))
+        )
+    return _backends[name](**kwargs)
+
+
+class LLMRequestError(Exception):
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+# ChatCompletionのリクエスト(dict)を受け取り、テキストを返すバックエンド
+class LLMBackend(metaclass=ABCMeta):
+    @abstractmethod
+    def complete(self, payload, timeout=None):
+        pass
+
+    # 生成されたテキストの差分を届いた順に返す
+    @abstractmethod
+    def stream(self, payload, timeout=None):
+        pass
+
+    def close(self):
+        pass
+
+
+# openaiパッケージをそのまま使う。api_keyはリクエストごとに渡す
+# 期限までは、429/5xxや接続エラーをジッター付きで待ってリトライする（ストリームは最初の差分が届くまで）
+@register_llm_backend("openai")
+class OpenAIBackend(LLMBackend):
+    def __init__(
+        self,
+        api_key=None,
+        api_base=None,
+        timeout=request_timeout,
+        retries=request_retries,
+        backoff=request_backoff,
+    ):
+        self.api_key = api_key
+        self.api_base = api_base
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.requests = 0
+        self.retried = 0
+
+    @property
+    def stats(self):
+        return {"requests": self.requests, "retried": self.retried}
+
+    def options(self, timeout=None):
+        options = {
+            "api_key": self.api_key,
+            "api_base": self.api_base,
+            "request_timeout": timeout,
+        }
+        return {k: v for k, v in options.items() if v is not None}
+
+    @classmethod
+    def retryable(cls, error):
+        if isinstance(error, (openai.error.Timeout, openai.error.APIConnectionError, openai.error.TryAgain)):
+            return True
+        return isinstance(error, openai.error.OpenAIError) and error.http_status in retry_statuses
+
+    # 残り時間を1回ごとのタイムアウトにして、期限を過ぎるリトライはしない
+    def __with_retries(self, request, timeout=None):
+        timeout = timeout or self.timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for attempt in range(self.retries + 1):
+            remaining = None if deadline is None else deadline - time.monotonic()
+            try:
+                self.requests += 1
+                return request(remaining)
+            except Exception as e:
+                delay = random.uniform(0, self.backoff * 2**attempt)
+                if attempt == self.retries or not self.retryable(e):
+                    raise
+                if deadline is not None and time.monotonic() + delay >= deadline:
+                    raise
+                logger.warning("retrying LLM request in {:.2f}s: {!r}".format(delay, e))
+                self.retried += 1
+                time.sleep(delay)
+
+    def complete(self, payload, timeout=None):
+        response = self.__with_retries(
+            lambda remaining: openai.ChatCompletion.create(**payload, **self.options(remaining)), timeout
+        )
+        return response.choices[0].message.content
+
+    def __open(self, payload, remaining):
+        response = openai.ChatCompletion.create(**payload, stream=True, **self.options(remaining))
+        # 最初のチャンクが届くまでをリトライの対象にする
+        chunks = iter(response)
+        first = next(chunks, None)
+        return first, chunks
+
+    def stream(self, payload, timeout=None):
+        first, chunks = self.__with_retries(lambda remaining: self.__open(payload, remaining), timeout)
+        if first is None:
+            return
+        for chunk in itertools.chain([first], chunks):
+            delta = chunk["choices"][0]["delta"].get("content")
+            if delta:
+                yield delta
+
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+# 非同期バックエンドが共有するイベントループ（専用スレッドで回す）
+def event_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="llm-loop", daemon=True).start()
+    return _loop
+
+
+# keep-aliveの接続プールを使うaiohttpクライアント。期限・ジッター付きリトライ・ヘッジに対応
+@register_llm_backend("async")
+class AsyncHTTPBackend(LLMBackend):
+    def __init__(
+        self,
+        api_key=None,
+        api_base=None,
+        timeout=request_timeout,
+        retries=request_retries,
+        backoff=request_backoff,
+        hedge_after=None,
+        pool_size=32,
+        keepalive=30.0,
+    ):
+        self.api_key = api_key
+        self.api_base = (api_base or os.environ.get("OPENAI_API_BASE") or default_api_base).rstrip("/")
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        # 最初のリクエストがこの秒数で返らなければ同じリクエストをもう1本投げる
+        self.hedge_after = hedge_after
+        self.pool_size = pool_size
+        self.keepalive = keepalive
+        self.requests = 0
+        self.retried = 0
+        self.hedged = 0
+        self.__session = None
+
+    @property
+    def stats(self):
+        return {"requests": self.requests, "retried": self.retried, "hedged": self.hedged}
+
+    @property
+    def url(self):
+        return self.api_base + "/chat/completions"
+
+    async def __session_for_loop(self):
+        if self.__session is None or self.__session.closed:
+            headers = {}
+            if self.api_key:
+                headers["Authorization"] = "Bearer {}".format(self.api_key)
+            self.__session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.pool_size, keepalive_timeout=self.keepalive
+                ),
+                headers=headers,
+                timeout=aiohttp.ClientTimeout(total=None, sock_read=self.timeout),
+            )
+        return self.__session
+
+    @classmethod
+    def retryable(cls, error):
+        if isinstance(error, LLMRequestError):
+            return error.status in retry_statuses
+        return isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError))
+
+    async def __open(self, payload):
+        session = await self.__session_for_loop()
+        self.requests += 1
+        response = await session.post(self.url, json=payload)
+        if response.status != 200:
+            message = await response.text()
+            response.release()
+            raise LLMRequestError(message, response.status)
+        return response
+
+    async def __post(self, payload):
+        response = await self.__open(payload)
+        async with response:
+            body = await response.json(content_type=None)
+        return body["choices"][0]["message"]["content"]
+
+    async def __hedged(self, request):
+        first = asyncio.ensure_future(request())
+        if self.hedge_after is None:
+            return await first
+        done, _ = await asyncio.wait({first}, timeout=self.hedge_after)
+        if done:
+            return first.result()
+        self.hedged += 1
+        pending = {first, asyncio.ensure_future(request())}
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            winners = [task for task in done if task.exception() is None]
+            if winners:
+                for other in pending:
+                    other.cancel()
+                # 同時に返ってきた側のレスポンスは閉じておく
+                for other in winners[1:]:
+                    release = getattr(other.result(), "release", None)
+                    if release is not None:
+                        release()
+                return winners[0].result()
+            error = next(iter(done)).exception()
+        raise error
+
+    async def __with_retries(self, request):
+        for attempt in range(self.retries + 1):
+            try:
+                return await self.__hedged(request)
+            except Exception as e:
+                if attempt == self.retries or not self.retryable(e):
+                    raise
+                # full jitter
+                delay = random.uniform(0, self.backoff * 2**attempt)
+                logger.warning("retrying LLM request in {:.2f}s: {!r}".format(delay, e))
+                self.retried += 1
+                await asyncio.sleep(delay)
+
+    async def acomplete(self, payload, timeout=None):
+        return await asyncio.wait_for(
+            self.__with_retries(lambda: self.__post(payload)), timeout or self.timeout
+        )
+
+    def complete(self, payload, timeout=None):
+        future = asyncio.run_coroutine_threadsafe(self.acomplete(payload, timeout), event_loop())
+        return future.result()
+
+    # ヘッダが届くまではリトライ・ヘッジし、本文はSSEを読みながら返す
+    async def astream(self, payload, timeout=None):
+        payload = dict(payload, stream=True)
+        response = await asyncio.wait_for(
+            self.__with_retries(lambda: self.__open(payload)), timeout or self.timeout
+        )
+        async with response:
+            async for line in response.content:
+                line = line.strip()
+                if not line.startswith(b"data:"):
+                    continue
+                data = line[len(b"data:") :].strip()
+                if data == b"[DONE]":
+                    break
+                delta = json.loads(data)["choices"][0]["delta"].get("content")
+                if delta:
+                    yield delta
+
+    def stream(self, payload, timeout=None):
+        deltas = queue.Queue()
+        end = object()
+
+        async def pump():
+            try:
+                async for delta in self.astream(payload, timeout):
+                    deltas.put((delta, None))
+            except Exception as e:
+                deltas.put((None, e))
+            finally:
+                deltas.put((end, None))
+
+        future = asyncio.run_coroutine_threadsafe(pump(), event_loop())
+        try:
+            while True:
+                delta, error = deltas.get()
+                if error is not None:
+                    raise error
+                if delta is end:
+                    return
+                yield delta
+        finally:
+            future.cancel()
+
+    def close(self):
+        if self.__session is not None and not self.__session.closed:
+            asyncio.run_coroutine_threadsafe(self.__session.close(), event_loop()).result()
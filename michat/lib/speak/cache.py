@@ -0,0 +1,282 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+
+cache_root = Path(".cache/tts")
+memory_entries = 128
+disk_limit_bytes = 256 * 1024 * 1024
+completion_db = Path(".cache/completions.sqlite3")
+completion_entries = 256
+completion_rows = 10000
+completion_ttl = 7 * 24 * 60 * 60
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text):
+    text = unicodedata.normalize("NFKC", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+# 合成済み音声のキャッシュ（メモリ上のLRUとディスク）
+class TTSCache:
+    def __init__(self, root=cache_root, memory_size=memory_entries, disk_limit=disk_limit_bytes):
+        self.__memory = OrderedDict()
+        self.__memory_size = memory_size
+        self.__disk_limit = disk_limit
+        self.__lock = threading.Lock()
+        self.hits = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.root = None if root is None else Path(root)
+        self.__disk_usage = 0
+        if self.root is not None:
+            self.root.mkdir(parents=True, exist_ok=True)
+            self.__disk_usage = sum(p.stat().st_size for p in self.root.glob("*/*.wav"))
+
+    @property
+    def stats(self):
+        with self.__lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "memory_entries": len(self.__memory),
+                "disk_bytes": self.__disk_usage,
+            }
+
+    @classmethod
+    def key(cls, text, speaker_id, params=None):
+        source = json.dumps(
+            {
+                "text": normalize_text(text),
+                "speaker_id": int(speaker_id),
+                "params": params or {},
+            },
+            ensure_ascii=False,
+            sort_keys=True,
+        )
+        return hashlib.sha256(source.encode()).hexdigest()
+
+    def path(self, key):
+        return self.root / key[:2] / "{}.wav".format(key)
+
+    def __remember(self, key, wav):
+        if self.__memory_size <= 0:
+            return
+        self.__memory[key] = wav
+        self.__memory.move_to_end(key)
+        while len(self.__memory) > self.__memory_size:
+            self.__memory.popitem(last=False)
+
+    def get(self, key):
+        with self.__lock:
+            wav = self.__memory.get(key)
+            if wav is not None:
+                self.__memory.move_to_end(key)
+                self.hits += 1
+                self.memory_hits += 1
+                return wav
+        wav = self.__read(key)
+        with self.__lock:
+            if wav is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+            self.__remember(key, wav)
+            return wav
+
+    def __read(self, key):
+        if self.root is None:
+            return None
+        path = self.path(key)
+        try:
+            wav = path.read_bytes()
+            # ディスク側はmtimeで古いものから消すので、読んだら更新する
+            os.utime(path)
+            return wav
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, wav):
+        with self.__lock:
+            self.__remember(key, wav)
+        if self.root is None or len(wav) > self.__disk_limit:
+            return
+        path = self.path(key)
+        path.parent.mkdir(exist_ok=True)
+        # 合成ワーカーのプロセスとも同じディレクトリを使うので、一時ファイルは mkstemp で作る
+        fd, tmp = tempfile.mkstemp(suffix=".tmp", prefix=path.stem + ".", dir=path.parent)
+        with os.fdopen(fd, "wb") as f:
+            f.write(wav)
+        with self.__lock:
+            old_size = path.stat().st_size if path.exists() else 0
+            os.replace(tmp, path)
+            self.__disk_usage += len(wav) - old_size
+            if self.__disk_usage > self.__disk_limit:
+                self.__evict()
+
+    def __evict(self):
+        files = sorted(self.root.glob("*/*.wav"), key=lambda p: p.stat().st_mtime)
+        for path in files:
+            if self.__disk_usage <= self.__disk_limit:
+                break
+            size = path.stat().st_size
+            path.unlink()
+            self.__disk_usage -= size
+            logger.debug("evicted tts cache: {}".format(path.name))
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_tts_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = TTSCache()
+    return _cache
+
+
+# ChatGPTの応答キャッシュ（TTL付きのメモリLRUとSQLite）
+class CompletionCache:
+    def __init__(
+        self,
+        path=completion_db,
+        memory_size=completion_entries,
+        max_rows=completion_rows,
+        ttl=completion_ttl,
+    ):
+        self.__memory = OrderedDict()
+        self.__memory_size = memory_size
+        self.max_rows = max_rows
+        self.ttl = ttl
+        self.__lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self.__db = None
+        if path is not None:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            self.__db = sqlite3.connect(str(path), check_same_thread=False)
+            self.__db.execute(
+                "CREATE TABLE IF NOT EXISTS completions ("
+                "key TEXT PRIMARY KEY, text TEXT, latency REAL, created REAL, accessed REAL)"
+            )
+            self.__db.execute(
+                "CREATE INDEX IF NOT EXISTS completions_accessed ON completions (accessed)"
+            )
+            self.__db.commit()
+
+    @classmethod
+    def key(cls, model, temperature, max_tokens, messages):
+        source = json.dumps(
+            {
+                "model": model,
+                "temperature": temperature,
+                "max_tokens": int(max_tokens),
+                "messages": messages,
+            },
+            ensure_ascii=False,
+            sort_keys=True,
+        )
+        return hashlib.sha256(source.encode()).hexdigest()
+
+    @property
+    def stats(self):
+        with self.__lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "saved_seconds": self.saved_seconds,
+            }
+
+    def __remember(self, key, entry):
+        if self.__memory_size <= 0:
+            return
+        self.__memory[key] = entry
+        self.__memory.move_to_end(key)
+        while len(self.__memory) > self.__memory_size:
+            self.__memory.popitem(last=False)
+
+    def __lookup(self, key, now):
+        entry = self.__memory.get(key)
+        if entry is not None:
+            self.__memory.move_to_end(key)
+            return entry
+        if self.__db is None:
+            return None
+        row = self.__db.execute(
+            "SELECT text, latency, created FROM completions WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        self.__db.execute("UPDATE completions SET accessed = ? WHERE key = ?", (now, key))
+        self.__db.commit()
+        self.__remember(key, row)
+        return row
+
+    def get(self, key):
+        now = time.time()
+        with self.__lock:
+            entry = self.__lookup(key, now)
+            if entry is not None and now - entry[2] > self.ttl:
+                self.__memory.pop(key, None)
+                if self.__db is not None:
+                    self.__db.execute("DELETE FROM completions WHERE key = ?", (key,))
+                    self.__db.commit()
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.saved_seconds += entry[1]
+            return entry[0]
+
+    # latencyはAPIにかかった時間。ヒットしたときに節約できた時間として数える
+    def put(self, key, text, latency=0.0):
+        now = time.time()
+        with self.__lock:
+            self.__remember(key, (text, latency, now))
+            if self.__db is None:
+                return
+            self.__db.execute(
+                "INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?, ?)",
+                (key, text, latency, now, now),
+            )
+            self.__db.execute(
+                "DELETE FROM completions WHERE key IN ("
+                "SELECT key FROM completions ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_rows,),
+            )
+            self.__db.commit()
+
+
+_completion_cache = None
+
+
+def get_completion_cache():
+    global _completion_cache
+    if _completion_cache is None:
+        with _cache_lock:
+            if _completion_cache is None:
+                _completion_cache = CompletionCache()
+    return _completion_cache
@@ -0,0 +1,103 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from pathlib import Path
+
+conversation_db = Path(".cache/conversations.sqlite3")
+page_size = 20
+
+Turn = namedtuple("Turn", ["turn", "user_text", "bot_text", "emotions", "created"])
+
+
+# 会話の保存先（SQLite, WALモード）。発言は追記のみで、読むときはページ単位
+class ConversationStore:
+    def __init__(self, path=conversation_db):
+        if str(path) != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.__lock = threading.Lock()
+        self.__db = sqlite3.connect(str(path), check_same_thread=False)
+        self.__db.execute("PRAGMA journal_mode=WAL")
+        self.__db.execute("PRAGMA synchronous=NORMAL")
+        self.__db.execute(
+            "CREATE TABLE IF NOT EXISTS turns ("
+            "session TEXT, turn INTEGER, user_text TEXT, bot_text TEXT, emotions TEXT, created REAL, "
+            "PRIMARY KEY (session, turn))"
+        )
+        # ChatGPTに渡す（要約済みの）履歴はセッションごとに最新の1つだけ持つ
+        self.__db.execute(
+            "CREATE TABLE IF NOT EXISTS histories (session TEXT PRIMARY KEY, history TEXT, updated REAL)"
+        )
+        self.__db.commit()
+
+    def append(self, session, user_text, bot_text, emotions=None, history=None):
+        now = time.time()
+        with self.__lock, self.__db:
+            (last,) = self.__db.execute(
+                "SELECT COALESCE(MAX(turn), 0) FROM turns WHERE session = ?", (session,)
+            ).fetchone()
+            turn = last + 1
+            self.__db.execute(
+                "INSERT INTO turns VALUES (?, ?, ?, ?, ?, ?)",
+                (session, turn, user_text, bot_text, json.dumps(emotions, ensure_ascii=False), now),
+            )
+            if history is not None:
+                self.__db.execute(
+                    "INSERT OR REPLACE INTO histories VALUES (?, ?, ?)",
+                    (session, json.dumps(history, ensure_ascii=False), now),
+                )
+        return turn
+
+    @classmethod
+    def __turn(cls, row):
+        turn, user_text, bot_text, emotions, created = row
+        return Turn(turn, user_text, bot_text, json.loads(emotions), created)
+
+    # before より前の発言を新しい方から limit 件、古い順に並べて返す
+    def turns(self, session, limit=page_size, before=None):
+        query = "SELECT turn, user_text, bot_text, emotions, created FROM turns WHERE session = ?"
+        args = [session]
+        if before is not None:
+            query += " AND turn < ?"
+            args.append(before)
+        query += " ORDER BY turn DESC LIMIT ?"
+        args.append(limit)
+        with self.__lock:
+            rows = self.__db.execute(query, args).fetchall()
+        return [self.__turn(row) for row in reversed(rows)]
+
+    def latest(self, session):
+        turns = self.turns(session, limit=1)
+        return turns[0] if turns else None
+
+    def count(self, session):
+        with self.__lock:
+            (n,) = self.__db.execute(
+                "SELECT COUNT(*) FROM turns WHERE session = ?", (session,)
+            ).fetchone()
+        return n
+
+    def history(self, session):
+        with self.__lock:
+            row = self.__db.execute(
+                "SELECT history FROM histories WHERE session = ?", (session,)
+            ).fetchone()
+        return [] if row is None else json.loads(row[0])
+
+    def close(self):
+        with self.__lock:
+            self.__db.close()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_conversation_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ConversationStore()
+    return _store
@@ -0,0 +1,315 @@
+import io
+import logging
+import os
+import re
+import shutil
+import subprocess
+import threading
+import uuid
+import wave
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .stream import synthesize_stream
+from .wav import concat_wav
+
+audio_format = os.environ.get("MICHAT_AUDIO_FORMAT", "ogg")
+audio_bitrate = os.environ.get("MICHAT_AUDIO_BITRATE", "32k")
+audio_host = os.environ.get("MICHAT_AUDIO_HOST", "0.0.0.0")
+audio_port = int(os.environ.get("MICHAT_AUDIO_PORT", 8502))
+# ブラウザから見たURL（リバースプロキシの後ろなどで変える）。https で配信するアプリでは https のURLにする
+audio_base_url = os.environ.get("MICHAT_AUDIO_BASE_URL")
+# MICHAT_AUDIO_BASE_URL がなくても、リクエストから分かるブラウザの接続先が同じマシンなら localhost で届く
+local_hosts = ("localhost", "127.0.0.1", "::1")
+max_streams = 16
+chunk_size = 4096
+
+# format: (ffmpegのコーデック, コンテナ, Content-Type)
+formats = {
+    "ogg": ("libopus", "ogg", "audio/ogg"),
+    "mp3": ("libmp3lame", "mp3", "audio/mpeg"),
+}
+
+logger = logging.getLogger(__name__)
+
+
+def encoder_available():
+    return shutil.which("ffmpeg") is not None
+
+
+# 配信サーバのURLにブラウザから届くと分かっているときだけ配信する（それ以外はWAVで返す）
+# browser_host はブラウザが実際にアクセスしてきたホスト。分からなければ None（設定値の browser.serverAddress は使えない）
+def delivery_available(browser_host=None, base_url=audio_base_url):
+    if not encoder_available():
+        return False
+    return base_url is not None or browser_host in local_hosts
+
+
+def encoder_command(format, bitrate, sample_rate, channels=1):
+    if format not in formats:
+        raise ValueError("{} is not a valid audio format: {}".format(format, ", ".join(formats)))
+    codec, container, _ = formats[format]
+    source = ["-f", "s16le", "-ar", str(sample_rate), "-ac", str(channels), "-i", "pipe:0"]
+    output = ["-c:a", codec, "-b:a", bitrate, "-flush_packets", "1", "-f", container, "pipe:1"]
+    return ["ffmpeg", "-hide_banner", "-loglevel", "error"] + source + output
+
+
+def read_pcm(wav):
+    with wave.open(io.BytesIO(wav), "rb") as reader:
+        return reader.readframes(reader.getnframes()), reader.getframerate(), reader.getnchannels()
+
+
+# 1つの返答の音声。文ごとのWAVを受け取ってエンコーダに流し、できた分から配信する
+# エンコーダが失敗したら、受け取ったWAVをつなげて返せるように残しておく
+class AudioStream:
+    def __init__(self, format=audio_format, bitrate=audio_bitrate, command=None):
+        self.id = uuid.uuid4().hex
+        self.format = format
+        self.bitrate = bitrate
+        self.content_type = formats[format][2]
+        # テストなどでエンコーダを差し替えるときは、PCMを受け取るコマンドを渡す
+        self.__command = command
+        self.__process = None
+        self.__reader = None
+        self.__chunks = []
+        self.__wavs = []
+        self.__done = False
+        self.__closed = False
+        self.__cond = threading.Condition()
+        self.bytes_in = 0
+        self.error = None
+
+    @property
+    def done(self):
+        with self.__cond:
+            return self.__done
+
+    @property
+    def failed(self):
+        return self.error is not None
+
+    @property
+    def bytes_out(self):
+        with self.__cond:
+            return sum(len(c) for c in self.__chunks)
+
+    def __start(self, sample_rate, channels):
+        command = self.__command or encoder_command(self.format, self.bitrate, sample_rate, channels)
+        self.__process = subprocess.Popen(
+            command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        )
+        self.__reader = threading.Thread(target=self.__read, name="audio-encoder", daemon=True)
+        self.__reader.start()
+
+    def __read(self):
+        try:
+            while True:
+                chunk = self.__process.stdout.read1(chunk_size)
+                if not chunk:
+                    break
+                with self.__cond:
+                    self.__chunks.append(chunk)
+                    self.__cond.notify_all()
+        finally:
+            returncode = self.__process.wait()
+            if returncode != 0 and self.error is None:
+                self.__fail("encoder exited with {}".format(returncode))
+            with self.__cond:
+                self.__done = True
+                self.__cond.notify_all()
+
+    def __fail(self, error):
+        logger.error("audio encoder failed, falling back to wav: {}".format(error))
+        self.error = str(error)
+        if self.__process is not None and self.__process.poll() is None:
+            self.__process.kill()
+
+    def write(self, wav):
+        pcm, sample_rate, channels = read_pcm(wav)
+        with self.__cond:
+            self.__wavs.append(wav)
+        self.bytes_in += len(wav)
+        if self.failed:
+            return
+        try:
+            if self.__process is None:
+                self.__start(sample_rate, channels)
+            self.__process.stdin.write(pcm)
+            self.__process.stdin.flush()
+        except OSError as e:
+            self.__fail(e)
+
+    def close(self):
+        with self.__cond:
+            self.__closed = True
+            if self.__process is None:
+                self.__done = True
+            self.__cond.notify_all()
+        if self.__process is not None and not self.__process.stdin.closed:
+            try:
+                self.__process.stdin.close()
+            except OSError as e:
+                self.__fail(e)
+
+    # 書き込みが終わるまで待って、受け取ったWAVをつなげて返す
+    def wav(self, timeout=None):
+        with self.__cond:
+            self.__cond.wait_for(lambda: self.__closed, timeout)
+            return concat_wav(self.__wavs)
+
+    # 最初のチャンクが届くか、エンコードが終わるまで待つ。エンコーダが失敗していたら False
+    def wait_first(self, timeout=None):
+        with self.__cond:
+            self.__cond.wait_for(lambda: self.__chunks or self.__done, timeout)
+        return not self.failed
+
+    # 文ごとに合成しながら書き込む（別スレッド）。sentencesが尽きたら閉じる
+    def synthesize(self, sentences, audio):
+        def run():
+            try:
+                for sentence, wav in synthesize_stream(sentences, audio):
+                    self.write(wav)
+            except Exception as e:
+                logger.error("while synthesizing a stream: {}".format(e))
+            finally:
+                self.close()
+
+        thread = threading.Thread(target=run, name="audio-synthesize", daemon=True)
+        thread.start()
+        return thread
+
+    # エンコード済みの分を先頭から返し、続きは届くのを待つ
+    def chunks(self, timeout=None):
+        i = 0
+        while True:
+            with self.__cond:
+                while i >= len(self.__chunks) and not self.__done:
+                    if not self.__cond.wait(timeout):
+                        return
+                if i >= len(self.__chunks):
+                    return
+                chunk = self.__chunks[i]
+            i += 1
+            yield chunk
+
+    def read(self, timeout=None):
+        return b"".join(self.chunks(timeout))
+
+
+def encode(wav, format=audio_format, bitrate=audio_bitrate):
+    stream = AudioStream(format, bitrate)
+    stream.write(wav)
+    stream.close()
+    return stream.read()
+
+
+# AudioStreamを /audio/<id> でチャンク転送するHTTPサーバ
+class AudioServer:
+    def __init__(self, host=audio_host, port=audio_port, base_url=audio_base_url, capacity=max_streams):
+        self.__streams = OrderedDict()
+        self.__capacity = capacity
+        self.__lock = threading.Lock()
+        self.__httpd = ThreadingHTTPServer((host, port), self.__handler())
+        self.__httpd.daemon_threads = True
+        self.__thread = None
+        self.base_url = (base_url or "http://localhost:{}".format(self.port)).rstrip("/")
+
+    @property
+    def port(self):
+        return self.__httpd.server_address[1]
+
+    def url(self, stream):
+        return "{}/audio/{}.{}".format(self.base_url, stream.id, formats[stream.format][1])
+
+    def add(self, stream):
+        with self.__lock:
+            self.__streams[stream.id] = stream
+            while len(self.__streams) > self.__capacity:
+                _, old = self.__streams.popitem(last=False)
+                old.close()
+        return stream
+
+    def get(self, id):
+        with self.__lock:
+            return self.__streams.get(id)
+
+    def open(self, format=audio_format, bitrate=audio_bitrate, command=None):
+        return self.add(AudioStream(format, bitrate, command))
+
+    def __handler(self):
+        server = self
+        path = re.compile(r"^/audio/([0-9a-f]+)\.\w+$")
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                match = path.match(self.path)
+                stream = None if match is None else server.get(match.group(1))
+                if stream is None:
+                    self.send_error(404)
+                    return
+                if not stream.wait_first():
+                    self.send_wav(stream.wav())
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", stream.content_type)
+                self.send_header("Transfer-Encoding", "chunked")
+                self.send_header("Cache-Control", "no-store")
+                self.send_header("Access-Control-Allow-Origin", "*")
+                self.end_headers()
+                try:
+                    for chunk in stream.chunks():
+                        self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                        self.wfile.flush()
+                    self.wfile.write(b"0\r\n\r\n")
+                except ConnectionError:
+                    # 再生を止められた
+                    self.close_connection = True
+
+            # エンコーダが使えなかった返答は、WAVのまま返す
+            def send_wav(self, wav):
+                self.send_response(200)
+                self.send_header("Content-Type", "audio/wav")
+                self.send_header("Content-Length", str(len(wav)))
+                self.send_header("Cache-Control", "no-store")
+                self.send_header("Access-Control-Allow-Origin", "*")
+                self.end_headers()
+                self.wfile.write(wav)
+
+        return Handler
+
+    def start(self):
+        self.__thread = threading.Thread(
+            target=self.__httpd.serve_forever, name="audio-server", daemon=True
+        )
+        self.__thread.start()
+        logger.info("serving audio on {}".format(self.base_url))
+        return self
+
+    def stop(self):
+        self.__httpd.shutdown()
+        self.__httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+# Streamlitの再実行をまたいで1つだけ起動しておく
+def get_audio_server():
+    global _server
+    if _server is None:
+        with _server_lock:
+            if _server is None:
+                _server = AudioServer().start()
+    return _server
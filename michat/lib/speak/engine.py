@@ -0,0 +1,109 @@
+import logging
+import threading
+from collections import OrderedDict
+
+from ..startup import lazy_import
+
+voicevox_core = lazy_import("voicevox_core")
+
+open_jtalk_dict_dir = "./open_jtalk_dic_utf_8-1.11"
+# AccelerationMode の名前（AUTO, CPU, GPU）
+acceleration_mode = "AUTO"
+max_loaded_models = 4
+
+logger = logging.getLogger(__name__)
+
+
+# VoicevoxCoreはプロセスで1つだけ初期化し、話者モデルはLRUで保持する
+class EnginePool:
+    def __init__(
+        self,
+        max_models=max_loaded_models,
+        acceleration_mode=acceleration_mode,
+        open_jtalk_dict_dir=open_jtalk_dict_dir,
+        cpu_num_threads=0,
+    ):
+        if max_models < 1:
+            raise ValueError("max_models must be positive: {}".format(max_models))
+        self.__max_models = max_models
+        self.__acceleration_mode = acceleration_mode
+        self.__open_jtalk_dict_dir = open_jtalk_dict_dir
+        # 0ならVOICEVOXに任せる（複数プロセスで動かすときは分け合う）
+        self.__cpu_num_threads = cpu_num_threads
+        self.__core = None
+        self.__models = OrderedDict()
+        # Streamlitのスクリプトスレッドから同時に呼ばれるのでcoreの操作は直列化する
+        self.__lock = threading.RLock()
+
+    @property
+    def max_models(self):
+        return self.__max_models
+
+    @property
+    def loaded_models(self):
+        with self.__lock:
+            return list(self.__models.keys())
+
+    def __new_core(self):
+        logger.info("initializing VoicevoxCore")
+        mode = self.__acceleration_mode
+        if isinstance(mode, str):
+            mode = getattr(voicevox_core.AccelerationMode, mode)
+        return voicevox_core.VoicevoxCore(
+            acceleration_mode=mode,
+            cpu_num_threads=self.__cpu_num_threads,
+            open_jtalk_dict_dir=self.__open_jtalk_dict_dir,
+        )
+
+    @property
+    def core(self):
+        with self.__lock:
+            if self.__core is None:
+                self.__core = self.__new_core()
+            return self.__core
+
+    def __evict(self):
+        while len(self.__models) > self.__max_models:
+            speaker_id, _ = self.__models.popitem(last=False)
+            logger.info("unloading speaker model: {}".format(speaker_id))
+            unload = getattr(self.__core, "unload_model", None)
+            if unload is not None:
+                unload(speaker_id)
+            else:
+                # 0.14系には個別のアンロードがないので、残すモデルだけで作り直す
+                self.__core = self.__new_core()
+                for retained in self.__models:
+                    self.__core.load_model(retained)
+
+    def load(self, speaker_id):
+        with self.__lock:
+            core = self.core
+            if speaker_id in self.__models:
+                self.__models.move_to_end(speaker_id)
+                return core
+            logger.info("loading speaker model: {}".format(speaker_id))
+            core.load_model(speaker_id)
+            self.__models[speaker_id] = True
+            self.__evict()
+            return self.__core
+
+    def audio_query(self, text, speaker_id):
+        with self.__lock:
+            return self.load(speaker_id).audio_query(text, speaker_id)
+
+    def synthesis(self, audio_query, speaker_id):
+        with self.__lock:
+            return self.load(speaker_id).synthesis(audio_query, speaker_id)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_engine_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = EnginePool()
+    return _pool
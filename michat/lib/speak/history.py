@@ -0,0 +1,120 @@
+import logging
+import re
+import threading
+from collections import OrderedDict
+
+prompt_token_budget = 2048
+summary_token_budget = 256
+summary_prefix = "これまでの会話の要約:\n"
+
+logger = logging.getLogger(__name__)
+
+# cl100k系のトークナイザを目安にした見積もり（かな・漢字は1文字1トークン強、英数字は4文字で1トークン程度）
+_WIDE = re.compile(r"[^\x00-\x7f]")
+_WORD = re.compile(r"[A-Za-z0-9]+")
+_MESSAGE_OVERHEAD = 4
+
+
+def count_tokens(text):
+    wide = len(_WIDE.findall(text))
+    words = _WORD.findall(text)
+    narrow = sum((len(w) + 3) // 4 for w in words)
+    symbols = len(text) - wide - sum(len(w) for w in words) - text.count(" ")
+    return int(wide * 1.2) + narrow + max(symbols, 0)
+
+
+# 古い発言を短く書き出すだけの要約（ネットワーク不要）
+def extractive_summary(summary, messages, limit=40):
+    names = {"user": "ユーザー", "assistant": "アシスタント"}
+    lines = [] if not summary else summary.splitlines()
+    for message in messages:
+        text = " ".join(message["content"].split())
+        if len(text) > limit:
+            text = text[:limit] + "…"
+        lines.append("{}: {}".format(names.get(message["role"], message["role"]), text))
+    return "\n".join(lines)
+
+
+# 会話履歴をトークン数の予算内に収め、溢れた古いターンは要約にまとめる
+class HistoryManager:
+    def __init__(
+        self,
+        budget=prompt_token_budget,
+        summary_budget=summary_token_budget,
+        counter=count_tokens,
+        summarizer=extractive_summary,
+        cache_size=1024,
+    ):
+        self.budget = budget
+        self.summary_budget = summary_budget
+        self.counter = counter
+        self.summarizer = summarizer
+        self.__cache = OrderedDict()
+        self.__cache_size = cache_size
+        self.__lock = threading.Lock()
+
+    # 発言ごとのトークン数はキャッシュして、新しい発言だけ数える
+    def count(self, text):
+        with self.__lock:
+            n = self.__cache.get(text)
+            if n is not None:
+                self.__cache.move_to_end(text)
+                return n
+        n = self.counter(text)
+        with self.__lock:
+            self.__cache[text] = n
+            while len(self.__cache) > self.__cache_size:
+                self.__cache.popitem(last=False)
+        return n
+
+    def count_message(self, message):
+        return self.count(message["content"]) + _MESSAGE_OVERHEAD
+
+    def count_messages(self, messages):
+        return sum(self.count_message(m) for m in messages)
+
+    @classmethod
+    def is_summary(cls, message):
+        return message["role"] == "system" and message["content"].startswith(summary_prefix)
+
+    def __trim_summary(self, summary):
+        lines = summary.splitlines()
+        # 予算を超えたら古い行から捨てる
+        while lines and self.count("\n".join(lines)) > self.summary_budget:
+            lines.pop(0)
+        return "\n".join(lines)
+
+    def fit(self, system_text, user_text, history):
+        if not history:
+            return []
+        summary = None
+        turns = list(history)
+        if self.is_summary(turns[0]):
+            summary = turns.pop(0)["content"][len(summary_prefix) :]
+
+        fixed = self.count(system_text) + self.count(user_text) + 2 * _MESSAGE_OVERHEAD
+        available = self.budget - fixed
+        summary_cost = 0 if summary is None else self.count(summary) + _MESSAGE_OVERHEAD
+        if self.count_messages(turns) + summary_cost <= available:
+            return history
+
+        # 新しい方から入るだけ残す（user/assistantの組を崩さない）
+        available -= self.summary_budget + _MESSAGE_OVERHEAD
+        used = 0
+        cut = len(turns)
+        for i in range(len(turns) - 1, -1, -1):
+            used += self.count_message(turns[i])
+            if used > available:
+                break
+            cut = i
+        if cut % 2 == 1:
+            cut += 1
+        if available < 0:
+            logger.warning("system and user text exceed the token budget: {}".format(fixed))
+
+        summary = self.__trim_summary(self.summarizer(summary, turns[:cut]))
+        compacted = turns[cut:]
+        logger.debug("folded {} messages into the summary".format(cut))
+        if summary:
+            compacted = [{"role": "system", "content": summary_prefix + summary}] + compacted
+        return compacted
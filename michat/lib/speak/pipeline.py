@@ -0,0 +1,193 @@
+import logging
+import queue
+import threading
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+def numbered_path(path, index):
+    path = Path(path)
+    return path.with_name("{}-{}{}".format(path.stem, index, path.suffix))
+
+
+class BatchItem:
+    def __init__(self, index, user_text):
+        self.index = index
+        self.user_text = user_text
+        self.gen_text = None
+        self.params = None
+        self.history = None
+        self.wav = None
+        self.output = None
+        self.error = None
+
+
+class StageStats:
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.errors = 0
+        self.busy = 0.0
+        self.started = None
+        self.finished = None
+        self.__lock = threading.Lock()
+
+    def record(self, elapsed, failed=False):
+        with self.__lock:
+            self.count += 1
+            self.errors += int(failed)
+            self.busy += elapsed
+            self.finished = time.perf_counter()
+
+    @property
+    def wall(self):
+        if self.started is None or self.finished is None:
+            return 0.0
+        return self.finished - self.started
+
+    @property
+    def throughput(self):
+        return self.count / self.wall if self.wall > 0 else 0.0
+
+    def __str__(self):
+        average = self.busy / self.count if self.count else 0.0
+        return "{}: {} items, {:.2f} items/s, busy {:.2f}s (avg {:.2f}s), {} errors".format(
+            self.name, self.count, self.throughput, self.busy, average, self.errors
+        )
+
+
+# 入力ごとの処理を担うスレッド群。受け取ったものを処理して次のキューへ流す
+class Stage:
+    def __init__(self, name, func, inbox, outbox, workers=1, skip_errors=True):
+        self.name = name
+        self.skip_errors = skip_errors
+        self.func = func
+        self.inbox = inbox
+        self.outbox = outbox
+        self.workers = workers
+        self.stats = StageStats(name)
+        self.__alive = workers
+        self.__lock = threading.Lock()
+        self.__threads = []
+
+    def start(self, started):
+        self.stats.started = started
+        for i in range(self.workers):
+            thread = threading.Thread(target=self.__work, name="{}-{}".format(self.name, i), daemon=True)
+            thread.start()
+            self.__threads.append(thread)
+
+    def join(self):
+        for thread in self.__threads:
+            thread.join()
+
+    def __work(self):
+        while True:
+            item = self.inbox.get()
+            if item is _STOP:
+                # 他のワーカーにも終了を伝える
+                self.inbox.put(_STOP)
+                break
+            if item.error is None or not self.skip_errors:
+                start = time.perf_counter()
+                failed = False
+                try:
+                    self.func(item)
+                except Exception as e:
+                    logger.error("{} failed on input {}: {}".format(self.name, item.index, e))
+                    item.error = e
+                    failed = True
+                self.stats.record(time.perf_counter() - start, failed)
+            self.outbox.put(item)
+        with self.__lock:
+            self.__alive -= 1
+            if self.__alive == 0:
+                self.outbox.put(_STOP)
+
+
+# LLM -> TTS -> 出力 を有界キューでつないだバッチ処理
+class BatchPipeline:
+    def __init__(
+        self,
+        chat,
+        audio_factory,
+        system_text,
+        sink,
+        chained=True,
+        llm_workers=4,
+        tts_workers=1,
+        queue_size=2,
+    ):
+        self.chat = chat
+        self.audio_factory = audio_factory
+        self.system_text = system_text
+        self.sink = sink
+        # 会話履歴をつなぐ場合はLLMを入力順に1つずつ処理する
+        self.chained = chained
+        self.history = None
+        self.__local = threading.local()
+
+        inbox = queue.Queue()
+        generated = queue.Queue(queue_size)
+        synthesized = queue.Queue(queue_size)
+        self.done = queue.Queue()
+        self.stages = [
+            Stage("llm", self.generate, inbox, generated, 1 if chained else llm_workers),
+            Stage("tts", self.synthesize, generated, synthesized, tts_workers),
+            Stage("sink", self.emit, synthesized, self.done, skip_errors=False),
+        ]
+        self.__pending = {}
+        self.__next = 0
+
+    @property
+    def stats(self):
+        return [stage.stats for stage in self.stages]
+
+    def generate(self, item):
+        history = self.history if self.chained else None
+        item.gen_text, item.history, item.params = self.chat.generate(
+            self.system_text, item.user_text, history
+        )
+        if self.chained:
+            self.history = item.history
+
+    def synthesize(self, item):
+        # Audioは状態を持つのでワーカースレッドごとに作る
+        audio = getattr(self.__local, "audio", None)
+        if audio is None:
+            audio = self.__local.audio = self.audio_factory()
+        audio.transform(item.gen_text)
+        item.wav = audio.get_wav()
+
+    # TTSが並列でも入力順に出力する
+    def emit(self, item):
+        self.__pending[item.index] = item
+        while self.__next in self.__pending:
+            ready = self.__pending.pop(self.__next)
+            self.__next += 1
+            if ready.error is None:
+                try:
+                    self.sink(ready)
+                except Exception as e:
+                    logger.error("sink failed on input {}: {}".format(ready.index, e))
+                    ready.error = e
+
+    def run(self, user_texts):
+        items = [BatchItem(i, text) for i, text in enumerate(user_texts)]
+        started = time.perf_counter()
+        for stage in self.stages:
+            stage.start(started)
+        inbox = self.stages[0].inbox
+        for item in items:
+            inbox.put(item)
+        inbox.put(_STOP)
+        for stage in self.stages:
+            stage.join()
+        return items
+
+    def report(self):
+        return "\n".join(str(stats) for stats in self.stats)
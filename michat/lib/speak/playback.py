@@ -0,0 +1,263 @@
+import io
+import logging
+import os
+import threading
+import time
+import wave
+from collections import deque
+
+from ..startup import lazy_import
+from ..telemetry import span
+from .wav import concat_wav
+
+pyaudio = lazy_import("pyaudio")
+
+# device: スピーカーで再生する / null: 捨てる / record: メモリに残す
+audio_sink = os.environ.get("MICHAT_AUDIO_SINK", "device")
+# 1回に書き込むフレーム数。中断はこの単位で効く（24kHzで約43ms）
+chunk_frames = 1024
+
+logger = logging.getLogger(__name__)
+
+
+# PyAudioでスピーカーに書き込む。形式が同じあいだはストリームを開いたままにして、文の間を空けない
+class DeviceSink:
+    def __init__(self):
+        self.__pyaudio = None
+        self.__stream = None
+        self.__format = None
+
+    def start(self, sample_rate, channels, sample_width):
+        params = (sample_rate, channels, sample_width)
+        if params == self.__format:
+            return
+        self.__close_stream()
+        if self.__pyaudio is None:
+            self.__pyaudio = pyaudio.PyAudio()
+        self.__stream = self.__pyaudio.open(
+            format=self.__pyaudio.get_format_from_width(sample_width),
+            channels=channels,
+            rate=sample_rate,
+            output=True,
+        )
+        self.__format = params
+
+    def write(self, frames):
+        self.__stream.write(frames)
+
+    def stop(self):
+        pass
+
+    def __close_stream(self):
+        if self.__stream is not None:
+            self.__stream.stop_stream()
+            self.__stream.close()
+        self.__stream = None
+        self.__format = None
+
+    def close(self):
+        self.__close_stream()
+        if self.__pyaudio is not None:
+            self.__pyaudio.terminate()
+            self.__pyaudio = None
+
+
+# 音を出さないシンク（サーバーやテスト用）。realtime なら再生と同じだけ時間をかける
+class NullSink:
+    def __init__(self, realtime=False):
+        self.realtime = realtime
+        self.seconds = 0.0
+        self.__frame_bytes = 1
+        self.__sample_rate = 1
+
+    def start(self, sample_rate, channels, sample_width):
+        self.__frame_bytes = channels * sample_width
+        self.__sample_rate = sample_rate
+
+    def write(self, frames):
+        seconds = len(frames) / self.__frame_bytes / self.__sample_rate
+        self.seconds += seconds
+        if self.realtime:
+            time.sleep(seconds)
+
+    def stop(self):
+        pass
+
+    def close(self):
+        pass
+
+
+# 再生したものをクリップごとにメモリに残す。中断したクリップは途中までになる
+class RecordingSink(NullSink):
+    def __init__(self, realtime=False):
+        super().__init__(realtime)
+        self.clips = []
+        self.__params = None
+        self.__frames = []
+
+    def start(self, sample_rate, channels, sample_width):
+        super().start(sample_rate, channels, sample_width)
+        self.__params = (channels, sample_width, sample_rate)
+        self.__frames = []
+
+    def write(self, frames):
+        super().write(frames)
+        self.__frames.append(frames)
+
+    def stop(self):
+        channels, sample_width, sample_rate = self.__params
+        out = io.BytesIO()
+        with wave.open(out, "wb") as writer:
+            writer.setnchannels(channels)
+            writer.setsampwidth(sample_width)
+            writer.setframerate(sample_rate)
+            writer.writeframes(b"".join(self.__frames))
+        self.clips.append(out.getvalue())
+        self.__frames = []
+
+    def wav(self):
+        return concat_wav(self.clips)
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(self.wav())
+
+
+sinks = {"device": DeviceSink, "null": NullSink, "record": RecordingSink}
+
+
+def sink_names():
+    return sorted(sinks.keys())
+
+
+# WAVのバイト列を裏のスレッドで順に再生する。呼び出し側は待たずに次の生成や聞き取りに進める
+# 1つの返答の文ごとのWAVは同じ utterance にまとめ、cancel でまとめて止める
+# utterance は増えていく番号で、再生を始めた返答より古い返答のWAVは遅れて届いても捨てる
+class Player:
+    def __init__(self, sink=None, chunk_frames=chunk_frames):
+        if sink is None or isinstance(sink, str):
+            sink = sinks[sink or audio_sink]()
+        self.sink = sink
+        self.__chunk_frames = chunk_frames
+        self.__queue = deque()
+        self.__cond = threading.Condition()
+        self.__current = None
+        self.__interrupted = False
+        self.__cancelled = set()
+        self.__next_utterance = 0
+        self.__started = 0
+        self.__closed = False
+        self.__thread = threading.Thread(target=self.__run, name="playback", daemon=True)
+        self.__thread.start()
+
+    @property
+    def playing(self):
+        with self.__cond:
+            return self.__current is not None
+
+    @property
+    def pending(self):
+        with self.__cond:
+            return len(self.__queue)
+
+    # 再生中か、再生を待っているWAVがある
+    @property
+    def busy(self):
+        with self.__cond:
+            return self.__current is not None or len(self.__queue) > 0
+
+    # utterance を省略すると新しい返答として扱う。続きの文は返した utterance を渡す
+    def play(self, wav, utterance=None):
+        with self.__cond:
+            if self.__closed:
+                raise RuntimeError("player is closed")
+            if utterance is None:
+                self.__next_utterance += 1
+                utterance = self.__next_utterance
+            if utterance not in self.__cancelled and utterance >= self.__started:
+                self.__queue.append((utterance, wav))
+                self.__cond.notify_all()
+        return utterance
+
+    # 省略すると再生中の返答を止める。まだ届いていない文も捨てる
+    def cancel(self, utterance=None):
+        with self.__cond:
+            if utterance is None:
+                utterance = self.__current
+            if utterance is None:
+                return
+            self.__cancelled.add(utterance)
+            self.__queue = deque(item for item in self.__queue if item[0] != utterance)
+            if self.__current == utterance:
+                self.__interrupted = True
+            self.__cond.notify_all()
+
+    # 再生し終わるまで待つ。utterance を渡すとその返答だけを待つ
+    def wait(self, utterance=None, timeout=None):
+        def done():
+            if utterance is None:
+                return not self.__queue and self.__current is None
+            return self.__current != utterance and all(u != utterance for u, _ in self.__queue)
+
+        with self.__cond:
+            return self.__cond.wait_for(done, timeout)
+
+    def __run(self):
+        while True:
+            with self.__cond:
+                while not self.__queue and not self.__closed:
+                    self.__cond.wait()
+                if not self.__queue:
+                    break
+                utterance, wav = self.__queue.popleft()
+                self.__current = utterance
+                self.__interrupted = False
+                if utterance > self.__started:
+                    # これより古い返答はもう再生しないので、止めた印も要らない
+                    self.__started = utterance
+                    self.__cancelled = {u for u in self.__cancelled if u >= utterance}
+            try:
+                self.__play(wav)
+            except Exception as e:
+                logger.error("playback failed: {}".format(e))
+            with self.__cond:
+                self.__current = None
+                self.__cond.notify_all()
+        self.sink.close()
+
+    def __play(self, wav):
+        with span("playback"), wave.open(io.BytesIO(wav), "rb") as reader:
+            self.sink.start(reader.getframerate(), reader.getnchannels(), reader.getsampwidth())
+            try:
+                while not self.__interrupted:
+                    frames = reader.readframes(self.__chunk_frames)
+                    if not frames:
+                        break
+                    self.sink.write(frames)
+            finally:
+                self.sink.stop()
+
+    def close(self):
+        with self.__cond:
+            self.__closed = True
+            self.__cond.notify_all()
+        self.__thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+_player = None
+_player_lock = threading.Lock()
+
+
+def get_player():
+    global _player
+    if _player is None:
+        with _player_lock:
+            if _player is None:
+                _player = Player()
+    return _player
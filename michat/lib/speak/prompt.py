@@ -0,0 +1,100 @@
+import logging
+import threading
+import time
+from pathlib import Path
+
+system_root = Path("system")
+emotion_file = "system-emotion.txt"
+check_interval = 1.0
+
+logger = logging.getLogger(__name__)
+
+
+def persona_file(feature):
+    return "system-{}.txt".format(feature.name.lower())
+
+
+# system/*.txt を一度だけ読み込んで保持し、更新されたら読み直す
+class PromptRegistry:
+    def __init__(self, features, root=system_root, emotion=emotion_file, interval=check_interval):
+        self.features = list(features)
+        self.root = Path(root)
+        self.emotion_file = emotion
+        self.interval = interval
+        self.__texts = {}
+        self.__mtimes = {}
+        self.__composed = {}
+        self.__checked = 0.0
+        self.__lock = threading.Lock()
+        self.reload()
+
+    def __load(self):
+        mtimes = {p.name: p.stat().st_mtime for p in self.root.glob("*.txt")}
+        if mtimes == self.__mtimes:
+            return False
+        texts = {}
+        for name, mtime in mtimes.items():
+            if self.__mtimes.get(name) == mtime:
+                texts[name] = self.__texts[name]
+            else:
+                texts[name] = (self.root / name).read_text()
+                logger.info("loaded prompt: {}".format(name))
+        # ペルソナとemotionの連結はここで作っておく
+        self.__composed = {}
+        if self.emotion_file in texts:
+            emotion = texts[self.emotion_file]
+            self.__composed = {
+                text: text + emotion for name, text in texts.items() if name != self.emotion_file
+            }
+        self.__texts = texts
+        self.__mtimes = mtimes
+        return True
+
+    def reload(self):
+        with self.__lock:
+            self.__checked = time.monotonic()
+            return self.__load()
+
+    def refresh(self):
+        if time.monotonic() - self.__checked < self.interval:
+            return False
+        return self.reload()
+
+    @property
+    def personas(self):
+        self.refresh()
+        return [f for f in self.features if persona_file(f) in self.__texts]
+
+    @property
+    def emotion(self):
+        self.refresh()
+        return self.__texts.get(self.emotion_file, "")
+
+    def system(self, feature):
+        self.refresh()
+        name = persona_file(feature)
+        if name not in self.__texts:
+            raise ValueError("invalid ChatGPT feature was set")
+        return self.__texts[name]
+
+    def with_emotion(self, system_text):
+        self.refresh()
+        composed = self.__composed.get(system_text)
+        if composed is None:
+            if self.emotion_file not in self.__texts:
+                raise FileNotFoundError(self.root / self.emotion_file)
+            composed = system_text + self.__texts[self.emotion_file]
+        return composed
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_prompt_registry(features):
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = PromptRegistry(features)
+    return _registry
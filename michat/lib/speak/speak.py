@@ -3,16 +3,20 @@ import os
 from argparse import ArgumentParser
 from pathlib import Path
 from enum import Enum
-import json
+import time
 
-import openai
-from dotenv import load_dotenv
-from playsound import playsound
-from voicevox_core import AccelerationMode, VoicevoxCore
+from ..startup import lazy_import
+from ..telemetry import count, span
+from .backend import OpenAIBackend, get_llm_backend, request_timeout
+from .cache import get_completion_cache, get_tts_cache
+from .history import HistoryManager, count_tokens
+from .prompt import get_prompt_registry
+from .stream import ChatStream, EmotionChatStream, EmotionParser
+from .wav import wav_duration
+from .workers import get_tts_pool
 
-open_jtalk_dict_dir = "./open_jtalk_dic_utf_8-1.11"
-acceleration_mode = AccelerationMode.AUTO
-system_root = Path("system")
+dotenv = lazy_import("dotenv")
+playsound = lazy_import("playsound")
 
 
 class ChatGPTFeature(Enum):
@@ -41,12 +45,30 @@ class ChatGPTFeature(Enum):
 
 
 class ChatGPT:
-    def __init__(self, max_token_size):
+    def __init__(
+        self, max_token_size, history_manager=None, completion_cache=None, backend=None
+    ):
         self.__max_token_size = max_token_size
+        self.model = "gpt-3.5-turbo"
+        self.temperature = 0.5
+        # 1回の生成の期限（秒）。リトライもこの中で行う
+        self.timeout = request_timeout
+        # history_manager=False で履歴を切り詰めない
+        if history_manager is None:
+            history_manager = HistoryManager()
+        self.history_manager = None if history_manager is False else history_manager
+        # None なら temperature=0 のときだけ共有キャッシュを使う。False で無効
+        self.completion_cache = completion_cache
         dotenv_path = Path(os.path.join(os.getcwd(), ".env"))
         if dotenv_path.exists():
-            load_dotenv(dotenv_path)
-        openai.api_key = os.environ.get("OPENAI_API_KEY")
+            dotenv.load_dotenv(dotenv_path)
+        # APIキーはグローバルに設定せず、バックエンドごとに持たせる
+        # backendはLLMBackendのインスタンスか登録名（"openai", "async"）
+        if backend is None:
+            backend = OpenAIBackend(api_key=os.environ.get("OPENAI_API_KEY"))
+        elif isinstance(backend, str):
+            backend = get_llm_backend(backend, api_key=os.environ.get("OPENAI_API_KEY"))
+        self.backend = backend
 
     @property
     def max_token_size(self):
@@ -56,11 +78,24 @@ class ChatGPT:
     def max_token_size(self, n):
         self.__max_token_size = n
 
-    # history は（DBやファイルなど）外部で保持している
-    def generate(self, system_text, user_text, history=None):
-        messages = []
+    def compact(self, system_text, user_text, history):
         if history is None:
-            history = []
+            return []
+        if self.history_manager is None:
+            return history
+        return self.history_manager.fit(system_text, user_text, history)
+
+    @property
+    def cache(self):
+        if self.completion_cache is None:
+            return get_completion_cache() if self.temperature == 0 else None
+        return self.completion_cache or None
+
+    def cache_key(self, messages):
+        return self.cache.key(self.model, self.temperature, self.max_token_size, messages)
+
+    def messages(self, system_text, user_text, history):
+        messages = []
         for h in history:
             messages.append(h)
         messages.extend(
@@ -75,18 +110,49 @@ class ChatGPT:
                 },
             ]
         )
-        # GPT-3でテキストを生成する
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=messages,
-            max_tokens=int(self.max_token_size),
-            n=1,
-            stop=None,
-            temperature=0.5,
-        )
+        return messages
+
+    def payload(self, messages):
+        return {
+            "model": self.model,
+            "messages": messages,
+            "max_tokens": int(self.max_token_size),
+            "n": 1,
+            "stop": None,
+            "temperature": self.temperature,
+        }
+
+    # トークン数を数えてSpanとカウンタに載せる（計測が無効なら何もしない）
+    def record_tokens(self, s, messages, text):
+        if not s:
+            return
+        prompt_tokens = sum(count_tokens(m["content"]) for m in messages)
+        completion_tokens = count_tokens(text)
+        s.set(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        count("michat_tokens_total", prompt_tokens, kind="prompt")
+        count("michat_tokens_total", completion_tokens, kind="completion")
+
+    # history は（DBやファイルなど）外部で保持している
+    def generate(self, system_text, user_text, history=None):
+        history = self.compact(system_text, user_text, history)
+        messages = self.messages(system_text, user_text, history)
+        with span("generate", model=self.model) as s:
+            cache = self.cache
+            text = None
+            if cache is not None:
+                key = self.cache_key(messages)
+                text = cache.get(key)
+            s.set(cached=text is not None)
+            if text is None:
+                # GPT-3でテキストを生成する
+                start = time.perf_counter()
+                response = self.backend.complete(self.payload(messages), self.timeout)
 
-        # GPT-3の生成したテキストを取得する
-        text = response.choices[0].message.content.strip()
+                # GPT-3の生成したテキストを取得する
+                text = response.strip()
+                if cache is not None:
+                    cache.put(key, text, time.perf_counter() - start)
+                self.record_tokens(s, messages, text)
         history = history + [
             {
                 "role": "user",
@@ -96,56 +162,127 @@ class ChatGPT:
         ]
         return (text, history)
 
+    def stream(self, deltas, user_text, history, on_done=None):
+        return ChatStream(deltas, user_text, history, on_done)
+
+    # ストリームを読み終えるまでを1つのSpanにする（最初の差分までの時間も記録する）
+    def traced(self, deltas, messages):
+        s = span("generate", model=self.model, stream=True)
+        if not s:
+            return deltas
+
+        def trace():
+            chunks = []
+            with s:
+                for delta in deltas:
+                    if not chunks:
+                        s.set(first_token=time.perf_counter() - s.start)
+                    chunks.append(delta)
+                    yield delta
+                self.record_tokens(s, messages, "".join(chunks))
+
+        return trace()
+
+    # 生成されたテキストを届いた順に返す
+    def generate_stream(self, system_text, user_text, history=None):
+        history = self.compact(system_text, user_text, history)
+        messages = self.messages(system_text, user_text, history)
+        cache = self.cache
+        if cache is None:
+            deltas = self.traced(self.backend.stream(self.payload(messages), self.timeout), messages)
+            return self.stream(deltas, user_text, history)
+
+        key = self.cache_key(messages)
+        text = cache.get(key)
+        if text is not None:
+            return self.stream(iter([text]), user_text, history)
+        start = time.perf_counter()
+        deltas = self.traced(self.backend.stream(self.payload(messages), self.timeout), messages)
+        return self.stream(
+            deltas,
+            user_text,
+            history,
+            lambda text: cache.put(key, text, time.perf_counter() - start),
+        )
+
 
 class ChatGPTWithEmotion(ChatGPT):
-    def __init__(self, max_token_size):
-        super().__init__(max_token_size)
-        self.system_emotion = system_root / Path("system-emotion.txt")
+    def __init__(
+        self, max_token_size, history_manager=None, completion_cache=None, backend=None
+    ):
+        super().__init__(max_token_size, history_manager, completion_cache, backend)
+        self.prompts = get_prompt_registry(ChatGPTFeature)
 
     def trim_and_parse(self, text):
-        lines = []
-        payload = None
-        for line in text.splitlines():
-            try:
-                payload = json.loads(line)
-                continue
-            except ValueError:
-                pass
-            if "感情パラメータ" not in line and line != "":
-                lines.append(line)
-        return "\n".join(lines), payload
+        parser = EmotionParser()
+        trimmed = parser.feed(text) + parser.close()
+        return trimmed.strip(), parser.params
+
+    def with_emotion(self, system_text):
+        return self.prompts.with_emotion(system_text)
 
     def generate(self, system_text, user_text, history=None):
-        with open(self.system_emotion, "r") as f:
-            system_text += f.read()
+        system_text = self.with_emotion(system_text)
         generated, new_history = super().generate(system_text, user_text, history)
         response, params = self.trim_and_parse(generated)
         return (response, new_history, params)
 
+    def stream(self, deltas, user_text, history, on_done=None):
+        return EmotionChatStream(deltas, user_text, history, on_done)
+
+    def generate_stream(self, system_text, user_text, history=None):
+        return super().generate_stream(self.with_emotion(system_text), user_text, history)
+
 
 class Audio:
-    def __init__(self, speaker_id):
-        self.speaker_id = speaker_id
+    def __init__(self, speaker_id, pool=None, cache=None, **params):
+        self.speaker_id = int(speaker_id)
+        if pool is None:
+            pool = get_tts_pool()
+        self.pool = pool
+        # cache=False でキャッシュを使わない
+        if cache is None:
+            cache = get_tts_cache()
+        self.cache = None if cache is False else cache
+        # speed_scale, pitch_scale などAudioQueryに設定する合成パラメータ
+        self.params = params
+        self.key = None
+        self.audio_query = None
+        self.wav = None
 
     # voicevoxでテキストを音声に変換する
     def transform(self, text):
-        self.core = VoicevoxCore(
-            acceleration_mode=acceleration_mode, open_jtalk_dict_dir=open_jtalk_dict_dir
-        )
-        self.core.load_model(self.speaker_id)
-        self.audio_query = self.core.audio_query(text, self.speaker_id)
+        self.audio_query = None
+        self.wav = None
+        with span("query", speaker_id=self.speaker_id, chars=len(text)) as s:
+            if self.cache is not None:
+                self.key = self.cache.key(text, self.speaker_id, self.params)
+                self.wav = self.cache.get(self.key)
+                s.set(cached=self.wav is not None)
+                if self.wav is not None:
+                    return
+            self.audio_query = self.pool.audio_query(text, self.speaker_id)
+            for name, value in self.params.items():
+                setattr(self.audio_query, name, value)
 
     # 音声をファイルに保存する
     def save_wav(self, out):
-        out.write_bytes(self.wav)
+        out.write_bytes(self.get_wav())
 
     def get_wav(self):
-        self.wav = self.core.synthesis(self.audio_query, self.speaker_id)
+        if self.wav is None:
+            with span("synthesis", speaker_id=self.speaker_id) as s:
+                self.wav = self.pool.synthesis(self.audio_query, self.speaker_id)
+                if s:
+                    s.set(audio_seconds=wav_duration(self.wav))
+            if self.cache is not None:
+                self.cache.put(self.key, self.wav)
         return self.wav
 
     # 音声を再生する
     def play(self, file):
-        playsound(file)
+        with span("playback"):
+            playsound.playsound(file)
 
 
 def setup_log(log_file, log_level):
@@ -169,15 +306,4 @@ def setup_log(log_file, log_level):
 
 
 def system_text(feature=ChatGPTFeature.ZUNDAMON):
-    if feature is ChatGPTFeature.ZUNDAMON:
-        system = Path("system-zundamon.txt")
-    elif feature is ChatGPTFeature.ENE:
-        system = Path("system-ene.txt")
-    elif feature is ChatGPTFeature.MIKU:
-        system = Path("system-miku.txt")
-    else:
-        raise ValueError("invalid ChatGPT feature was set")
-
-    with open(system_root / system, "r") as f:
-        text = f.read()
-    return text
+    return get_prompt_registry(ChatGPTFeature).system(feature)
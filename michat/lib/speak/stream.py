@@ -0,0 +1,268 @@
+import json
+import queue
+import re
+import threading
+
+SENTENCE_DELIMITERS = "。！？♪\n"
+
+# 感情パラメータの見出し行（「チャットボットの現在の感情パラメーター」など）
+EMOTION_LABEL = "感情パラメ"
+EMOTION_LABEL_PREFIXES = (EMOTION_LABEL, "現在の" + EMOTION_LABEL, "チャットボットの現在の" + EMOTION_LABEL)
+# これより長い { ... } は感情パラメータとみなさない
+MAX_EMOTION_HEADER = 512
+
+_emotion_pair = re.compile(r"[\"']?([^\"'{},:：\s]+)[\"']?\s*[:：]\s*(-?\d+)")
+
+
+def _boundary(delimiters):
+    return re.compile("[{}]+".format(re.escape(delimiters)))
+
+
+# ストリームで届くテキストを文の区切りでまとめて返す
+def split_sentences(chunks, delimiters=SENTENCE_DELIMITERS):
+    boundary = _boundary(delimiters)
+    buffer = ""
+    for chunk in chunks:
+        buffer += chunk
+        start = 0
+        for m in boundary.finditer(buffer):
+            # 区切り文字が次のチャンクに続くかもしれないので末尾は保留する
+            if m.end() == len(buffer):
+                break
+            sentence = buffer[start : m.end()].strip()
+            if sentence:
+                yield sentence
+            start = m.end()
+        buffer = buffer[start:]
+    sentence = buffer.strip()
+    if sentence:
+        yield sentence
+
+
+# 別スレッドでiterableを読み進めて、消費側と処理を重ねる
+def prefetch(iterable, maxsize=0):
+    items = queue.Queue(maxsize)
+    end = object()
+
+    def produce():
+        try:
+            for item in iterable:
+                items.put((item, None))
+        except Exception as e:
+            items.put((None, e))
+        finally:
+            items.put((end, None))
+
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        item, error = items.get()
+        if error is not None:
+            raise error
+        if item is end:
+            return
+        yield item
+
+
+# 文ごとに音声合成する（LLMの生成とTTSを重ねる）
+def synthesize_stream(sentences, audio):
+    for sentence in prefetch(sentences):
+        audio.transform(sentence)
+        yield sentence, audio.get_wav()
+
+
+class ChatStream:
+    def __init__(self, deltas, user_text, history, on_done=None):
+        self.__deltas = deltas
+        self.__user_text = user_text
+        self.__history = history
+        self.__on_done = on_done
+        self.__texts = []
+        self.__done = False
+
+    def __iter__(self):
+        for delta in self.__deltas:
+            self.__texts.append(delta)
+            yield delta
+        self.__done = True
+        if self.__on_done is not None:
+            self.__on_done(self.raw_text)
+
+    @property
+    def done(self):
+        return self.__done
+
+    @property
+    def raw_text(self):
+        return "".join(self.__texts).strip()
+
+    @property
+    def text(self):
+        return self.raw_text
+
+    @property
+    def history(self):
+        return self.__history + [
+            {
+                "role": "user",
+                "content": self.__user_text,
+            },
+            {"role": "assistant", "content": self.raw_text},
+        ]
+
+    def sentences(self):
+        return split_sentences(self)
+
+
+# 届いたテキストを1度だけ走査して、感情パラメータの見出しとJSONを取り除く
+# 行頭の、見出しやJSONかもしれない部分だけを保留し、それ以外はすぐに返す
+class EmotionParser:
+    def __init__(self, on_params=None):
+        self.params = None
+        self.__on_params = on_params
+        self.__line = ""  # 保留中の行頭のテキスト
+        self.__holding = True  # 行頭で、まだ本文かどうか分からない
+        self.__label = False  # 保留中の行は見出し
+        self.__depth = 0  # JSONの括弧の深さ
+        self.__quoted = False
+        self.__escaped = False
+
+    # 本文として確定したテキストを返す
+    def feed(self, chunk):
+        out = []
+        start = 0
+        for i, c in enumerate(chunk):
+            if not self.__holding:
+                if c == "\n":
+                    self.__holding = True
+                    out.append(chunk[start : i + 1])
+                    start = i + 1
+                continue
+            start = i + 1
+            if self.__depth:
+                self.__json(c, out)
+            elif c == "\n":
+                # 見出しと空行は捨てる
+                if not self.__label and self.__line.strip():
+                    out.append(self.__line + c)
+                self.__reset()
+            elif c == "{" and (self.__label or not self.__line.strip()):
+                self.__line = c
+                self.__depth = 1
+            else:
+                self.__line += c
+                self.__classify(out)
+        if not self.__holding:
+            out.append(chunk[start:])
+        return "".join(out)
+
+    # 最後まで届いたら、保留していたものを片付ける
+    def close(self):
+        out = []
+        if self.__depth:
+            self.__header(out)
+        elif not self.__label:
+            out.append(self.__line)
+        self.__reset()
+        return "".join(out)
+
+    def __reset(self):
+        self.__line = ""
+        self.__holding = True
+        self.__label = False
+        self.__depth = 0
+        self.__quoted = False
+        self.__escaped = False
+
+    def __release(self, out):
+        out.append(self.__line)
+        self.__line = ""
+        self.__holding = False
+
+    def __classify(self, out):
+        if self.__label:
+            return
+        head = self.__line.lstrip()
+        if not head:
+            return
+        if head.startswith(EMOTION_LABEL_PREFIXES):
+            self.__label = True
+        elif not any(p.startswith(head) for p in EMOTION_LABEL_PREFIXES):
+            self.__release(out)
+
+    def __json(self, c, out):
+        self.__line += c
+        if self.__escaped:
+            self.__escaped = False
+        elif self.__quoted:
+            if c == "\\":
+                self.__escaped = True
+            elif c == '"':
+                self.__quoted = False
+        elif c == '"':
+            self.__quoted = True
+        elif c == "{":
+            self.__depth += 1
+        elif c == "}":
+            self.__depth -= 1
+            if self.__depth == 0:
+                self.__header(out)
+                return
+        if len(self.__line) > MAX_EMOTION_HEADER:
+            # 閉じないまま長すぎるものは本文として流す
+            self.__depth = 0
+            self.__release(out)
+
+    # 閉じたJSONを解釈する。壊れていても「"喜び": 3」の形の組は拾う
+    def __header(self, out):
+        text = self.__line
+        try:
+            payload = json.loads(text)
+        except ValueError:
+            payload = None
+        if not isinstance(payload, dict):
+            pairs = _emotion_pair.findall(text)
+            payload = {k: int(v) for k, v in pairs} if pairs else None
+        self.__reset()
+        if payload is None:
+            self.__line = text
+            self.__release(out)
+            return
+        self.params = payload
+        if self.__on_params is not None:
+            self.__on_params(payload)
+
+
+class EmotionChatStream(ChatStream):
+    def __init__(self, deltas, user_text, history, on_done=None, on_params=None):
+        super().__init__(deltas, user_text, history, on_done)
+        self.__parser = EmotionParser(on_params)
+        self.__spoken = []
+        self.__parsed = False
+
+    @property
+    def params(self):
+        return self.__parser.params
+
+    @property
+    def text(self):
+        if not self.__parsed:
+            # sentences() を通さずに読み終えた場合は、ここでまとめて解釈する
+            parser = EmotionParser()
+            return (parser.feed(self.raw_text) + parser.close()).strip()
+        return "".join(self.__spoken).strip()
+
+    # 感情パラメータを除いた読み上げる部分だけを流す
+    def spoken(self):
+        for delta in self:
+            text = self.__parser.feed(delta)
+            if text:
+                self.__spoken.append(text)
+                yield text
+        text = self.__parser.close()
+        self.__parsed = True
+        if text:
+            self.__spoken.append(text)
+            yield text
+
+    def sentences(self):
+        return split_sentences(self.spoken())
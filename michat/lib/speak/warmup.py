@@ -0,0 +1,69 @@
+import json
+import logging
+import time
+from pathlib import Path
+
+from ..transcript import GOODBYE_TEXT, LISTENING_TEXT, REQUEST_ERROR_TEXT, UNKNOWN_VALUE_TEXT
+from .speak import Audio
+
+canned_manifest = Path("system/canned.json")
+builtin_phrases = [UNKNOWN_VALUE_TEXT, REQUEST_ERROR_TEXT, LISTENING_TEXT, GOODBYE_TEXT]
+dummy_text = "あ"
+
+logger = logging.getLogger(__name__)
+
+
+# 決まり文句の一覧。manifestの "phrases" はすべての話者、"speakers" は最初から温めておく話者
+def load_manifest(path=canned_manifest):
+    manifest = {"speakers": [], "phrases": []}
+    path = Path(path)
+    if path.exists():
+        manifest.update(json.loads(path.read_text()))
+    phrases = builtin_phrases + [p for p in manifest["phrases"] if p not in builtin_phrases]
+    return [int(s) for s in manifest["speakers"]], phrases
+
+
+# 話者モデルの読み込みと空の推論を済ませ、決まり文句を合成してTTSキャッシュに入れておく
+def warm_up(speaker_ids, phrases=None, audio_factory=Audio):
+    if phrases is None:
+        _, phrases = load_manifest()
+    report = {"speakers": {}}
+    start = time.perf_counter()
+    for speaker_id in speaker_ids:
+        audio = audio_factory(speaker_id)
+        pool = audio.pool
+        t = time.perf_counter()
+        load = getattr(pool, "load", None)
+        if load is not None:
+            load(speaker_id)
+        loaded = time.perf_counter()
+        # ONNXのセッションは最初の推論で作られるので、キャッシュを通さずに1回合成する
+        pool.synthesis(pool.audio_query(dummy_text, speaker_id), speaker_id)
+        inferred = time.perf_counter()
+        rendered = 0
+        for phrase in phrases:
+            audio.transform(phrase)
+            if audio.wav is None:
+                rendered += 1
+            audio.get_wav()
+        report["speakers"][speaker_id] = {
+            "load": loaded - t,
+            "inference": inferred - loaded,
+            "phrases": time.perf_counter() - inferred,
+            "rendered": rendered,
+            "cached": len(phrases) - rendered,
+        }
+    report["total"] = time.perf_counter() - start
+    logger.info(format_report(report))
+    return report
+
+
+def format_report(report):
+    lines = ["warm-up finished in {:.2f}s".format(report["total"])]
+    for speaker_id, r in report["speakers"].items():
+        lines.append(
+            "  speaker {}: load {:.2f}s, first inference {:.2f}s, phrases {:.2f}s ({} rendered, {} cached)".format(
+                speaker_id, r["load"], r["inference"], r["phrases"], r["rendered"], r["cached"]
+            )
+        )
+    return "\n".join(lines)
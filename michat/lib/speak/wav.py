@@ -0,0 +1,34 @@
+import io
+import struct
+import wave
+
+
+# 同じフォーマットのWAVを1つにつなげる
+def concat_wav(parts):
+    out = io.BytesIO()
+    writer = None
+    for part in parts:
+        with wave.open(io.BytesIO(part), "rb") as reader:
+            if writer is None:
+                writer = wave.open(out, "wb")
+                writer.setparams(reader.getparams())
+            writer.writeframes(reader.readframes(reader.getnframes()))
+    if writer is None:
+        return b""
+    writer.close()
+    return out.getvalue()
+
+
+def wav_duration(wav):
+    with wave.open(io.BytesIO(wav), "rb") as reader:
+        return reader.getnframes() / reader.getframerate()
+
+
+# 長さの分からないまま流すWAVのヘッダ（サイズは最大値にしておく）
+def wav_stream_header(sample_rate, channels=1, sample_width=2):
+    block_align = channels * sample_width
+    fmt = struct.pack(
+        "<IHHIIHH", 16, 1, channels, sample_rate, sample_rate * block_align, block_align, sample_width * 8
+    )
+    size = struct.pack("<I", 0xFFFFFFFF)
+    return b"RIFF" + size + b"WAVEfmt " + fmt + b"data" + size
@@ -0,0 +1,270 @@
+import atexit
+import logging
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+from .engine import EnginePool, get_engine_pool
+
+# 0なら呼び出し元のスレッドで合成する（"auto"でCPUコア数）
+synthesis_processes = os.environ.get("MICHAT_TTS_PROCESSES", "0")
+max_batch_size = 8
+
+logger = logging.getLogger(__name__)
+
+
+# audio_query の代わりに返すもの。パラメータだけ覚えておき、クエリの作成と合成はワーカーで続けて行う
+class PendingQuery:
+    def __init__(self, text, speaker_id):
+        object.__setattr__(self, "text", text)
+        object.__setattr__(self, "speaker_id", speaker_id)
+        object.__setattr__(self, "params", {})
+
+    def __setattr__(self, name, value):
+        self.params[name] = value
+
+
+def _synthesize(engine, text, speaker_id, params):
+    query = engine.audio_query(text, speaker_id)
+    for name, value in params.items():
+        setattr(query, name, value)
+    return engine.synthesis(query, speaker_id)
+
+
+# ワーカープロセスの本体。まとめて届いた要求を順に処理して、同じ順で結果を返す
+def _serve(conn, engine_factory, engine_kwargs):
+    engine = engine_factory(**engine_kwargs)
+    while True:
+        batch = conn.recv()
+        if batch is None:
+            break
+        done = {}
+        results = []
+        for op, text, speaker_id, params in batch:
+            key = (op, text, speaker_id, tuple(sorted(params.items())))
+            try:
+                if key not in done:
+                    if op == "load":
+                        getattr(engine, "load", lambda speaker_id: None)(speaker_id)
+                        done[key] = None
+                    else:
+                        done[key] = _synthesize(engine, text, speaker_id, params)
+                results.append((done[key], None))
+            except Exception as e:
+                results.append((None, RuntimeError("{}: {}".format(type(e).__name__, e))))
+        conn.send(results)
+    conn.close()
+
+
+class _Request:
+    def __init__(self, op, text, speaker_id, params):
+        self.op = op
+        self.text = text
+        self.speaker_id = speaker_id
+        self.params = params
+        self.future = Future()
+
+    @property
+    def message(self):
+        return (self.op, self.text, self.speaker_id, self.params)
+
+
+# 1つのワーカープロセスと、そこへ要求を送るスレッド
+class _Worker:
+    def __init__(self, index, context, engine_factory, engine_kwargs, batch_size):
+        self.index = index
+        self.speakers = set()
+        self.batches = 0
+        self.requests = 0
+        self.__context = context
+        self.__engine_factory = engine_factory
+        self.__engine_kwargs = engine_kwargs
+        self.__batch_size = batch_size
+        self.__queue = deque()
+        self.__cond = threading.Condition()
+        self.__closed = False
+        self.__start()
+        self.__thread = threading.Thread(
+            target=self.__dispatch, name="synthesis-{}".format(index), daemon=True
+        )
+        self.__thread.start()
+
+    @property
+    def pending(self):
+        with self.__cond:
+            return len(self.__queue)
+
+    def __start(self):
+        self.__conn, child = self.__context.Pipe()
+        self.__process = self.__context.Process(
+            target=_serve,
+            args=(child, self.__engine_factory, self.__engine_kwargs),
+            name="voicevox-{}".format(self.index),
+            daemon=True,
+        )
+        self.__process.start()
+        child.close()
+
+    def submit(self, request):
+        with self.__cond:
+            if self.__closed:
+                raise RuntimeError("synthesis pool is closed")
+            self.__queue.append(request)
+            self.__cond.notify()
+        return request.future
+
+    # 先頭の要求と同じ話者の要求を、順序を保ったまままとめて取り出す
+    def __next_batch(self):
+        first = self.__queue.popleft()
+        batch = [first]
+        others = []
+        while self.__queue and len(batch) < self.__batch_size:
+            request = self.__queue.popleft()
+            if request.speaker_id == first.speaker_id:
+                batch.append(request)
+            else:
+                others.append(request)
+        self.__queue.extendleft(reversed(others))
+        return batch
+
+    def __dispatch(self):
+        while True:
+            with self.__cond:
+                while not self.__queue and not self.__closed:
+                    self.__cond.wait()
+                if not self.__queue:
+                    break
+                batch = self.__next_batch()
+            try:
+                self.__conn.send([r.message for r in batch])
+                results = self.__conn.recv()
+            except (EOFError, OSError) as e:
+                logger.error("synthesis worker {} died: {}".format(self.index, e))
+                for request in batch:
+                    request.future.set_exception(RuntimeError("synthesis worker died"))
+                self.__restart()
+                continue
+            self.batches += 1
+            self.requests += len(batch)
+            for request, (wav, error) in zip(batch, results):
+                if error is None:
+                    request.future.set_result(wav)
+                else:
+                    request.future.set_exception(error)
+        try:
+            self.__conn.send(None)
+        except OSError:
+            pass
+        self.__process.join(5)
+
+    def __restart(self):
+        self.__conn.close()
+        if self.__process.is_alive():
+            self.__process.kill()
+        self.__process.join()
+        self.speakers.clear()
+        self.__start()
+
+    def close(self):
+        with self.__cond:
+            self.__closed = True
+            self.__cond.notify()
+        self.__thread.join()
+
+
+# VOICEVOXを複数プロセスで動かす。話者ごとに担当のプロセスを決め、同じ話者の要求はまとめて送る
+# EnginePoolと同じ audio_query / synthesis を持つので、Audio(pool=...) にそのまま渡せる
+class SynthesisWorkerPool:
+    def __init__(
+        self,
+        processes=None,
+        engine_factory=EnginePool,
+        engine_kwargs=None,
+        batch_size=max_batch_size,
+    ):
+        cpus = os.cpu_count() or 1
+        self.processes = processes or cpus
+        if engine_kwargs is None:
+            engine_kwargs = {}
+            if engine_factory is EnginePool:
+                engine_kwargs["cpu_num_threads"] = max(1, cpus // self.processes)
+        context = multiprocessing.get_context("spawn")
+        self.__workers = [
+            _Worker(i, context, engine_factory, engine_kwargs, batch_size)
+            for i in range(self.processes)
+        ]
+        self.__affinity = {}
+        self.__lock = threading.Lock()
+        logger.info("started {} synthesis workers".format(self.processes))
+
+    @property
+    def stats(self):
+        return [
+            {
+                "speakers": sorted(w.speakers),
+                "pending": w.pending,
+                "batches": w.batches,
+                "requests": w.requests,
+            }
+            for w in self.__workers
+        ]
+
+    def worker_of(self, speaker_id):
+        with self.__lock:
+            worker = self.__affinity.get(speaker_id)
+            if worker is None or speaker_id not in worker.speakers:
+                # 担当する話者が少なく、空いているプロセスに割り当てる
+                worker = min(self.__workers, key=lambda w: (len(w.speakers), w.pending))
+                worker.speakers.add(speaker_id)
+                self.__affinity[speaker_id] = worker
+            return worker
+
+    def submit(self, text, speaker_id, params=None):
+        request = _Request("synthesize", text, speaker_id, dict(params or {}))
+        return self.worker_of(speaker_id).submit(request)
+
+    # 結果は texts の順に返す
+    def map(self, texts, speaker_id, params=None):
+        futures = [self.submit(text, speaker_id, params) for text in texts]
+        for future in futures:
+            yield future.result()
+
+    def load(self, speaker_id):
+        request = _Request("load", "", speaker_id, {})
+        self.worker_of(speaker_id).submit(request).result()
+
+    def audio_query(self, text, speaker_id):
+        return PendingQuery(text, speaker_id)
+
+    def synthesis(self, audio_query, speaker_id):
+        return self.submit(audio_query.text, speaker_id, audio_query.params).result()
+
+    def close(self):
+        for worker in self.__workers:
+            worker.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+# MICHAT_TTS_PROCESSES が設定されていればワーカープロセスで、なければこのプロセスで合成する
+def get_tts_pool():
+    global _pool
+    if synthesis_processes in ("", "0"):
+        return get_engine_pool()
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                processes = None if synthesis_processes == "auto" else int(synthesis_processes)
+                _pool = SynthesisWorkerPool(processes)
+                atexit.register(_pool.close)
+    return _pool
@@ -0,0 +1,2 @@
+from .lazy import LazyModule, lazy_exports, lazy_import
+from .profiler import StartupProfiler
@@ -0,0 +1,46 @@
+import importlib
+import sys
+import threading
+
+
+# 属性に初めて触れたときにモジュールを読み込む（openai や voicevox_core など重いもの用）
+# 入っていないモジュールも、使うまではエラーにならない
+class LazyModule:
+    def __init__(self, name):
+        self.__name = name
+        self.__module = None
+        self.__lock = threading.Lock()
+
+    def __load(self):
+        if self.__module is None:
+            with self.__lock:
+                if self.__module is None:
+                    self.__module = importlib.import_module(self.__name)
+        return self.__module
+
+    def __getattr__(self, name):
+        return getattr(self.__load(), name)
+
+    def __repr__(self):
+        state = "loaded" if self.__module is not None else "not loaded"
+        return "<lazy module {!r} ({})>".format(self.__name, state)
+
+
+def lazy_import(name):
+    return LazyModule(name)
+
+
+# パッケージの __getattr__ にする。公開している名前に初めて触れたときにサブモジュールを読み込む
+# exports はサブモジュール（相対名）と、そこから公開する名前の一覧
+def lazy_exports(package, exports):
+    modules = {name: module for module, names in exports.items() for name in names}
+
+    def __getattr__(name):
+        module = modules.get(name)
+        if module is None:
+            raise AttributeError("module {!r} has no attribute {!r}".format(package, name))
+        value = getattr(importlib.import_module(module, package), name)
+        setattr(sys.modules[package], name, value)
+        return value
+
+    return __getattr__, sorted(modules)
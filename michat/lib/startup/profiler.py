@@ -0,0 +1,162 @@
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+report_size = 20
+profile_flag = "--profile-startup"
+
+
+# 読み込みの時間を測るために、モジュールの実行だけを包むローダー
+class _TimedLoader:
+    def __init__(self, loader, profiler):
+        self.__loader = loader
+        self.__profiler = profiler
+
+    def create_module(self, spec):
+        return self.__loader.create_module(spec)
+
+    def exec_module(self, module):
+        # 以後はモジュールから元のローダーが見えるようにしておく
+        module.__loader__ = self.__loader
+        if module.__spec__ is not None:
+            module.__spec__.loader = self.__loader
+        with self.__profiler.importing(module.__name__):
+            self.__loader.exec_module(module)
+
+    def __getattr__(self, name):
+        return getattr(self.__loader, name)
+
+
+class _TimingFinder:
+    def __init__(self, profiler):
+        self.__profiler = profiler
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            find_spec = getattr(finder, "find_spec", None)
+            if finder is self or find_spec is None:
+                continue
+            spec = find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+            spec.loader = _TimedLoader(spec.loader, self.__profiler)
+        return spec
+
+
+# 起動にかかった時間を、モジュールの読み込みと初期化の段階ごとに集計する
+# モジュールの時間は、そのモジュールが読み込んだものを含む累計と、含まない自身の時間
+class StartupProfiler:
+    def __init__(self):
+        self.__finder = _TimingFinder(self)
+        self.__local = threading.local()
+        self.__lock = threading.Lock()
+        self.__imports = {}
+        self.__phases = []
+        self.__started = None
+        self.__stopped = None
+        self.__preloaded = 0
+
+    @property
+    def running(self):
+        return self.__started is not None and self.__stopped is None
+
+    # 引数に --profile-startup があれば、その場で計測を始める
+    # エントリポイントで lib を読み込む前に呼び、lib の読み込みも測れるようにする
+    @classmethod
+    def from_argv(cls, argv=None, flag=profile_flag):
+        argv = sys.argv[1:] if argv is None else argv
+        profiler = cls()
+        if any(arg == flag or arg.startswith(flag + "=") for arg in argv):
+            profiler.start()
+        return profiler
+
+    def start(self):
+        self.__started = time.perf_counter()
+        self.__preloaded = len(sys.modules)
+        sys.meta_path.insert(0, self.__finder)
+        return self
+
+    def stop(self):
+        if self.__finder in sys.meta_path:
+            sys.meta_path.remove(self.__finder)
+        self.__stopped = time.perf_counter()
+
+    @contextmanager
+    def importing(self, name):
+        stack = self.__local.__dict__.setdefault("stack", [])
+        frame = [name, 0.0]
+        stack.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            stack.pop()
+            if stack:
+                stack[-1][1] += elapsed
+            with self.__lock:
+                self.__imports[name] = (elapsed, elapsed - frame[1])
+
+    # 計測していないときは何もしない
+    @contextmanager
+    def phase(self, name):
+        if not self.running:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.__phases.append((name, time.perf_counter() - start))
+
+    def report(self):
+        end = self.__stopped if self.__stopped is not None else time.perf_counter()
+        with self.__lock:
+            imports = sorted(self.__imports.items(), key=lambda item: -item[1][1])
+        packages = {}
+        for name, (_, own) in imports:
+            top = name.split(".")[0]
+            packages[top] = packages.get(top, 0.0) + own
+        return {
+            "total": end - self.__started,
+            "imports": sum(own for _, (_, own) in imports),
+            "preloaded": self.__preloaded,
+            "modules": [
+                {"module": name, "cumulative": cumulative, "self": own}
+                for name, (cumulative, own) in imports
+            ],
+            "packages": dict(sorted(packages.items(), key=lambda item: -item[1])),
+            "phases": [{"phase": name, "seconds": seconds} for name, seconds in self.__phases],
+        }
+
+    def format(self, top=report_size):
+        report = self.report()
+        lines = [
+            "startup {:.3f}s, {} modules imported in {:.3f}s ({} already loaded)".format(
+                report["total"], len(report["modules"]), report["imports"], report["preloaded"]
+            )
+        ]
+        for p in report["phases"]:
+            lines.append("  phase {:<24} {:8.3f}s".format(p["phase"], p["seconds"]))
+        for name, seconds in list(report["packages"].items())[:top]:
+            lines.append("  package {:<22} {:8.3f}s".format(name, seconds))
+        for m in report["modules"][:top]:
+            lines.append(
+                "  module {:<32} {:8.3f}s self {:8.3f}s cumulative".format(
+                    m["module"], m["self"], m["cumulative"]
+                )
+            )
+        return "\n".join(lines)
+
+    # 計測を終えて標準エラーに出す。path があればJSONでも書き出す
+    def finish(self, path=None):
+        self.stop()
+        print(self.format(), file=sys.stderr)
+        if path:
+            Path(path).write_text(json.dumps(self.report(), ensure_ascii=False, indent=2))
@@ -0,0 +1,2 @@
+from .openai_server import FakeOpenAIServer
+from .tts import FakeAudioQuery, FakeEngine
@@ -0,0 +1,194 @@
+import json
+import random
+import sys
+import threading
+import time
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+default_reply = '感情パラメーター\n{"喜び": 3, "楽しさ": 2}\nこんにちは！ぼくはずんだもんなのだ。今日もよろしくなのだ♪'
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    # ヘッジやキャンセルでクライアントが先に切るのは想定内
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+# OpenAI互換の /v1/chat/completions をローカルで返すテスト用・負荷試験用サーバ
+class FakeOpenAIServer:
+    def __init__(
+        self,
+        reply=default_reply,
+        chunk_size=4,
+        delay=0.0,
+        latency=0.0,
+        fail_first=0,
+        failure_rate=0.0,
+        host="127.0.0.1",
+        port=0,
+    ):
+        self.reply = reply
+        self.chunk_size = chunk_size
+        # delay: チャンクごとの待ち時間, latency: 応答を返し始めるまでの時間（秒 or リクエスト番号を受け取る関数）
+        self.delay = delay
+        self.latency = latency
+        self.fail_first = fail_first
+        self.failure_rate = failure_rate
+        self.requests = []
+        self.__random = random.Random(0)
+        self.__lock = threading.Lock()
+        self.__httpd = _HTTPServer((host, port), self.__handler())
+        self.__thread = None
+
+    @property
+    def host(self):
+        return self.__httpd.server_address[0]
+
+    @property
+    def port(self):
+        return self.__httpd.server_address[1]
+
+    @property
+    def url(self):
+        return "http://{}:{}/v1".format(self.host, self.port)
+
+    # 受け取ったリクエストを記録して、その通し番号を返す
+    def record(self, body):
+        with self.__lock:
+            self.requests.append(body)
+            return len(self.requests) - 1
+
+    def first_latency(self, index):
+        if callable(self.latency):
+            return self.latency(index)
+        return self.latency
+
+    def should_fail(self, index):
+        if index < self.fail_first:
+            return True
+        with self.__lock:
+            return self.__random.random() < self.failure_rate
+
+    def chunks(self):
+        for i in range(0, len(self.reply), self.chunk_size):
+            yield self.reply[i : i + self.chunk_size]
+
+    def __handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # keep-aliveで接続を使い回せるようにする
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                index = server.record(body)
+                if not self.path.endswith("/chat/completions"):
+                    self.send_error(404)
+                    return
+                time.sleep(server.first_latency(index))
+                if server.should_fail(index):
+                    self.send_error(503, "fake failure")
+                    return
+                if body.get("stream"):
+                    self.stream(body)
+                else:
+                    self.complete(body)
+
+            def complete(self, body):
+                time.sleep(server.delay)
+                payload = json.dumps(
+                    {
+                        "id": "chatcmpl-fake",
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": body.get("model"),
+                        "choices": [
+                            {
+                                "index": 0,
+                                "message": {"role": "assistant", "content": server.reply},
+                                "finish_reason": "stop",
+                            }
+                        ],
+                        "usage": {},
+                    }
+                ).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def stream(self, body):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                for chunk in server.chunks():
+                    time.sleep(server.delay)
+                    event = {
+                        "id": "chatcmpl-fake",
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": body.get("model"),
+                        "choices": [{"index": 0, "delta": {"content": chunk}, "finish_reason": None}],
+                    }
+                    self.wfile.write("data: {}\n\n".format(json.dumps(event)).encode())
+                    self.wfile.flush()
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+
+        return Handler
+
+    def start(self):
+        self.__thread = threading.Thread(target=self.__httpd.serve_forever, daemon=True)
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        self.__httpd.shutdown()
+        self.__httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def main():
+    parser = ArgumentParser(description="fake OpenAI server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("-p", "--port", type=int, default=8000)
+    parser.add_argument("--delay", type=float, default=0.05, help="seconds per chunk")
+    parser.add_argument("--latency", type=float, default=0.3, help="seconds before the first byte")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of 503 responses")
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(
+        delay=args.delay,
+        latency=args.latency,
+        failure_rate=args.failure_rate,
+        host=args.host,
+        port=args.port,
+    )
+    print("serving on {} (set OPENAI_API_BASE)".format(server.url))
+    server.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
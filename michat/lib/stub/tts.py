@@ -0,0 +1,46 @@
+import io
+import time
+import wave
+
+import numpy as np
+
+sample_rate = 24000
+
+
+class FakeAudioQuery:
+    def __init__(self, text):
+        self.text = text
+        self.speed_scale = 1.0
+        self.pitch_scale = 0.0
+        self.intonation_scale = 1.0
+        self.volume_scale = 1.0
+
+
+# EnginePoolの代わりに使う、VOICEVOXなしで決まった長さの音を返すエンジン
+class FakeEngine:
+    def __init__(self, latency=0.0, per_char=0.0, seconds_per_char=0.1):
+        # latency: 1回の合成にかかる時間, per_char: 1文字あたりに加える時間
+        self.latency = latency
+        self.per_char = per_char
+        self.seconds_per_char = seconds_per_char
+        self.queries = 0
+        self.syntheses = 0
+
+    def audio_query(self, text, speaker_id):
+        self.queries += 1
+        return FakeAudioQuery(text)
+
+    def synthesis(self, audio_query, speaker_id):
+        self.syntheses += 1
+        text = audio_query.text
+        time.sleep(self.latency + self.per_char * len(text))
+        frames = int(sample_rate * self.seconds_per_char * len(text) / audio_query.speed_scale)
+        t = np.arange(frames) / sample_rate
+        samples = (np.sin(2 * np.pi * 220 * t) * 3000 * audio_query.volume_scale).astype(np.int16)
+        out = io.BytesIO()
+        with wave.open(out, "wb") as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(sample_rate)
+            w.writeframes(samples.tobytes())
+        return out.getvalue()
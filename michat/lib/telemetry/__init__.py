@@ -0,0 +1,15 @@
+from .telemetry import (
+    Counter,
+    Histogram,
+    NullSpan,
+    Span,
+    Telemetry,
+    count,
+    disable,
+    enable,
+    get_telemetry,
+    observe,
+    prometheus_text,
+    span,
+    write_prometheus,
+)
@@ -0,0 +1,243 @@
+import bisect
+import json
+import logging
+import threading
+import time
+from pathlib import Path
+
+latency_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+ratio_buckets = (0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 5.0)
+
+logger = logging.getLogger(__name__)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, v) for k, v in pairs) + "}"
+
+
+def _format_value(v):
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help=""):
+        self.name = name
+        self.help = help
+        self.values = {}
+
+    def inc(self, value=1, **labels):
+        key = _label_key(labels)
+        self.values[key] = self.values.get(key, 0) + value
+
+    def samples(self):
+        for key, value in sorted(self.values.items()):
+            yield self.name + _format_labels(key), value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help="", buckets=latency_buckets):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        # ラベルごとに [各バケットの件数..., 合計, 件数]
+        self.values = {}
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        counts = self.values.get(key)
+        if counts is None:
+            counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-2] += value
+        counts[-1] += 1
+
+    def samples(self):
+        for key, counts in sorted(self.values.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = (("le", _format_value(bound)),)
+                yield self.name + "_bucket" + _format_labels(key, le), cumulative
+            yield self.name + "_sum" + _format_labels(key), counts[-2]
+            yield self.name + "_count" + _format_labels(key), counts[-1]
+
+
+# 処理段ごとの時間を測る。終わったらヒストグラムとトレースに書く
+class Span:
+    def __init__(self, telemetry, name, attrs):
+        self.telemetry = telemetry
+        self.name = name
+        self.attrs = attrs
+        self.start = None
+        self.duration = None
+
+    def __bool__(self):
+        return True
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.wall = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.start
+        # 途中で閉じられたストリーム（GeneratorExit）は失敗に数えない
+        if isinstance(exc, Exception):
+            self.attrs["error"] = repr(exc)
+        self.telemetry.finish(self)
+        return False
+
+
+# 無効なときに返す何もしないSpan。偽になるので、重い属性の計算は if span: で省ける
+class NullSpan:
+    def __bool__(self):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_null_span = NullSpan()
+
+
+class Telemetry:
+    def __init__(self, trace_file=None):
+        self.__lock = threading.Lock()
+        self.__metrics = {}
+        self.__trace = None
+        if trace_file is not None:
+            self.__trace = open(trace_file, "a", encoding="utf-8")
+        self.stage_seconds = self.histogram("michat_stage_seconds", "time spent in each stage")
+        self.stage_errors = self.counter("michat_stage_errors_total", "failed stage runs")
+        self.audio_seconds = self.counter(
+            "michat_audio_seconds_total", "seconds of audio transcribed or synthesized"
+        )
+        self.realtime_factor = self.histogram(
+            "michat_realtime_factor", "processing time per second of audio", ratio_buckets
+        )
+
+    def __register(self, metric):
+        with self.__lock:
+            return self.__metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help=""):
+        return self.__register(Counter(name, help))
+
+    def histogram(self, name, help="", buckets=latency_buckets):
+        return self.__register(Histogram(name, help, buckets))
+
+    def count(self, name, value=1, **labels):
+        metric = self.__metrics.get(name) or self.counter(name)
+        with self.__lock:
+            metric.inc(value, **labels)
+
+    def observe(self, name, value, **labels):
+        metric = self.__metrics.get(name) or self.histogram(name)
+        with self.__lock:
+            metric.observe(value, **labels)
+
+    def finish(self, span):
+        audio = span.attrs.get("audio_seconds")
+        with self.__lock:
+            self.stage_seconds.observe(span.duration, stage=span.name)
+            if "error" in span.attrs:
+                self.stage_errors.inc(stage=span.name)
+            if audio:
+                self.audio_seconds.inc(audio, stage=span.name)
+                self.realtime_factor.observe(span.duration / audio, stage=span.name)
+            if self.__trace is not None:
+                record = {
+                    "name": span.name,
+                    "start": span.wall,
+                    "duration": span.duration,
+                    "thread": threading.current_thread().name,
+                }
+                record.update(span.attrs)
+                self.__trace.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+                self.__trace.flush()
+
+    def prometheus(self):
+        lines = []
+        with self.__lock:
+            for metric in self.__metrics.values():
+                if metric.help:
+                    lines.append("# HELP {} {}".format(metric.name, metric.help))
+                lines.append("# TYPE {} {}".format(metric.name, metric.kind))
+                for name, value in metric.samples():
+                    lines.append("{} {}".format(name, _format_value(value)))
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        with self.__lock:
+            if self.__trace is not None:
+                self.__trace.close()
+                self.__trace = None
+
+
+_telemetry = None
+
+
+# 計測を有効にする。trace_fileを渡すとSpanを1行ずつJSONで書き出す
+def enable(trace_file=None):
+    global _telemetry
+    disable()
+    _telemetry = Telemetry(trace_file)
+    logger.info("telemetry enabled")
+    return _telemetry
+
+
+def disable():
+    global _telemetry
+    if _telemetry is not None:
+        _telemetry.close()
+    _telemetry = None
+
+
+def get_telemetry():
+    return _telemetry
+
+
+def span(name, **attrs):
+    if _telemetry is None:
+        return _null_span
+    return Span(_telemetry, name, attrs)
+
+
+def count(name, value=1, **labels):
+    if _telemetry is not None:
+        _telemetry.count(name, value, **labels)
+
+
+def observe(name, value, **labels):
+    if _telemetry is not None:
+        _telemetry.observe(name, value, **labels)
+
+
+def prometheus_text():
+    return "" if _telemetry is None else _telemetry.prometheus()
+
+
+def write_prometheus(path):
+    Path(path).write_text(prometheus_text())
@@ -1 +1,16 @@
-from .transcriber import AudioTranscriber, VoiceTranscriber
+from ..startup import lazy_exports
+
+# numpy や speech_recognition を使うモジュールは、名前に触れたときに読み込む
+__getattr__, __all__ = lazy_exports(
+    __name__,
+    {
+        ".transcriber": ["AudioTranscriber", "VoiceTranscriber", "pcm_audio_data"],
+        ".texts": ["GOODBYE_TEXT", "LISTENING_TEXT", "REQUEST_ERROR_TEXT", "STATUS_TEXTS", "UNKNOWN_VALUE_TEXT"],
+        ".backend": ["RecognitionBackend", "backend_names", "get_backend", "register_backend"],
+        ".buffer": ["PCMBuffer", "to_wav"],
+        ".vad": ["VoiceActivityDetector", "downmix"],
+        ".preprocess": ["Preprocessor", "Resampler", "preprocess_pcm"],
+        ".ingest": ["FrameIngestor"],
+        ".batch": ["BatchTranscriber", "collect_files", "completed_files", "format_summary", "transcribe_file"],
+    },
+)
@@ -0,0 +1,75 @@
+import time
+from abc import ABCMeta, abstractmethod
+
+from ..startup import lazy_import
+
+sr = lazy_import("speech_recognition")
+
+_backends = {}
+
+
+def register_backend(name):
+    def register(cls):
+        _backends[name] = cls
+        return cls
+
+    return register
+
+
+def backend_names():
+    return sorted(_backends.keys())
+
+
+def get_backend(name, **kwargs):
+    if name not in _backends:
+        raise ValueError(
+            "{} is not a valid backend: {}".format(name, ", ".join(backend_names()))
+        )
+    return _backends[name](**kwargs)
+
+
+# 音声認識のバックエンド。失敗時は speech_recognition の例外を投げる
+class RecognitionBackend(metaclass=ABCMeta):
+    def __init__(self, language="ja-JP"):
+        self.language = language
+        self.recognizer = sr.Recognizer()
+
+    @abstractmethod
+    def recognize(self, audio):
+        pass
+
+
+@register_backend("google")
+class GoogleBackend(RecognitionBackend):
+    def recognize(self, audio):
+        return self.recognizer.recognize_google(audio, language=self.language)
+
+
+# ローカルで動くWhisper（openai-whisperが必要）
+@register_backend("whisper")
+class WhisperBackend(RecognitionBackend):
+    def __init__(self, language="ja-JP", model="base"):
+        super().__init__(language)
+        self.model = model
+
+    def recognize(self, audio):
+        language = {"ja-JP": "japanese", "en-US": "english"}.get(self.language, self.language)
+        return self.recognizer.recognize_whisper(audio, model=self.model, language=language)
+
+
+# テスト用に決まった文字列を返す
+@register_backend("stub")
+class StubBackend(RecognitionBackend):
+    def __init__(self, language="ja-JP", text=None, delay=0.0):
+        super().__init__(language)
+        self.text = text
+        self.delay = delay
+
+    def recognize(self, audio):
+        time.sleep(self.delay)
+        if self.text is not None:
+            return self.text
+        seconds = len(audio.frame_data) / (audio.sample_rate * audio.sample_width)
+        if seconds == 0:
+            raise sr.UnknownValueError()
+        return "{:.2f}秒の音声".format(seconds)
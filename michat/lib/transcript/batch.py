@@ -0,0 +1,174 @@
+import json
+import logging
+import threading
+import time
+import wave
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from pathlib import Path
+
+import numpy as np
+
+from ..startup import lazy_import
+from ..telemetry import span
+from .backend import get_backend
+from .preprocess import preprocess_pcm, speech_rate
+from .transcriber import pcm_audio_data
+
+sr = lazy_import("speech_recognition")
+
+# speech_recognition の AudioFile が読める形式
+audio_suffixes = (".wav", ".aif", ".aiff", ".flac")
+# 結果の status。resume ではエラー以外を済んだものとして飛ばす
+OK = "ok"
+NO_SPEECH = "no_speech"
+ERROR = "error"
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+# ディレクトリ（再帰的に音声ファイルを探す）、またはマニフェスト（1行に1パスの .txt か "path" を持つ .jsonl）
+def collect_files(source):
+    source = Path(source)
+    if source.is_dir():
+        return sorted(p for p in source.rglob("*") if p.suffix.lower() in audio_suffixes)
+    files = []
+    for line in source.read_text().splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if source.suffix == ".jsonl":
+            line = json.loads(line)["path"]
+        path = Path(line)
+        # 相対パスはマニフェストの場所から
+        files.append(path if path.is_absolute() else source.parent / path)
+    return files
+
+
+# 書き出し済みの結果から、もう一度やらなくてよいファイルを集める。中断で途切れた最後の行は無視する
+def completed_files(output):
+    done = set()
+    output = Path(output)
+    if not output.exists():
+        return done
+    with open(output, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue
+            if result.get("status") in (OK, NO_SPEECH):
+                done.add(result["path"])
+    return done
+
+
+# WAVは自前で読んで16kHzモノラルにする。それ以外は speech_recognition に任せる
+def decode(path):
+    path = Path(path)
+    if path.suffix.lower() == ".wav":
+        with wave.open(str(path), "rb") as reader:
+            if reader.getsampwidth() == 2:
+                rate = reader.getframerate()
+                channels = reader.getnchannels()
+                samples = np.frombuffer(reader.readframes(reader.getnframes()), dtype=np.int16)
+                if rate > speech_rate or channels > 1:
+                    samples = preprocess_pcm(samples, rate, channels)
+                    rate, channels = speech_rate, 1
+                return pcm_audio_data(samples, rate, channels)
+    with sr.AudioFile(str(path)) as source:
+        return sr.Recognizer().record(source)
+
+
+# ワーカー（スレッドかプロセス）ごとにバックエンドを1つ作って使い回す
+def _backend(name, kwargs):
+    key = (name, tuple(sorted(kwargs.items())))
+    backends = _local.__dict__.setdefault("backends", {})
+    if key not in backends:
+        backends[key] = get_backend(name, **kwargs)
+    return backends[key]
+
+
+def transcribe_file(path, backend="google", backend_kwargs=None):
+    start = time.perf_counter()
+    result = {"path": str(path), "text": None, "seconds": None}
+    try:
+        audio = decode(path)
+        result["seconds"] = round(len(audio.frame_data) / (audio.sample_rate * audio.sample_width), 3)
+        recognizer = _backend(backend, backend_kwargs or {})
+        with span("transcribe", backend=type(recognizer).__name__, audio_seconds=result["seconds"]):
+            result["text"] = recognizer.recognize(audio)
+        result["status"] = OK
+    except sr.UnknownValueError:
+        result["status"] = NO_SPEECH
+    except Exception as e:
+        result["status"] = ERROR
+        result["error"] = "{}: {}".format(type(e).__name__, e)
+    result["elapsed"] = round(time.perf_counter() - start, 3)
+    return result
+
+
+# 保存済みの録音をまとめて認識し、終わった順にJSONLで書き足していく
+# 書き出しは1行ずつ flush するので、中断しても resume で続きからやり直せる
+class BatchTranscriber:
+    def __init__(self, backend="google", backend_kwargs=None, workers=4, processes=False):
+        self.backend = backend
+        self.backend_kwargs = dict(backend_kwargs or {})
+        self.workers = max(1, workers)
+        self.processes = processes
+
+    def __executor(self):
+        if self.processes:
+            return ProcessPoolExecutor(self.workers)
+        return ThreadPoolExecutor(self.workers, thread_name_prefix="transcribe")
+
+    def run(self, files, output, resume=True, on_result=None):
+        start = time.perf_counter()
+        files = [str(f) for f in files]
+        done = completed_files(output) if resume else set()
+        todo = [f for f in files if f not in done]
+        summary = {OK: 0, NO_SPEECH: 0, ERROR: 0, "skipped": len(files) - len(todo), "audio_seconds": 0.0}
+        logger.info("{} files to transcribe ({} already done)".format(len(todo), summary["skipped"]))
+
+        mode = "a" if resume else "w"
+        with open(output, mode, encoding="utf-8") as out, self.__executor() as executor:
+            if resume and out.tell() > 0 and not Path(output).read_bytes().endswith(b"\n"):
+                # 途切れた行の続きに書かないよう改行しておく
+                out.write("\n")
+            pending = set()
+            queued = iter(todo)
+            try:
+                while True:
+                    # 何千ファイルあっても、投げておくのはワーカー数の2倍まで
+                    for path in queued:
+                        pending.add(executor.submit(transcribe_file, path, self.backend, self.backend_kwargs))
+                        if len(pending) >= 2 * self.workers:
+                            break
+                    if not pending:
+                        break
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        result = future.result()
+                        out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                        out.flush()
+                        summary[result["status"]] += 1
+                        summary["audio_seconds"] += result["seconds"] or 0.0
+                        if on_result is not None:
+                            on_result(result)
+            except KeyboardInterrupt:
+                for future in pending:
+                    future.cancel()
+                raise
+        summary["elapsed"] = time.perf_counter() - start
+        return summary
+
+
+def format_summary(summary):
+    return "{} ok, {} no speech, {} errors, {} skipped: {:.1f}s of audio in {:.1f}s".format(
+        summary[OK],
+        summary[NO_SPEECH],
+        summary[ERROR],
+        summary["skipped"],
+        summary["audio_seconds"],
+        summary["elapsed"],
+    )
@@ -0,0 +1,116 @@
+import io
+import wave
+
+import numpy as np
+
+max_buffer_seconds = 60
+initial_buffer_seconds = 5
+
+
+# int16 PCMを溜めるリングバッファ。上限を超えたら古いサンプルから上書きする
+class PCMBuffer:
+    def __init__(self, max_seconds=max_buffer_seconds, initial_seconds=initial_buffer_seconds):
+        self.max_seconds = max_seconds
+        self.initial_seconds = initial_seconds
+        self.sample_rate = None
+        self.channels = None
+        self.__data = None
+        self.__start = 0
+        self.__length = 0
+
+    def __len__(self):
+        return self.__length
+
+    @property
+    def capacity(self):
+        return 0 if self.__data is None else len(self.__data)
+
+    @property
+    def max_frames(self):
+        return int(self.max_seconds * self.sample_rate)
+
+    @property
+    def duration(self):
+        if not self.sample_rate:
+            return 0.0
+        return self.__length / self.sample_rate
+
+    def clear(self):
+        self.__start = 0
+        self.__length = 0
+
+    def __configure(self, sample_rate, channels):
+        if self.sample_rate == sample_rate and self.channels == channels:
+            return
+        if self.__length > 0:
+            raise ValueError(
+                "PCM format changed: {}Hz/{}ch -> {}Hz/{}ch".format(
+                    self.sample_rate, self.channels, sample_rate, channels
+                )
+            )
+        self.sample_rate = sample_rate
+        self.channels = channels
+        frames = min(int(self.initial_seconds * sample_rate), self.max_frames)
+        self.__data = np.empty((max(frames, 1), channels), dtype=np.int16)
+        self.__start = 0
+
+    def __grow(self, needed):
+        capacity = self.capacity
+        if needed <= capacity or capacity >= self.max_frames:
+            return
+        new_capacity = min(max(capacity * 2, needed), self.max_frames)
+        data = np.empty((new_capacity, self.channels), dtype=np.int16)
+        # 伸ばすときに先頭から並べ直す
+        data[: self.__length] = self.view()
+        self.__data = data
+        self.__start = 0
+
+    # samplesはインターリーブされたint16（1次元 or (1, n)）
+    def append(self, samples, sample_rate, channels):
+        self.__configure(sample_rate, channels)
+        samples = np.asarray(samples, dtype=np.int16).reshape(-1, channels)
+        n = len(samples)
+        if n == 0:
+            return
+        self.__grow(self.__length + n)
+        capacity = self.capacity
+        if n >= capacity:
+            # 上限より長い入力は末尾だけ残す
+            self.__data[:] = samples[-capacity:]
+            self.__start = 0
+            self.__length = capacity
+            return
+
+        end = (self.__start + self.__length) % capacity
+        first = min(n, capacity - end)
+        self.__data[end : end + first] = samples[:first]
+        self.__data[: n - first] = samples[first:]
+        overflow = self.__length + n - capacity
+        if overflow > 0:
+            self.__start = (self.__start + overflow) % capacity
+            self.__length = capacity
+        else:
+            self.__length += n
+
+    # 連続した領域のビューを返す（一周していたときだけ並べ直す）
+    def view(self):
+        if self.__data is None:
+            return np.empty((0, self.channels or 1), dtype=np.int16)
+        if self.__start + self.__length > self.capacity:
+            self.__data[:] = np.roll(self.__data, -self.__start, axis=0)
+            self.__start = 0
+        return self.__data[self.__start : self.__start + self.__length]
+
+    def wav(self):
+        return to_wav(self.view(), self.sample_rate or 16000, self.channels or 1)
+
+
+def to_wav(samples, sample_rate, channels=1):
+    wav_bytes = io.BytesIO()
+    with wave.open(wav_bytes, "wb") as writer:
+        writer.setnchannels(channels)
+        writer.setsampwidth(2)
+        writer.setframerate(sample_rate)
+        writer.writeframes(memoryview(np.ascontiguousarray(samples, dtype=np.int16)).cast("B"))
+    wav_bytes.seek(0)
+    return wav_bytes
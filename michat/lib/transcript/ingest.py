@@ -0,0 +1,141 @@
+import logging
+import queue
+import threading
+
+from .preprocess import Preprocessor
+from .vad import VoiceActivityDetector
+
+# 受信側のキューを待つ時間。この間隔で止めるかどうかを確かめる
+receive_timeout = 1.0
+# この間フレームが1つも届かなければ、接続が切れたものとして止まる
+idle_timeout = 30.0
+# 取り出されるのを待つ発話の上限。溢れたら古いものから捨てる
+max_utterances = 4
+
+logger = logging.getLogger(__name__)
+
+
+# WebRTCの音声フレームを裏のスレッドで受け取ってVADに流し、区切れた発話だけをキューに入れる
+# セッションごとに1つ持ち、スクリプトのスレッドは get() で発話が届くまで眠って待つ
+# フレームは届いたそばから16kHzモノラルにしてから溜める（preprocessor=False でそのまま）
+class FrameIngestor:
+    def __init__(self, vad=None, preprocessor=None, idle_timeout=idle_timeout, max_utterances=max_utterances):
+        self.vad = vad if vad is not None else VoiceActivityDetector()
+        if preprocessor is None:
+            preprocessor = Preprocessor()
+        self.preprocessor = None if preprocessor is False else preprocessor
+        self.idle_timeout = idle_timeout
+        self.frames = 0
+        self.dropped = 0
+        self.__utterances = queue.Queue(max_utterances)
+        self.__vad_lock = threading.Lock()
+        self.__lock = threading.Lock()
+        self.__stop = threading.Event()
+        self.__thread = None
+        self.__receiver = None
+
+    @property
+    def running(self):
+        return self.__thread is not None and self.__thread.is_alive()
+
+    @property
+    def pending(self):
+        return self.__utterances.qsize()
+
+    @property
+    def sample_rate(self):
+        return self.vad.sample_rate
+
+    # 1フレームを流し込む（av.AudioFrame と同じ to_ndarray, sample_rate, layout を使う）
+    # 返り値はフレームそのままなので、audio_frame_callback としても渡せる
+    def feed(self, frame):
+        samples = frame.to_ndarray()
+        sample_rate = frame.sample_rate
+        channels = len(frame.layout.channels)
+        with self.__vad_lock:
+            if self.preprocessor is not None:
+                samples = self.preprocessor.process(samples, sample_rate, channels)
+                sample_rate, channels = self.preprocessor.sample_rate, 1
+            segments = self.vad.feed(samples, sample_rate, channels)
+        self.frames += 1
+        for segment in segments:
+            self.__put(segment)
+        return frame
+
+    # スクリプトが返答を作っている間に溜まった古い発話（返答の音声を拾ったものもある）は捨てる
+    def __put(self, segment):
+        while True:
+            try:
+                self.__utterances.put_nowait(segment)
+                return
+            except queue.Full:
+                try:
+                    self.__utterances.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    # receiver（streamlit-webrtc の audio_receiver）からの受信を裏で始める。同じ receiver なら何もしない
+    def start(self, receiver):
+        with self.__lock:
+            if self.running and self.__receiver is receiver:
+                return
+        self.stop(flush=False)
+        with self.__lock:
+            self.__receiver = receiver
+            self.__stop = threading.Event()
+            self.__thread = threading.Thread(
+                target=self.__receive, args=(receiver, self.__stop), name="frame-ingest", daemon=True
+            )
+            self.__thread.start()
+
+    def __receive(self, receiver, stop):
+        idle = 0.0
+        while not stop.is_set():
+            try:
+                frames = receiver.get_frames(timeout=receive_timeout)
+            except queue.Empty:
+                idle += receive_timeout
+                if idle >= self.idle_timeout:
+                    logger.info("no audio frames for {:.0f}s, stop receiving".format(idle))
+                    break
+                continue
+            except Exception as e:
+                logger.error("while receiving audio frames: {}".format(e))
+                break
+            idle = 0.0
+            for frame in frames:
+                self.feed(frame)
+
+    # 受信を止める。flush なら話している途中の音声も1つの発話にする
+    def stop(self, flush=True):
+        with self.__lock:
+            thread = self.__thread
+            self.__stop.set()
+            self.__thread = None
+            self.__receiver = None
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        if flush:
+            with self.__vad_lock:
+                segment = self.vad.flush()
+            if segment is not None:
+                self.__put(segment)
+
+    # 発話が届くまで、interval ごとに tick(フレームが届いているか) を呼びながら待つ。受信が止まったら None
+    # Streamlit は st が呼ばれたときにしか再実行や停止を受け付けないので、呼び出し側は tick で毎回 st を呼ぶ
+    def wait(self, interval, tick):
+        while True:
+            utterance = self.get(timeout=interval)
+            if utterance is not None or not self.running:
+                return utterance
+            tick(self.frames > 0)
+
+    # 発話が届くまで待つ。timeout までに届かなければ None
+    def get(self, timeout=None):
+        try:
+            if timeout == 0:
+                return self.__utterances.get_nowait()
+            return self.__utterances.get(timeout=timeout)
+        except queue.Empty:
+            return None
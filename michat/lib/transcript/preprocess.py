@@ -0,0 +1,130 @@
+import math
+
+import numpy as np
+
+# 音声認識に渡すサンプルレート（これより高くても認識は良くならず、送るデータが増えるだけ）
+speech_rate = 16000
+# 低域通過フィルタの片側のゼロ交差の数。多いほど急峻になる
+zero_crossings = 16
+# 一度にフィルタにかける入力のサンプル数の上限
+max_block = 4800
+# 直流成分を追従する時定数（秒）
+dc_seconds = 0.5
+# 音量の正規化（AGC）の目標、上限、追従の時定数、これより小さい音は無音として扱う
+target_db = -20.0
+max_gain_db = 20.0
+agc_seconds = 0.5
+gate_db = -50.0
+
+
+def _level_db(x):
+    return 10.0 * math.log10(float(np.mean(x * x)) + 1e-10)
+
+
+# ポリフェーズ（有理数比）のリサンプラ。チャンクごとに呼べるように、入力の末尾と位相を持ち越す
+class Resampler:
+    def __init__(self, from_rate, to_rate=speech_rate, zero_crossings=zero_crossings):
+        g = math.gcd(from_rate, to_rate)
+        self.from_rate = from_rate
+        self.to_rate = to_rate
+        self.up = to_rate // g
+        self.down = from_rate // g
+        factor = max(self.up, self.down)
+        numtaps = 2 * zero_crossings * factor + 1
+        n = np.arange(numtaps) - (numtaps - 1) / 2
+        h = np.sinc(n / factor) / factor * np.blackman(numtaps) * self.up
+        self.taps = -(-numtaps // self.up)
+        h = np.pad(h, (0, self.taps * self.up - numtaps))
+        # phases[p, j] = h[j * up + p]
+        self.__phases = h.reshape(self.taps, self.up).T.astype(np.float32)
+        self.__offsets = np.arange(self.taps)
+        self.reset()
+
+    def reset(self):
+        self.__history = np.zeros(self.taps - 1, dtype=np.float32)
+        self.__consumed = 0
+        self.__next = 0
+
+    def process(self, x):
+        x = np.asarray(x, dtype=np.float32)
+        if self.up == self.down:
+            return x
+        if len(x) > max_block:
+            # 窓を並べた行列が大きくなりすぎないよう、長い入力は区切って処理する
+            return np.concatenate([self.process(x[i : i + max_block]) for i in range(0, len(x), max_block)])
+        start = self.__consumed
+        total = start + len(x)
+        buf = np.concatenate([self.__history, x])
+        # 出力 n は、アップサンプル後の位置 n * down の入力まで揃っていれば計算できる
+        end = -(-total * self.up // self.down)
+        t = np.arange(self.__next, end, dtype=np.int64) * self.down
+        base = t // self.up - start + self.taps - 1
+        windows = buf[base[:, None] - self.__offsets[None, :]]
+        y = np.einsum("ij,ij->i", self.__phases[t % self.up], windows)
+        if self.taps > 1:
+            self.__history = buf[len(buf) - (self.taps - 1) :]
+        self.__consumed = total
+        self.__next = end
+        return y
+
+
+# 届いたフレームを順に、モノラル化、直流除去、16kHzへのリサンプル、（任意で）音量の正規化をして int16 で返す
+class Preprocessor:
+    def __init__(self, sample_rate=speech_rate, normalize=False):
+        self.sample_rate = sample_rate
+        self.normalize = normalize
+        self.__resampler = None
+        self.__dc = None
+        self.__level_db = None
+        self.__gain = 1.0
+
+    def reset(self):
+        if self.__resampler is not None:
+            self.__resampler.reset()
+        self.__dc = None
+        self.__level_db = None
+        self.__gain = 1.0
+
+    def process(self, samples, sample_rate, channels=1):
+        x = np.asarray(samples).reshape(-1, channels).astype(np.float32)
+        x = x.mean(axis=1) if channels > 1 else x.reshape(-1)
+        if len(x) == 0:
+            return np.empty(0, dtype=np.int16)
+        if self.__resampler is None or self.__resampler.from_rate != sample_rate:
+            self.__resampler = Resampler(sample_rate, self.sample_rate)
+            self.reset()
+        x = self.__remove_dc(x, sample_rate)
+        x = self.__resampler.process(x)
+        if self.normalize and len(x):
+            x = self.__agc(x)
+        return np.clip(np.rint(x), -32768, 32767).astype(np.int16)
+
+    def __remove_dc(self, x, sample_rate):
+        mean = float(x.mean())
+        if self.__dc is None:
+            self.__dc = mean
+        else:
+            self.__dc += (1.0 - math.exp(-len(x) / (dc_seconds * sample_rate))) * (mean - self.__dc)
+        return x - self.__dc
+
+    # 声のあるチャンクの音量を追いかけて、目標の音量に近づける。ゲインはチャンク内で滑らかに変える
+    def __agc(self, x):
+        level_db = _level_db(x / 32768.0)
+        if level_db > gate_db:
+            if self.__level_db is None:
+                self.__level_db = level_db
+            else:
+                rate = 1.0 - math.exp(-len(x) / (agc_seconds * self.sample_rate))
+                self.__level_db += rate * (level_db - self.__level_db)
+        gain = self.__gain
+        if self.__level_db is not None:
+            gain_db = min(max(target_db - self.__level_db, -max_gain_db), max_gain_db)
+            gain = 10.0 ** (gain_db / 20.0)
+        ramp = np.linspace(self.__gain, gain, len(x), dtype=np.float32)
+        self.__gain = gain
+        return x * ramp
+
+
+# まとまった音声を一度に処理する
+def preprocess_pcm(samples, sample_rate, channels=1, to_rate=speech_rate, normalize=False):
+    return Preprocessor(to_rate, normalize).process(samples, sample_rate, channels)
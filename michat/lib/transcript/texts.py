@@ -0,0 +1,6 @@
+UNKNOWN_VALUE_TEXT = "よくわかりません..."
+REQUEST_ERROR_TEXT = "ごめんなさい！リクエストに失敗しました..."
+LISTENING_TEXT = "Listening..."
+GOODBYE_TEXT = "ばいばい、またね"
+# 認識した発話ではなく、状態を知らせる文言
+STATUS_TEXTS = (UNKNOWN_VALUE_TEXT, REQUEST_ERROR_TEXT, LISTENING_TEXT, GOODBYE_TEXT)
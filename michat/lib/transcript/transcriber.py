@@ -1,13 +1,40 @@
 import io
+import logging
+import queue
+import threading
+import time
 from abc import ABCMeta, abstractmethod
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-import speech_recognition as sr
+import numpy as np
+
+from ..startup import lazy_import
+from ..telemetry import span
+from .backend import get_backend
+from .preprocess import preprocess_pcm, speech_rate
+from .texts import GOODBYE_TEXT, LISTENING_TEXT, REQUEST_ERROR_TEXT, UNKNOWN_VALUE_TEXT
+from .vad import downmix
+
+sr = lazy_import("speech_recognition")
+
+logger = logging.getLogger(__name__)
+
+
+def pcm_audio_data(samples, sample_rate, channels=1):
+    # モノラルで連続したint16ならコピーせずにそのまま渡す
+    samples = np.asarray(samples)
+    if channels > 1:
+        samples = downmix(samples, channels)
+    samples = np.ascontiguousarray(samples.reshape(-1), dtype=np.int16)
+    return sr.AudioData(memoryview(samples).cast("B"), sample_rate, 2)
 
 
 class Transcriber(metaclass=ABCMeta):
-    def __init__(self):
+    def __init__(self, backend="google"):
         self.recognizer = sr.Recognizer()
+        self.backend = get_backend(backend) if isinstance(backend, str) else backend
         self.input = None
 
     @property
@@ -18,47 +45,149 @@ class Transcriber(metaclass=ABCMeta):
     def input(self, v):
         self._input = v
 
+    def recognize(self, audio):
+        with span("transcribe", backend=type(self.backend).__name__) as s:
+            if s:
+                s.set(audio_seconds=len(audio.frame_data) / (audio.sample_rate * audio.sample_width))
+            try:
+                return self.backend.recognize(audio)
+            except sr.UnknownValueError:
+                s.set(result="unknown")
+                return UNKNOWN_VALUE_TEXT
+            except sr.RequestError:
+                s.set(result="request_error")
+                return REQUEST_ERROR_TEXT
+
     @abstractmethod
     def listen(self, _from):
         pass
 
 
 class VoiceTranscriber(Transcriber):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, vad=None, backend="google", workers=0, max_pending=8, paused=None):
+        super().__init__(backend)
+        # VADを渡すと発話の区切りをローカルで判定する
+        self.vad = vad
+        # workers=0 なら録音と認識を交互に行う（返答を生成している間は録音しない）
+        # 並行にすると返答中も録音し続けるので、自分の声を拾わない使い方のときだけ増やす
+        self.workers = workers
+        self.max_pending = max_pending
+        # True を返す間はマイクの音声を読み捨てる（再生中の返答を自分で拾わないように）
+        self.paused = paused
+        self.latencies = deque(maxlen=100)
+        self.__pending = None
+
+    @property
+    def queue_depth(self):
+        return 0 if self.__pending is None else self.__pending.qsize()
+
+    @property
+    def stats(self):
+        latencies = list(self.latencies)
+        return {
+            "queue_depth": self.queue_depth,
+            "recognized": len(latencies),
+            "latency_last": latencies[-1] if latencies else None,
+            "latency_avg": sum(latencies) / len(latencies) if latencies else None,
+        }
+
+    def __timed_recognize(self, audio):
+        start = time.perf_counter()
+        text = self.recognize(audio)
+        return text, time.perf_counter() - start
+
+    # 録音スレッドが発話を取り続け、認識はワーカーで並行に行う（結果は発話順）
+    def __listen_concurrent(self, utterances):
+        pending = queue.Queue(self.max_pending)
+        self.__pending = pending
+        stop = threading.Event()
+        executor = ThreadPoolExecutor(self.workers, thread_name_prefix="recognize")
+
+        def capture():
+            try:
+                for audio in utterances:
+                    if stop.is_set():
+                        return
+                    pending.put((executor.submit(self.__timed_recognize, audio), None))
+                pending.put((None, None))
+            except Exception as e:
+                if not stop.is_set():
+                    pending.put((None, e))
+
+        threading.Thread(target=capture, name="capture", daemon=True).start()
+        try:
+            while True:
+                future, error = pending.get()
+                if error is not None:
+                    raise error
+                if future is None:
+                    return
+                text, latency = future.result()
+                self.latencies.append(latency)
+                logger.debug(
+                    "recognized in {:.2f}s (queue depth: {})".format(latency, pending.qsize())
+                )
+                yield text
+        finally:
+            stop.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+            self.__pending = None
 
     @classmethod
     def default_input(cls):
         return sr.Microphone()
 
+    def __skip_paused(self, source):
+        skipped = False
+        while self.paused is not None and self.paused():
+            source.stream.read(source.CHUNK)
+            skipped = True
+        return skipped
+
+    def utterances(self, source):
+        if self.vad is None:
+            while True:
+                self.__skip_paused(source)
+                audio = self.recognizer.listen(source)
+                # 聞いている途中で再生が始まったものは捨てる
+                if not self.__skip_paused(source):
+                    yield audio
+        while True:
+            if self.__skip_paused(source):
+                self.vad.reset()
+            chunk = source.stream.read(source.CHUNK)
+            samples = np.frombuffer(chunk, dtype=np.int16)
+            for segment in self.vad.feed(samples, source.SAMPLE_RATE):
+                yield pcm_audio_data(segment, source.SAMPLE_RATE)
+
     def listen(self, _from=None):
         if _from is None:
             _from = self.default_input()
 
         with _from as source:
-            self.recognizer.adjust_for_ambient_noise(source)
+            if self.vad is None:
+                self.recognizer.adjust_for_ambient_noise(source)
+            utterances = self.utterances(source)
 
-            yield "Listening..."
+            yield LISTENING_TEXT
             try:
-                while True:
-                    try:
-                        audio = self.recognizer.listen(source)
-                        text = self.recognizer.recognize_google(audio, language="ja-JP")
-                        yield text
-                    except sr.UnknownValueError:
-                        yield "よくわかりません..."
-                    except sr.RequestError:
-                        yield "ごめんなさい！リクエストに失敗しました..."
+                if self.workers > 0:
+                    yield from self.__listen_concurrent(utterances)
+                    return
+                for audio in utterances:
+                    text, latency = self.__timed_recognize(audio)
+                    self.latencies.append(latency)
+                    yield text
 
             except KeyboardInterrupt:
-                yield "ばいばい、またね"
+                yield GOODBYE_TEXT
 
 
 class AudioTranscriber(Transcriber):
-    def __init__(self, wav=None):
+    def __init__(self, wav=None, backend="google"):
         self.wav = wav
         self.audio_file = None
-        super().__init__()
+        super().__init__(backend)
 
     @classmethod
     def default_file(cls):
@@ -69,22 +198,27 @@ class AudioTranscriber(Transcriber):
         file = cls.default_file()
         return sr.AudioFile(file)
 
-    def listen(self, _from=None):
-        try:
-            if _from is None:
-                self.audio_file = self.default_input()
-            elif isinstance(_from, io.BytesIO):
-                self.audio_file = sr.AudioFile(_from)
-
-            if self.audio_file is None:
-                self.audio_file = sr.AudioFile(self.wav)
-
-            with self.audio_file as source:
-                audio = self.recognizer.record(source)
-
-            text = self.recognizer.recognize_google(audio, language="ja-JP")
-            return text
-        except sr.UnknownValueError:
-            return "よくわかりません..."
-        except sr.RequestError:
-            return "ごめんなさい！リクエストに失敗しました..."
+    # _from はWAV(ファイル/BytesIO)、AudioData、またはPCM(ndarray/bytes)とサンプルレート
+    def listen(self, _from=None, sample_rate=None, channels=1):
+        if isinstance(_from, sr.AudioData):
+            return self.recognize(_from)
+        if sample_rate is not None:
+            if isinstance(_from, (bytes, bytearray, memoryview)):
+                _from = np.frombuffer(_from, dtype=np.int16)
+            if sample_rate > speech_rate:
+                # 認識に要らない帯域は送らない
+                _from = preprocess_pcm(_from, sample_rate, channels)
+                sample_rate, channels = speech_rate, 1
+            return self.recognize(pcm_audio_data(_from, sample_rate, channels))
+
+        if _from is None:
+            self.audio_file = self.default_input()
+        elif isinstance(_from, (io.BytesIO, str, Path)):
+            self.audio_file = sr.AudioFile(_from if isinstance(_from, io.BytesIO) else str(_from))
+
+        if self.audio_file is None:
+            self.audio_file = sr.AudioFile(self.wav)
+
+        with self.audio_file as source:
+            audio = self.recognizer.record(source)
+        return self.recognize(audio)
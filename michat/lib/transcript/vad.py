@@ -0,0 +1,148 @@
+from collections import deque
+
+import numpy as np
+
+from .buffer import PCMBuffer
+
+
+def downmix(samples, channels):
+    samples = np.asarray(samples, dtype=np.int16)
+    if channels == 1:
+        return samples.reshape(-1)
+    return samples.reshape(-1, channels).mean(axis=1).astype(np.int16)
+
+
+# フレームのエネルギーとゼロ交差率で発話区間を切り出す（ネットワーク不要）
+class VoiceActivityDetector:
+    def __init__(
+        self,
+        frame_ms=30,
+        margin_db=10.0,
+        min_level_db=-55.0,
+        max_zcr=0.4,
+        start_ms=90,
+        end_ms=600,
+        tail_ms=150,
+        pre_roll_ms=200,
+        min_speech_ms=250,
+        max_seconds=15,
+    ):
+        self.frame_ms = frame_ms
+        self.margin_db = margin_db
+        self.min_level_db = min_level_db
+        self.max_zcr = max_zcr
+        self.start_ms = start_ms
+        self.end_ms = end_ms
+        self.tail_ms = tail_ms
+        self.pre_roll_ms = pre_roll_ms
+        self.min_speech_ms = min_speech_ms
+        self.buffer = PCMBuffer(max_seconds=max_seconds)
+        self.sample_rate = None
+        self.noise_db = None
+        self.in_speech = False
+        self.__remainder = np.empty(0, dtype=np.int16)
+        self.__pre_roll = deque()
+        self.__voiced_run = 0
+        self.__silence_run = 0
+        self.__speech_frames = 0
+
+    def __frames(self, ms):
+        return max(1, int(round(ms / self.frame_ms)))
+
+    @property
+    def frame_length(self):
+        return int(self.sample_rate * self.frame_ms / 1000)
+
+    def __configure(self, sample_rate):
+        if self.sample_rate == sample_rate:
+            return
+        self.reset()
+        self.sample_rate = sample_rate
+        self.noise_db = None
+        self.__pre_roll = deque(maxlen=self.__frames(self.pre_roll_ms) + self.__frames(self.start_ms))
+
+    def reset(self):
+        self.in_speech = False
+        self.buffer.clear()
+        self.__remainder = np.empty(0, dtype=np.int16)
+        self.__pre_roll.clear()
+        self.__voiced_run = 0
+        self.__silence_run = 0
+        self.__speech_frames = 0
+
+    # まとめてフレームに分けて、エネルギー(dBFS)とゼロ交差率を計算する
+    def __analyze(self, frames):
+        x = frames.astype(np.float32) / 32768.0
+        energy_db = 10.0 * np.log10(np.mean(x * x, axis=1) + 1e-10)
+        zcr = np.mean(np.signbit(frames[:, 1:]) != np.signbit(frames[:, :-1]), axis=1)
+        return energy_db, zcr
+
+    def __is_voiced(self, energy_db, zcr):
+        if self.noise_db is None:
+            self.noise_db = energy_db
+        threshold = max(self.noise_db + self.margin_db, self.min_level_db)
+        voiced = energy_db > threshold and zcr < self.max_zcr
+        if not voiced and not self.in_speech:
+            # 無音区間で雑音レベルを追従させる
+            self.noise_db = 0.95 * self.noise_db + 0.05 * energy_db
+        return voiced
+
+    def __close(self):
+        tail = min(self.__silence_run, self.__frames(self.tail_ms))
+        length = len(self.buffer) - (self.__silence_run - tail) * self.frame_length
+        segment = None
+        if self.__speech_frames >= self.__frames(self.min_speech_ms):
+            segment = self.buffer.view()[:length, 0].copy()
+        self.in_speech = False
+        self.buffer.clear()
+        self.__pre_roll.clear()
+        self.__voiced_run = 0
+        self.__silence_run = 0
+        self.__speech_frames = 0
+        return segment
+
+    # PCMを流し込み、区切れた発話(16bitモノラル)をリストで返す
+    def feed(self, samples, sample_rate, channels=1):
+        self.__configure(sample_rate)
+        mono = downmix(samples, channels)
+        if len(self.__remainder):
+            mono = np.concatenate([self.__remainder, mono])
+        n = len(mono) // self.frame_length
+        self.__remainder = mono[n * self.frame_length :].copy()
+        if n == 0:
+            return []
+        frames = mono[: n * self.frame_length].reshape(n, self.frame_length)
+        energies, zcrs = self.__analyze(frames)
+
+        segments = []
+        for frame, energy_db, zcr in zip(frames, energies, zcrs):
+            voiced = self.__is_voiced(energy_db, zcr)
+            if not self.in_speech:
+                self.__pre_roll.append(frame)
+                self.__voiced_run = self.__voiced_run + 1 if voiced else 0
+                if self.__voiced_run >= self.__frames(self.start_ms):
+                    self.in_speech = True
+                    self.__speech_frames = self.__voiced_run
+                    for pre in self.__pre_roll:
+                        self.buffer.append(pre, sample_rate, 1)
+                    self.__pre_roll.clear()
+                continue
+
+            self.buffer.append(frame, sample_rate, 1)
+            if voiced:
+                self.__speech_frames += 1
+                self.__silence_run = 0
+            else:
+                self.__silence_run += 1
+            full = self.buffer.duration >= self.buffer.max_seconds
+            if self.__silence_run >= self.__frames(self.end_ms) or full:
+                segment = self.__close()
+                if segment is not None:
+                    segments.append(segment)
+        return segments
+
+    # ストリームが止まったときに話しかけの途中の発話を取り出す
+    def flush(self):
+        if not self.in_speech:
+            return None
+        return self.__close()
@@ -1,10 +1,29 @@
+import atexit
 from argparse import ArgumentParser
 from pathlib import Path
 
-import speech_recognition as sr
+# --profile-startup のときは lib の読み込みから測る
+from lib.startup import StartupProfiler, lazy_import
 
-from lib.speak import Audio, ChatGPT, setup_log
-from lib.transcript import VoiceTranscriber
+profiler = StartupProfiler.from_argv()
+
+from lib import telemetry  # noqa: E402
+from lib.speak import (  # noqa: E402
+    Audio,
+    ChatGPT,
+    Player,
+    concat_wav,
+    llm_backend_names,
+    load_manifest,
+    prefetch,
+    setup_log,
+    sink_names,
+    synthesize_stream,
+    warm_up,
+)
+from lib.transcript import STATUS_TEXTS, VoiceActivityDetector, VoiceTranscriber, backend_names  # noqa: E402
+
+sr = lazy_import("speech_recognition")
 
 
 def main():
@@ -22,25 +41,80 @@ def main():
     parser.add_argument(
         "-s", "--speaker-id", help="Speaker ID for the VOICEVOX model", default=3
     )
-    parser.add_argument("-o", "--output", help="wav output", default="output.wav")
+    parser.add_argument("-o", "--output", help="also write the replies to this wav file")
+    parser.add_argument(
+        "--sink", help="where to play the replies (default: $MICHAT_AUDIO_SINK or device)", choices=sink_names()
+    )
     parser.add_argument("-L", "--log-file", help="log output file", default="stdout")
     parser.add_argument("-l", "--log-level", help="logger level", default="INFO")
+    parser.add_argument(
+        "--stream", help="speak each sentence as it is generated", action="store_true"
+    )
+    parser.add_argument(
+        "--vad", help="split utterances with local voice activity detection", action="store_true"
+    )
+    parser.add_argument(
+        "--barge-in",
+        help="keep listening while a reply plays and stop it when the user speaks (use with echo cancellation)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-b", "--backend", help="speech recognition backend", choices=backend_names(), default="google"
+    )
+    parser.add_argument(
+        "--llm-backend", help="ChatGPT client", choices=llm_backend_names(), default="openai"
+    )
+    parser.add_argument(
+        "--no-warmup", help="skip loading the models and canned phrases", action="store_true"
+    )
+    parser.add_argument("--trace", help="write stage spans as JSON lines")
+    parser.add_argument("--metrics", help="write Prometheus metrics on exit")
+    parser.add_argument(
+        "--profile-startup",
+        help="report import and initialization time (and write it as JSON to FILE)",
+        nargs="?",
+        const="",
+        metavar="FILE",
+    )
     args = parser.parse_args()
 
     logger = setup_log(log_file=args.log_file, log_level=args.log_level)
+    if args.trace or args.metrics:
+        telemetry.enable(args.trace)
+        if args.metrics:
+            atexit.register(telemetry.write_prometheus, args.metrics)
 
     speaker_id = args.speaker_id
     max_token_size = args.max_tokens
     system_file = Path(args.file_system)
-    output = Path(args.output)
+    output = Path(args.output) if args.output else None
 
-    ts = VoiceTranscriber()
-    audio = Audio(speaker_id)
-    chat = ChatGPT(max_token_size)
+    # 返答は裏で再生する。--barge-in でなければ、再生中はマイクの音声を捨てて自分の声を拾わない
+    player = Player(args.sink)
+    with profiler.phase("transcriber"):
+        ts = VoiceTranscriber(
+            VoiceActivityDetector() if args.vad else None,
+            args.backend,
+            paused=None if args.barge_in else lambda: player.busy,
+        )
+    with profiler.phase("audio"):
+        audio = Audio(speaker_id)
+    with profiler.phase("chat"):
+        chat = ChatGPT(max_token_size, backend=args.llm_backend)
+    if not args.no_warmup:
+        with profiler.phase("warmup"):
+            speakers, _ = load_manifest()
+            warm_up(sorted(set(speakers) | {int(speaker_id)}))
     system_text = open(system_file, "r").read()
+    if profiler.running:
+        profiler.finish(args.profile_startup)
 
+    history = None
     logger.info("Listening...")
     for user_text in ts.listen():
+        # 話しかけられたら、再生中の返答は止める
+        if args.barge_in and isinstance(user_text, str) and user_text not in STATUS_TEXTS:
+            player.cancel()
         if isinstance(user_text, sr.UnknownValueError):
             logger.error("わかりません...")
         elif isinstance(user_text, sr.RequestError):
@@ -49,9 +123,25 @@ def main():
             logger.error(user_text)
             raise user_text
 
-        gen_text = chat.generate(system_text, user_text)
+        if args.stream:
+            stream = chat.generate_stream(system_text, user_text, history)
+            utterance = None
+            wavs = []
+            for sentence, wav in prefetch(synthesize_stream(stream.sentences(), audio)):
+                logger.info(sentence)
+                utterance = player.play(wav, utterance)
+                wavs.append(wav)
+            if output is not None and wavs:
+                output.write_bytes(concat_wav(wavs))
+            history = stream.history
+            continue
+
+        gen_text, history = chat.generate(system_text, user_text, history)
         logger.info(gen_text)
 
         audio.transform(gen_text)
-        audio.save_wav(output)
-        audio.play(output)
+        player.play(audio.get_wav())
+        if output is not None:
+            audio.save_wav(output)
+    player.wait()
+    player.close()
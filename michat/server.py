@@ -0,0 +1,38 @@
+from argparse import ArgumentParser
+from pathlib import Path
+
+import uvicorn
+
+from lib.api import create_app
+from lib.speak import setup_log
+
+
+def main():
+    progname = Path(__file__).name
+    parser = ArgumentParser(description=progname)
+    parser.add_argument("--host", help="address to bind", default="0.0.0.0")
+    parser.add_argument("-p", "--port", help="port to bind", type=int, default=8000)
+    parser.add_argument("--llm-concurrency", help="concurrent ChatGPT streams", type=int, default=8)
+    parser.add_argument("--tts-concurrency", help="concurrent syntheses", type=int, default=1)
+    parser.add_argument("--stt-concurrency", help="concurrent recognitions", type=int, default=2)
+    parser.add_argument(
+        "--max-queue", help="requests waiting per stage before 503", type=int, default=16
+    )
+    parser.add_argument("-L", "--log-file", help="log output file", default="stdout")
+    parser.add_argument("-l", "--log-level", help="logger level", default="INFO")
+    args = parser.parse_args()
+
+    setup_log(log_file=args.log_file, log_level=args.log_level)
+
+    app = create_app(
+        llm_concurrency=args.llm_concurrency,
+        tts_concurrency=args.tts_concurrency,
+        stt_concurrency=args.stt_concurrency,
+        max_queue=args.max_queue,
+    )
+    # エンジンとセッションはプロセス内で共有するので、ワーカーは1つにする
+    uvicorn.run(app, host=args.host, port=args.port, workers=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,29 @@
+import atexit
 from argparse import ArgumentParser
 from pathlib import Path
 import pprint
 
-from lib.speak import Audio, ChatGPTWithEmotion, setup_log
+# --profile-startup のときは lib の読み込みから測る
+from lib.startup import StartupProfiler
+
+profiler = StartupProfiler.from_argv()
+
+from lib import telemetry  # noqa: E402
+from lib.speak import (  # noqa: E402
+    Audio,
+    BatchPipeline,
+    ChatGPTWithEmotion,
+    Player,
+    concat_wav,
+    llm_backend_names,
+    load_manifest,
+    numbered_path,
+    prefetch,
+    setup_log,
+    sink_names,
+    synthesize_stream,
+    warm_up,
+)
 
 
 def main():
@@ -20,35 +41,131 @@ def main():
     parser.add_argument(
         "-s", "--speaker-id", help="Speaker ID for the VOICEVOX model", default=3
     )
-    parser.add_argument("-o", "--output", help="wav output", default="output.wav")
+    parser.add_argument("-o", "--output", help="also write the replies to this wav file")
+    parser.add_argument(
+        "--sink", help="where to play the replies (default: $MICHAT_AUDIO_SINK or device)", choices=sink_names()
+    )
     parser.add_argument("-L", "--log-file", help="log output file", default="stdout")
     parser.add_argument("-l", "--log-level", help="logger level", default="INFO")
+    parser.add_argument(
+        "--stream", help="speak each sentence as it is generated", action="store_true"
+    )
+    parser.add_argument(
+        "--batch", help="run the files through a pipelined batch", action="store_true"
+    )
+    parser.add_argument(
+        "--independent",
+        help="treat each file as a separate conversation (batch mode)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-w", "--workers", help="parallel LLM requests (batch mode)", type=int, default=4
+    )
+    parser.add_argument(
+        "--no-play", help="only write wav files (batch mode)", action="store_true"
+    )
+    parser.add_argument(
+        "--llm-backend", help="ChatGPT client", choices=llm_backend_names(), default="openai"
+    )
+    parser.add_argument(
+        "--no-warmup", help="skip loading the models and canned phrases", action="store_true"
+    )
+    parser.add_argument("--trace", help="write stage spans as JSON lines")
+    parser.add_argument("--metrics", help="write Prometheus metrics on exit")
+    parser.add_argument(
+        "--profile-startup",
+        help="report import and initialization time (and write it as JSON to FILE)",
+        nargs="?",
+        const="",
+        metavar="FILE",
+    )
     args = parser.parse_args()
 
     logger = setup_log(log_file=args.log_file, log_level=args.log_level)
+    if args.trace or args.metrics:
+        telemetry.enable(args.trace)
+        if args.metrics:
+            atexit.register(telemetry.write_prometheus, args.metrics)
 
     speaker_id = args.speaker_id
     max_token_size = args.max_tokens
     system_file = Path(args.file_system)
     user_files = args.files.split(",")
-    output = Path(args.output)
+    output = Path(args.output) if args.output else None
 
     system_text = open(system_file, "r").read()
     user_texts = [open(Path(user_file), "r").read() for user_file in user_files]
 
-    chat = ChatGPTWithEmotion(max_token_size)
-    history = None
-    for user_text in user_texts:
-        # ChatGPTで文章の生成
-        gen_text, history, params = chat.generate(system_text, user_text, history)
-        logger.info(gen_text)
-        logger.info(history)
-        logger.info(params)
-        # 音声出力
-        audio = Audio(speaker_id)
-        audio.transform(gen_text)
-        audio.save_wav(output)
-        audio.play(output)
+    with profiler.phase("chat"):
+        chat = ChatGPTWithEmotion(max_token_size, backend=args.llm_backend)
+    if not args.no_warmup:
+        with profiler.phase("warmup"):
+            speakers, _ = load_manifest()
+            warm_up(sorted(set(speakers) | {int(speaker_id)}))
+    if profiler.running:
+        profiler.finish(args.profile_startup)
+    if args.batch:
+        batch(args, logger, chat, system_text, user_texts)
+        return
+
+    audio = Audio(speaker_id)
+    # 再生は裏で続け、その間に次の入力の生成と合成を進める
+    with Player(args.sink) as player:
+        history = None
+        for user_text in user_texts:
+            if args.stream:
+                # 文ごとに生成・合成・再生を重ねる
+                stream = chat.generate_stream(system_text, user_text, history)
+                utterance = None
+                wavs = []
+                for sentence, wav in prefetch(synthesize_stream(stream.sentences(), audio)):
+                    logger.info(sentence)
+                    utterance = player.play(wav, utterance)
+                    wavs.append(wav)
+                if output is not None and wavs:
+                    output.write_bytes(concat_wav(wavs))
+                history = stream.history
+                logger.info(history)
+                logger.info(stream.params)
+                continue
+            # ChatGPTで文章の生成
+            gen_text, history, params = chat.generate(system_text, user_text, history)
+            logger.info(gen_text)
+            logger.info(history)
+            logger.info(params)
+            # 音声出力
+            audio.transform(gen_text)
+            player.play(audio.get_wav())
+            if output is not None:
+                audio.save_wav(output)
+        player.wait()
+
+
+def batch(args, logger, chat, system_text, user_texts):
+    player = Player("null" if args.no_play else args.sink)
+
+    def sink(item):
+        if args.output:
+            item.output = numbered_path(args.output, item.index)
+            item.output.write_bytes(item.wav)
+        logger.info("{}: {}".format(item.output or item.index, item.gen_text))
+        logger.info(item.params)
+        player.play(item.wav)
+
+    pipeline = BatchPipeline(
+        chat,
+        lambda: Audio(args.speaker_id),
+        system_text,
+        sink,
+        chained=not args.independent,
+        llm_workers=args.workers,
+    )
+    items = pipeline.run(user_texts)
+    for item in items:
+        if item.error is not None:
+            logger.error("input {} failed: {}".format(item.index, item.error))
+    logger.info(pipeline.report())
+    player.close()
 
 
 if __name__ == "__main__":
@@ -1,11 +1,80 @@
-from lib.transcript import VoiceTranscriber
+from argparse import ArgumentParser
+from pathlib import Path
+
+# --profile-startup のときは lib の読み込みから測る
+from lib.startup import StartupProfiler
+
+profiler = StartupProfiler.from_argv()
+
+from lib.transcript import (  # noqa: E402
+    BatchTranscriber,
+    VoiceActivityDetector,
+    VoiceTranscriber,
+    backend_names,
+    collect_files,
+    format_summary,
+)
 
 
 def main():
-    ts = VoiceTranscriber()
+    progname = Path(__file__).name
+    parser = ArgumentParser(description=progname)
+    parser.add_argument(
+        "--vad", help="split utterances with local voice activity detection", action="store_true"
+    )
+    parser.add_argument(
+        "-b", "--backend", help="speech recognition backend", choices=backend_names(), default="google"
+    )
+    parser.add_argument(
+        "-w", "--workers", help="concurrent recognitions (0: serial)", type=int, default=2
+    )
+    parser.add_argument(
+        "-i", "--input", help="transcribe the recordings in a directory or listed in a manifest (.txt/.jsonl)"
+    )
+    parser.add_argument(
+        "-o", "--output", help="JSON lines output (with --input)", default="transcripts.jsonl"
+    )
+    parser.add_argument(
+        "--processes", help="use worker processes instead of threads (with --input)", action="store_true"
+    )
+    parser.add_argument(
+        "--no-resume", help="start over instead of skipping files already in the output", action="store_true"
+    )
+    parser.add_argument(
+        "--profile-startup",
+        help="report import and initialization time (and write it as JSON to FILE)",
+        nargs="?",
+        const="",
+        metavar="FILE",
+    )
+    args = parser.parse_args()
+    if args.input:
+        if profiler.running:
+            profiler.finish(args.profile_startup)
+        batch(args)
+        return
+
+    with profiler.phase("transcriber"):
+        ts = VoiceTranscriber(
+            VoiceActivityDetector() if args.vad else None, args.backend, workers=args.workers
+        )
+    if profiler.running:
+        profiler.finish(args.profile_startup)
     for text in ts.listen():
         print(text)
 
 
+def batch(args):
+    files = collect_files(args.input)
+    transcriber = BatchTranscriber(args.backend, workers=args.workers, processes=args.processes)
+    summary = transcriber.run(
+        files,
+        args.output,
+        resume=not args.no_resume,
+        on_result=lambda result: print("{}: {}".format(result["path"], result["text"] or result["status"])),
+    )
+    print(format_summary(summary))
+
+
 if __name__ == '__main__':
     main()
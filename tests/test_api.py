@@ -0,0 +1,122 @@
+import asyncio
+import json
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from michat.lib.api import Limiter, Overloaded, VoiceService, create_app
+from michat.lib.api.api import ChatRequest, TTSRequest
+from michat.lib.speak import Audio, ChatGPTWithEmotion, get_llm_backend
+from michat.lib.stub import FakeEngine, FakeOpenAIServer
+from michat.lib.transcript import AudioTranscriber, get_backend
+
+
+def events(text):
+    parsed = []
+    for block in text.strip().split("\n\n"):
+        name, data = block.split("\n")
+        parsed.append((name[len("event: ") :], json.loads(data[len("data: ") :])))
+    return parsed
+
+
+@pytest.fixture
+def client():
+    engine = FakeEngine(seconds_per_char=0.01)
+    with FakeOpenAIServer() as server:
+        backend = get_llm_backend("openai", api_key="test", api_base=server.url)
+        service = VoiceService(
+            chat=ChatGPTWithEmotion(128, completion_cache=False, backend=backend),
+            audio_factory=lambda speaker_id: Audio(speaker_id, pool=engine, cache=False),
+            transcriber_factory=lambda: AudioTranscriber(backend=get_backend("stub", text="こんにちは")),
+        )
+        with TestClient(create_app(service)) as client:
+            yield client
+
+
+def test_health(client):
+    assert client.get("/healthz").json() == {"status": "ok"}
+    ready = client.get("/readyz")
+    assert ready.status_code == 200
+    assert ready.json()["queues"]["tts"]["active"] == 0
+
+
+def test_chat_streams_sentences_and_keeps_the_session(client):
+    response = client.post("/chat", json={"user_text": "こんにちは"})
+    assert response.headers["content-type"].startswith("text/event-stream")
+    parsed = events(response.text)
+    assert [name for name, _ in parsed] == ["sentence"] * 3 + ["done"]
+    done = parsed[-1][1]
+    assert done["emotions"] == {"喜び": 3, "楽しさ": 2}
+
+    client.post("/chat", json={"user_text": "またね", "session": done["session"]})
+    history = client.app.state.service.sessions.get(done["session"])
+    assert [m["content"] for m in history if m["role"] == "user"] == ["こんにちは", "またね"]
+
+
+def test_tts_streams_wav(client):
+    response = client.post("/tts", json={"text": "こんにちは。なのだ"})
+    assert response.headers["content-type"] == "audio/wav"
+    body = response.content
+    assert body[:4] == b"RIFF"
+    # 44バイトのヘッダの後に2文ぶんのPCM（1文字0.01秒、24kHz、16bit）
+    assert len(body) - 44 == 2 * int(24000 * 0.01 * 6) + 2 * int(24000 * 0.01 * 3)
+
+
+def test_stt_and_turn(client):
+    pcm = np.zeros(1600, dtype=np.int16).tobytes()
+    response = client.post("/stt?sample_rate=16000", content=pcm)
+    assert response.json() == {"text": "こんにちは"}
+
+    response = client.post("/turn?sample_rate=16000", content=pcm)
+    parsed = events(response.text)
+    assert parsed[0] == ("transcript", {"text": "こんにちは"})
+    sentence = parsed[1][1]
+    assert client.get(sentence["audio"]).content[:4] == b"RIFF"
+    assert parsed[-1][0] == "done"
+
+
+def test_bad_requests(client):
+    assert client.post("/stt", content=b"\x00\x00").status_code == 400
+    assert client.post("/chat", json={"user_text": "a", "feature": "nobody"}).status_code == 400
+    assert client.post("/tts", json={"text": "a", "format": "flac"}).status_code == 400
+
+
+def test_limiter_rejects_when_the_queue_is_full():
+    async def scenario():
+        limiter = Limiter("tts", concurrency=1, max_queue=1)
+        await limiter.acquire()
+        waiter = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        assert limiter.saturated
+        with pytest.raises(Overloaded):
+            await limiter.acquire()
+        limiter.release()
+        await waiter
+        limiter.release()
+        return limiter.stats
+
+    stats = asyncio.run(scenario())
+    assert stats["rejected"] == 1
+    assert stats["active"] == 0
+
+
+def test_unread_responses_do_not_hold_a_slot(client):
+    service = client.app.state.service
+    routes = {route.path: route.endpoint for route in client.app.routes}
+
+    async def scenario():
+        # クライアントが本文を読む前に切れた場合と同じく、イテレータを始めずに捨てる
+        for _ in range(service.llm.concurrency):
+            await routes["/chat"](ChatRequest(user_text="こんにちは"))
+        for _ in range(service.tts.concurrency):
+            await routes["/tts"](TTSRequest(text="こんにちは"))
+        response = await routes["/chat"](ChatRequest(user_text="こんにちは"))
+        body = [chunk async for chunk in response.body_iterator]
+        return body, service.llm.stats, service.tts.stats
+
+    body, llm, tts = asyncio.run(scenario())
+    assert "done" in body[-1]
+    assert llm["active"] == llm["waiting"] == 0
+    assert tts["active"] == tts["waiting"] == 0
+    assert client.get("/readyz").status_code == 200
@@ -0,0 +1,36 @@
+import queue
+import time
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("streamlit_webrtc")
+
+from michat.lib.bench.harness import HeadlessStreamlit, entry_point, lib_module, patched  # noqa: E402
+
+
+class Rerun(Exception):
+    pass
+
+
+# 停止や再実行が待っているとき、Streamlitは次の st の呼び出しで例外を投げる
+class PendingRerun(HeadlessStreamlit):
+    def warning(self, *args, **kwargs):
+        raise Rerun()
+
+
+def test_listen_yields_to_streamlit_every_interval():
+    app = entry_point("app")
+    ingestor = lib_module("transcript").FrameIngestor()
+    receiver = SimpleNamespace(get_frames=queue.Queue().get)
+    ctx = SimpleNamespace(state=SimpleNamespace(playing=True), audio_receiver=receiver)
+    st = PendingRerun({app.INGESTOR: ingestor})
+    try:
+        with patched(app, st=st, webrtc_streamer=lambda **kwargs: ctx, LISTEN_INTERVAL=0.2):
+            recorder = app.WebRTCRecorder()
+            start = time.perf_counter()
+            with pytest.raises(Rerun):
+                recorder.listen()
+            assert time.perf_counter() - start < 0.4
+    finally:
+        ingestor.stop(flush=False)
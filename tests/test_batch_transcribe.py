@@ -0,0 +1,74 @@
+import json
+import wave
+
+import numpy as np
+
+from michat.lib.transcript import BatchTranscriber, collect_files, completed_files, transcribe_file
+
+
+def write_wav(path, seconds, rate=48000, channels=2):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    samples = (np.random.default_rng(0).standard_normal(int(rate * seconds) * channels) * 3000).astype(np.int16)
+    with wave.open(str(path), "wb") as writer:
+        writer.setnchannels(channels)
+        writer.setsampwidth(2)
+        writer.setframerate(rate)
+        writer.writeframes(samples.tobytes())
+    return path
+
+
+def read(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def test_collect_files_from_a_directory_and_a_manifest(tmp_path):
+    a = write_wav(tmp_path / "rec" / "a.wav", 0.1)
+    b = write_wav(tmp_path / "rec" / "day2" / "b.wav", 0.1)
+    (tmp_path / "rec" / "notes.txt").write_text("not audio")
+    assert collect_files(tmp_path / "rec") == [a, b]
+
+    manifest = tmp_path / "list.jsonl"
+    manifest.write_text('{"path": "rec/a.wav"}\n{"path": "%s"}\n' % b)
+    assert collect_files(manifest) == [a, b]
+
+
+def test_decodes_to_16k_and_reports_failures(tmp_path):
+    result = transcribe_file(write_wav(tmp_path / "a.wav", 1.5), "stub")
+    assert result["status"] == "ok"
+    assert result["text"] == "1.50秒の音声"
+    assert result["seconds"] == 1.5
+
+    missing = transcribe_file(tmp_path / "missing.wav", "stub")
+    assert missing["status"] == "error"
+    assert "FileNotFoundError" in missing["error"]
+
+
+def test_batch_streams_jsonl_and_resumes(tmp_path):
+    files = [write_wav(tmp_path / "rec" / "{}.wav".format(i), 0.1 * (i + 1)) for i in range(6)]
+    output = tmp_path / "out.jsonl"
+    # 中断されて途中まで書けていた状態（最後の行は途切れている）
+    first = transcribe_file(files[0], "stub")
+    output.write_text(json.dumps(first, ensure_ascii=False) + '\n{"path": "' + str(files[1]))
+    assert completed_files(output) == {str(files[0])}
+
+    seen = []
+    summary = BatchTranscriber("stub", workers=3).run(files, output, on_result=seen.append)
+    assert summary["ok"] == 5
+    assert summary["skipped"] == 1
+    assert len(seen) == 5
+    lines = output.read_text().splitlines()
+    # 途切れた行はそのまま残り、その後ろに1行ずつ書き足される
+    assert lines[1] == '{"path": "' + str(files[1])
+    results = [json.loads(line) for i, line in enumerate(lines) if i != 1]
+    assert sorted(r["path"] for r in results if r["status"] == "ok") == sorted(str(f) for f in files)
+
+    again = BatchTranscriber("stub", workers=3).run(files, output)
+    assert again["skipped"] == 6 and again["ok"] == 0
+
+
+def test_batch_with_processes(tmp_path):
+    files = [write_wav(tmp_path / "{}.wav".format(i), 0.2, rate=16000, channels=1) for i in range(3)]
+    output = tmp_path / "out.jsonl"
+    summary = BatchTranscriber("stub", workers=2, processes=True).run(files, output, resume=False)
+    assert summary["ok"] == 3
+    assert {r["text"] for r in read(output)} == {"0.20秒の音声"}
@@ -0,0 +1,52 @@
+import pytest
+
+from michat.lib.bench import Benchmark, compare, percentiles
+
+
+def quick(scenario, **kwargs):
+    options = dict(
+        turns=3,
+        warmup=1,
+        stt_latency=0.0,
+        llm_latency=0.01,
+        chunk_delay=0.0,
+        tts_latency=0.01,
+        tts_per_char=0.0,
+    )
+    options.update(kwargs)
+    return Benchmark(scenario, **options).run()
+
+
+@pytest.mark.parametrize("scenario", Benchmark.scenarios)
+def test_benchmark_scenarios(scenario):
+    if scenario == "webrtc":
+        pytest.importorskip("streamlit_webrtc")
+    result = quick(scenario)
+    assert len(result["turns"]) == 3
+    for turn in result["turns"]:
+        assert 0 < turn["first_text"] <= turn["first_audio"] <= turn["total"]
+        assert turn["memory"] > 0
+    assert set(result["summary"]["total"]) >= {"p50", "p90", "p95", "p99", "max"}
+    assert ("stt" in result["summary"]) == (scenario != "speaker")
+    # 各段の時間は、動かしたエントリポイントのSpanから取っている
+    assert {"generate", "query", "synthesis"} <= set(result["stages"])
+    assert ("playback" in result["stages"]) == (scenario != "webrtc")
+
+
+def test_benchmark_without_stream():
+    result = quick("speaker", stream=False, trace_memory=False)
+    assert "memory" not in result["summary"]
+    assert result["summary"]["first_audio"]["p50"] > result["summary"]["first_text"]["p50"]
+
+
+def test_percentiles():
+    p = percentiles(list(range(1, 101)))
+    assert p["p50"] == pytest.approx(50.5)
+    assert p["max"] == 100
+    assert percentiles([]) == {}
+
+
+def test_compare_reports_regressions():
+    baseline = {"summary": {"total": {"p50": 1.0, "p95": 2.0}}}
+    result = {"summary": {"total": {"p50": 1.05, "p95": 3.0}, "stt": {"p50": 1.0}}}
+    assert compare(result, baseline) == [("total", "p95", 2.0, 3.0)]
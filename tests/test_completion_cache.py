@@ -0,0 +1,34 @@
+import openai
+
+from michat.lib.speak import ChatGPTWithEmotion, CompletionCache
+from michat.lib.stub import FakeOpenAIServer
+
+
+def test_completion_cache_ttl_and_persistence(tmp_path):
+    path = tmp_path / "completions.sqlite3"
+    cache = CompletionCache(path, ttl=60)
+    key = CompletionCache.key("gpt-3.5-turbo", 0, 256, [{"role": "user", "content": "hi"}])
+    assert cache.get(key) is None
+    cache.put(key, "hello", latency=1.5)
+    assert CompletionCache(path).get(key) == "hello"
+    assert cache.get(key) == "hello"
+    assert cache.stats["hit_rate"] == 0.5
+    assert cache.stats["saved_seconds"] == 1.5
+    assert CompletionCache(path, ttl=-1).get(key) is None
+
+
+def test_chat_uses_cache_for_same_prompt(monkeypatch, tmp_path):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    cache = CompletionCache(tmp_path / "completions.sqlite3")
+    with FakeOpenAIServer() as server:
+        monkeypatch.setattr(openai, "api_base", server.url)
+        chat = ChatGPTWithEmotion(512, completion_cache=cache)
+        first = chat.generate("system", "こんにちは")
+        second = chat.generate("system", "こんにちは")
+        stream = chat.generate_stream("system", "こんにちは")
+        sentences = list(stream.sentences())
+    assert first == second
+    assert sentences[0] == "こんにちは！"
+    assert stream.params == first[2]
+    assert len(server.requests) == 1
+    assert cache.stats["hits"] == 2
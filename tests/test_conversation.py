@@ -0,0 +1,41 @@
+from michat.lib.speak import ConversationStore
+
+
+def test_turns_are_numbered_per_session(tmp_path):
+    store = ConversationStore(tmp_path / "c.sqlite3")
+    assert store.append("a", "こんにちは", "やあ", {"喜び": 1}) == 1
+    assert store.append("a", "元気？", "元気なのだ") == 2
+    assert store.append("b", "はじめまして", "よろしく") == 1
+    assert store.count("a") == 2
+    assert store.count("b") == 1
+    latest = store.latest("a")
+    assert (latest.turn, latest.user_text, latest.bot_text) == (2, "元気？", "元気なのだ")
+    assert store.turns("a")[0].emotions == {"喜び": 1}
+    assert store.latest("nobody") is None
+
+
+def test_paged_reads(tmp_path):
+    store = ConversationStore(tmp_path / "c.sqlite3")
+    for i in range(1, 51):
+        store.append("s", "u{}".format(i), "b{}".format(i))
+    page = store.turns("s", limit=20)
+    assert [t.turn for t in page] == list(range(31, 51))
+    older = store.turns("s", limit=20, before=page[0].turn)
+    assert [t.turn for t in older] == list(range(11, 31))
+    assert [t.turn for t in store.turns("s", limit=20, before=11)] == list(range(1, 11))
+
+
+def test_history_and_persistence(tmp_path):
+    path = tmp_path / "c.sqlite3"
+    store = ConversationStore(path)
+    history = [{"role": "user", "content": "こんにちは"}, {"role": "assistant", "content": "やあ"}]
+    store.append("s", "こんにちは", "やあ", history=history)
+    assert store.history("s") == history
+    assert store.history("other") == []
+    store.close()
+
+    reopened = ConversationStore(path)
+    assert reopened.history("s") == history
+    assert reopened.count("s") == 1
+    (mode,) = reopened._ConversationStore__db.execute("PRAGMA journal_mode").fetchone()
+    assert mode == "wal"
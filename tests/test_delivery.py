@@ -0,0 +1,95 @@
+import urllib.request
+
+import pytest
+
+from michat.lib.speak import AudioServer, AudioStream, concat_wav, delivery_available, encode, encoder_available
+from michat.lib.speak.delivery import read_pcm
+from michat.lib.stub import FakeAudioQuery, FakeEngine
+
+engine = FakeEngine(seconds_per_char=0.01)
+
+
+def wav(text):
+    return engine.synthesis(FakeAudioQuery(text), 3)
+
+
+def test_stream_passes_pcm_through_the_encoder():
+    # catをエンコーダの代わりにして、PCMがそのまま出てくるのを確かめる
+    stream = AudioStream("ogg", command=["cat"])
+    parts = [wav("こんにちは"), wav("なのだ")]
+    for part in parts:
+        stream.write(part)
+    stream.close()
+    assert stream.read(timeout=5) == b"".join(read_pcm(p)[0] for p in parts)
+    assert stream.done
+
+
+def test_server_streams_sentences_before_the_reply_ends():
+    with AudioServer(host="127.0.0.1", port=0) as server:
+        stream = server.open("mp3", command=["cat"])
+        first = wav("こんにちは")
+        stream.write(first)
+        url = server.url(stream)
+        assert url.endswith(".mp3")
+        with urllib.request.urlopen(url, timeout=5) as response:
+            assert response.headers["Content-Type"] == "audio/mpeg"
+            # 返答が終わる前に最初の文が届く
+            head = response.read(len(read_pcm(first)[0]))
+            stream.write(wav("なのだ"))
+            stream.close()
+            rest = response.read()
+    assert head == read_pcm(first)[0]
+    assert len(rest) == len(read_pcm(wav("なのだ"))[0])
+
+
+def test_server_falls_back_to_wav_when_the_encoder_fails():
+    with AudioServer(host="127.0.0.1", port=0) as server:
+        # 何も出さずに失敗するエンコーダ
+        stream = server.open("ogg", command=["sh", "-c", "exit 1"])
+        parts = [wav("こんにちは"), wav("なのだ")]
+        for part in parts:
+            stream.write(part)
+        stream.close()
+        with urllib.request.urlopen(server.url(stream), timeout=5) as response:
+            assert response.headers["Content-Type"] == "audio/wav"
+            body = response.read()
+    assert stream.failed
+    assert body == concat_wav(parts)
+
+
+def test_stream_keeps_wavs_when_the_encoder_is_missing():
+    stream = AudioStream("ogg", command=["michat-no-such-encoder"])
+    stream.write(wav("こんにちは"))
+    stream.close()
+    assert stream.failed
+    assert stream.read(timeout=5) == b""
+    assert stream.wav(timeout=5) == concat_wav([wav("こんにちは")])
+
+
+def test_delivery_needs_a_reachable_url(monkeypatch):
+    monkeypatch.setattr("michat.lib.speak.delivery.encoder_available", lambda: True)
+    assert delivery_available("localhost", None)
+    assert not delivery_available("michat.example.com", None)
+    assert delivery_available("michat.example.com", "https://michat.example.com/audio-server")
+
+
+# ffmpeg があっても、MICHAT_AUDIO_BASE_URL もブラウザの接続先もなければ WAV で返す
+def test_delivery_without_a_base_url(monkeypatch):
+    monkeypatch.setattr("michat.lib.speak.delivery.encoder_available", lambda: True)
+    assert not delivery_available()
+    assert not delivery_available(base_url=None)
+
+
+def test_server_unknown_stream():
+    with AudioServer(host="127.0.0.1", port=0) as server:
+        with pytest.raises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen(server.base_url + "/audio/0123.ogg", timeout=5)
+    assert e.value.code == 404
+
+
+@pytest.mark.skipif(not encoder_available(), reason="ffmpeg is not installed")
+def test_encode_opus_is_smaller():
+    source = wav("こんにちは、ぼくはずんだもんなのだ")
+    encoded = encode(source, "ogg", "32k")
+    assert encoded.startswith(b"OggS")
+    assert len(encoded) < len(source) / 4
@@ -0,0 +1,44 @@
+from types import SimpleNamespace
+
+from michat.lib.speak import engine
+
+
+class FakeCore:
+    instances = 0
+
+    def __init__(self, **kwargs):
+        FakeCore.instances += 1
+        self.loaded = []
+
+    def load_model(self, speaker_id):
+        self.loaded.append(speaker_id)
+
+    def audio_query(self, text, speaker_id):
+        return (text, speaker_id)
+
+    def synthesis(self, audio_query, speaker_id):
+        return b"RIFF"
+
+
+fake_voicevox_core = SimpleNamespace(AccelerationMode=SimpleNamespace(AUTO="auto"), VoicevoxCore=FakeCore)
+
+
+def test_engine_pool_initializes_once(monkeypatch):
+    monkeypatch.setattr(engine, "voicevox_core", fake_voicevox_core)
+    FakeCore.instances = 0
+    pool = engine.EnginePool(max_models=2)
+    for _ in range(3):
+        query = pool.audio_query("こんにちは", 3)
+        pool.synthesis(query, 3)
+    assert FakeCore.instances == 1
+    assert pool.core.loaded == [3]
+
+
+def test_engine_pool_evicts_lru(monkeypatch):
+    monkeypatch.setattr(engine, "voicevox_core", fake_voicevox_core)
+    pool = engine.EnginePool(max_models=2)
+    pool.load(1)
+    pool.load(2)
+    pool.load(1)
+    pool.load(3)
+    assert pool.loaded_models == [1, 3]
@@ -0,0 +1,34 @@
+from michat.lib.speak import HistoryManager, count_tokens
+
+
+def turns(n, text="ずんだもちはおいしいのだ。" * 5):
+    history = []
+    for i in range(n):
+        history.append({"role": "user", "content": "質問{} {}".format(i, text)})
+        history.append({"role": "assistant", "content": "答え{} {}".format(i, text)})
+    return history
+
+
+def test_count_tokens():
+    assert count_tokens("") == 0
+    assert count_tokens("hello world") == 4
+    assert count_tokens("こんにちは") == 6
+
+
+def test_history_within_budget_is_untouched():
+    manager = HistoryManager(budget=2048)
+    history = turns(2)
+    assert manager.fit("system", "こんにちは", history) is history
+
+
+def test_history_is_folded_into_summary():
+    manager = HistoryManager(budget=600, summary_budget=100)
+    history = manager.fit("system", "こんにちは", turns(10))
+    assert HistoryManager.is_summary(history[0])
+    assert history[-1]["content"].startswith("答え9")
+    assert len(history) % 2 == 1
+    assert manager.count_messages(history) + count_tokens("system こんにちは") <= 600
+    # 要約は次のターンでも引き継がれる
+    history = manager.fit("system", "またね", history + turns(3))
+    assert HistoryManager.is_summary(history[0])
+    assert manager.count_messages(history[:1]) <= 100 + 4
@@ -0,0 +1,141 @@
+import queue
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from michat.lib.transcript import FrameIngestor
+
+RATE = 16000
+
+
+class FakeFrame:
+    def __init__(self, samples, channels=1):
+        self.samples = samples
+        self.sample_rate = RATE
+        self.layout = SimpleNamespace(channels=[None] * channels)
+
+    def to_ndarray(self):
+        return self.samples.reshape(1, -1)
+
+
+# streamlit-webrtc の audio_receiver と同じ get_frames(timeout) を持つ
+class FakeReceiver:
+    def __init__(self):
+        self.frames = queue.Queue()
+        self.calls = 0
+
+    def get_frames(self, timeout=None):
+        self.calls += 1
+        return [self.frames.get(timeout=timeout)]
+
+    def send(self, samples, chunk=320):
+        for i in range(0, len(samples), chunk):
+            self.frames.put(FakeFrame(samples[i : i + chunk]))
+
+
+def silence(seconds, level=30):
+    rng = np.random.default_rng(0)
+    return (rng.standard_normal(int(RATE * seconds)) * level).astype(np.int16)
+
+
+def tone(seconds, freq=220, level=8000):
+    t = np.arange(int(RATE * seconds)) / RATE
+    return (np.sin(2 * np.pi * freq * t) * level).astype(np.int16)
+
+
+def test_utterances_arrive_from_the_background_thread():
+    ingestor = FrameIngestor()
+    receiver = FakeReceiver()
+    ingestor.start(receiver)
+    assert ingestor.get(timeout=0) is None
+
+    receiver.send(np.concatenate([silence(1), tone(0.8), silence(1)]))
+    utterance = ingestor.get(timeout=5)
+    assert 0.8 <= len(utterance) / RATE < 1.2
+    assert ingestor.sample_rate == RATE
+
+    # 同じ receiver なら受信スレッドは増えない
+    threads = threading.active_count()
+    ingestor.start(receiver)
+    assert threading.active_count() == threads
+    ingestor.stop()
+    assert not ingestor.running
+
+
+def test_stop_flushes_the_utterance_in_progress():
+    ingestor = FrameIngestor()
+    receiver = FakeReceiver()
+    ingestor.start(receiver)
+    receiver.send(np.concatenate([silence(1), tone(0.6)]))
+    while not receiver.frames.empty():
+        time.sleep(0.01)
+    time.sleep(0.05)
+    ingestor.stop()
+    assert len(ingestor.get(timeout=0)) / RATE >= 0.6
+
+
+def test_idle_receiver_stops_the_thread(monkeypatch):
+    from michat.lib.transcript import ingest
+
+    monkeypatch.setattr(ingest, "receive_timeout", 0.01)
+    ingestor = FrameIngestor(idle_timeout=0.05)
+    receiver = FakeReceiver()
+    ingestor.start(receiver)
+    time.sleep(0.5)
+    assert not ingestor.running
+    # 何も届いていない間は数回待つだけで、回り続けない
+    assert receiver.calls <= 10
+
+
+def test_feed_works_as_a_frame_callback():
+    ingestor = FrameIngestor()
+    samples = np.concatenate([silence(1), tone(0.8), silence(1)])
+    stereo = np.repeat(samples, 2)
+    for i in range(0, len(stereo), 640):
+        frame = FakeFrame(stereo[i : i + 640], channels=2)
+        assert ingestor.feed(frame) is frame
+    assert ingestor.pending == 1
+
+
+def test_old_utterances_are_dropped_when_nobody_reads_them():
+    ingestor = FrameIngestor(max_utterances=2)
+    samples = np.concatenate([silence(1)] + [np.concatenate([tone(0.3 + 0.1 * i), silence(1)]) for i in range(4)])
+    for i in range(0, len(samples), 320):
+        ingestor.feed(FakeFrame(samples[i : i + 320]))
+    assert ingestor.pending == 2
+    assert ingestor.dropped == 2
+    # 残るのは新しい2つ
+    lengths = [len(ingestor.get(timeout=0)) for _ in range(2)]
+    assert lengths[0] < lengths[1]
+    assert lengths[0] / RATE >= 0.5
+
+
+class Rerun(Exception):
+    pass
+
+
+# 発話がなくても interval ごとに tick を呼ぶので、Streamlitの停止や再実行（st の呼び出しで投げられる）が待たされない
+def test_wait_ticks_every_interval_while_idle():
+    ingestor = FrameIngestor()
+    receiver = FakeReceiver()
+    ingestor.start(receiver)
+    ticks = []
+
+    def tick(receiving):
+        ticks.append(receiving)
+        raise Rerun()
+
+    start = time.perf_counter()
+    with pytest.raises(Rerun):
+        ingestor.wait(0.2, tick)
+    assert time.perf_counter() - start < 0.4
+    assert ticks == [False]
+
+    receiver.send(np.concatenate([silence(1), tone(0.8), silence(1)]))
+    utterance = ingestor.wait(0.1, ticks.append)
+    assert 0.8 <= len(utterance) / RATE < 1.2
+    ingestor.stop()
+    assert ingestor.wait(0.1, ticks.append) is None
@@ -0,0 +1,102 @@
+import time
+
+import openai
+import pytest
+
+from michat.lib.speak import AsyncHTTPBackend, ChatGPT, LLMRequestError, OpenAIBackend, get_llm_backend
+from michat.lib.stub import FakeOpenAIServer
+
+payload = {"model": "gpt-3.5-turbo", "messages": [{"role": "user", "content": "こんにちは"}]}
+
+
+def test_async_backend_complete_and_stream():
+    with FakeOpenAIServer(reply="こんにちはなのだ。", chunk_size=2) as server:
+        backend = AsyncHTTPBackend(api_key="test", api_base=server.url)
+        try:
+            assert backend.complete(payload) == "こんにちはなのだ。"
+            assert list(backend.stream(payload)) == ["こん", "にち", "はな", "のだ", "。"]
+        finally:
+            backend.close()
+    assert server.requests[1]["stream"] is True
+
+
+def test_async_backend_retries_server_errors():
+    with FakeOpenAIServer(reply="ok", fail_first=2) as server:
+        backend = AsyncHTTPBackend(api_key="test", api_base=server.url, retries=2, backoff=0.01)
+        try:
+            assert backend.complete(payload) == "ok"
+        finally:
+            backend.close()
+    assert backend.stats["retried"] == 2
+    assert len(server.requests) == 3
+
+
+def test_async_backend_gives_up():
+    with FakeOpenAIServer(reply="ok", fail_first=5) as server:
+        backend = AsyncHTTPBackend(api_key="test", api_base=server.url, retries=1, backoff=0.01)
+        try:
+            with pytest.raises(LLMRequestError) as e:
+                backend.complete(payload)
+        finally:
+            backend.close()
+    assert e.value.status == 503
+
+
+def test_async_backend_hedges_slow_requests():
+    # 最初のリクエストだけ遅い
+    latency = lambda i: 2.0 if i == 0 else 0.0  # noqa: E731
+    with FakeOpenAIServer(reply="ok", latency=latency) as server:
+        backend = AsyncHTTPBackend(api_key="test", api_base=server.url, hedge_after=0.1)
+        try:
+            assert backend.complete(payload, timeout=1.0) == "ok"
+        finally:
+            backend.close()
+    assert backend.stats["hedged"] == 1
+
+
+def test_openai_backend_retries_server_errors():
+    with FakeOpenAIServer(reply="ok", fail_first=2, chunk_size=1) as server:
+        backend = OpenAIBackend(api_key="test", api_base=server.url, backoff=0.01)
+        assert backend.complete(payload) == "ok"
+        assert list(backend.stream(payload)) == ["o", "k"]
+    assert backend.stats == {"requests": 4, "retried": 2}
+
+
+def test_openai_backend_gives_up_at_the_deadline():
+    with FakeOpenAIServer(reply="ok", latency=2.0) as server:
+        backend = OpenAIBackend(api_key="test", api_base=server.url, backoff=0.01)
+        start = time.perf_counter()
+        with pytest.raises(openai.error.Timeout):
+            backend.complete(payload, timeout=0.3)
+    assert time.perf_counter() - start < 1.5
+
+
+# 既定のバックエンドでも ChatGPT の期限が効く
+def test_chatgpt_default_backend_has_a_deadline(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    with FakeOpenAIServer(reply="やあ", latency=2.0) as server:
+        chat = ChatGPT(128)
+        chat.backend.api_base = server.url
+        chat.timeout = 0.3
+        assert isinstance(chat.backend, OpenAIBackend)
+        with pytest.raises(openai.error.Timeout):
+            list(chat.generate_stream("system", "こんにちは").sentences())
+
+
+def test_chatgpt_with_backend_name(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    with FakeOpenAIServer(reply="やあ") as server:
+        monkeypatch.setenv("OPENAI_API_BASE", server.url)
+        chat = ChatGPT(128, backend="async")
+        try:
+            text, history = chat.generate("system", "こんにちは")
+        finally:
+            chat.backend.close()
+    assert isinstance(chat.backend, AsyncHTTPBackend)
+    assert text == "やあ"
+    assert history[-1] == {"role": "assistant", "content": "やあ"}
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        get_llm_backend("nothing")
@@ -0,0 +1,43 @@
+import wave
+
+import numpy as np
+
+from michat.lib.transcript import PCMBuffer
+
+
+def test_pcm_buffer_appends_and_grows():
+    buffer = PCMBuffer(max_seconds=1, initial_seconds=0.1)
+    for i in range(5):
+        buffer.append(np.full((1, 20), i, dtype=np.int16), 100, 2)
+    assert len(buffer) == 50
+    assert 50 <= buffer.capacity <= 100
+    view = buffer.view()
+    assert view.shape == (50, 2)
+    assert view[0, 0] == 0 and view[-1, 0] == 4
+
+
+def test_pcm_buffer_overwrites_oldest_when_full():
+    buffer = PCMBuffer(max_seconds=1, initial_seconds=1)
+    buffer.append(np.arange(80, dtype=np.int16), 100, 1)
+    buffer.append(np.arange(80, 130, dtype=np.int16), 100, 1)
+    assert len(buffer) == 100
+    assert buffer.view()[:, 0].tolist() == list(range(30, 130))
+
+
+def test_pcm_buffer_view_is_zero_copy():
+    buffer = PCMBuffer()
+    buffer.append(np.ones(480, dtype=np.int16), 48000, 1)
+    earlier = buffer.view()
+    assert np.shares_memory(earlier, buffer._PCMBuffer__data)
+    # 後から取ったビューへの書き込みが、先に取ったビューに見える
+    buffer.view()[0, 0] = 7
+    assert earlier[0, 0] == 7
+
+
+def test_pcm_buffer_wav():
+    buffer = PCMBuffer()
+    buffer.append(np.zeros(960, dtype=np.int16), 48000, 2)
+    with wave.open(buffer.wav()) as reader:
+        assert reader.getnchannels() == 2
+        assert reader.getframerate() == 48000
+        assert reader.getnframes() == 480
@@ -0,0 +1,61 @@
+import threading
+import time
+
+from michat.lib.speak import BatchPipeline, numbered_path
+
+
+class FakeChat:
+    def __init__(self):
+        self.histories = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def generate(self, system_text, user_text, history=None):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        self.histories.append(history)
+        # 後の入力ほど早く終わるようにして順序の入れ替わりを起こす
+        time.sleep(0.05 / (1 + int(user_text)))
+        with self.lock:
+            self.active -= 1
+        history = (history or []) + [user_text]
+        return ("reply " + user_text, history, {"喜び": 1})
+
+
+class FakeAudio:
+    def transform(self, text):
+        self.text = text
+
+    def get_wav(self):
+        return self.text.encode()
+
+
+def run(chained):
+    chat = FakeChat()
+    emitted = []
+    pipeline = BatchPipeline(
+        chat, FakeAudio, "system", lambda item: emitted.append(item.wav), chained=chained
+    )
+    items = pipeline.run([str(i) for i in range(4)])
+    return chat, emitted, items, pipeline
+
+
+def test_batch_pipeline_chained_keeps_history():
+    chat, emitted, items, pipeline = run(chained=True)
+    assert emitted == [b"reply 0", b"reply 1", b"reply 2", b"reply 3"]
+    assert chat.histories == [None, ["0"], ["0", "1"], ["0", "1", "2"]]
+    assert chat.max_active == 1
+    assert [stats.count for stats in pipeline.stats] == [4, 4, 4]
+
+
+def test_batch_pipeline_independent_runs_in_parallel():
+    chat, emitted, items, _ = run(chained=False)
+    assert emitted == [b"reply 0", b"reply 1", b"reply 2", b"reply 3"]
+    assert chat.histories == [None] * 4
+    assert chat.max_active > 1
+
+
+def test_numbered_path():
+    assert numbered_path("out/output.wav", 2).as_posix() == "out/output-2.wav"
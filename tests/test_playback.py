@@ -0,0 +1,72 @@
+import io
+import time
+import wave
+
+from michat.lib.speak import NullSink, Player, RecordingSink
+from michat.lib.stub import FakeEngine
+
+engine = FakeEngine()
+
+
+def tone(chars):
+    return engine.synthesis(engine.audio_query("あ" * chars, 3), 3)
+
+
+def seconds(wav):
+    with wave.open(io.BytesIO(wav), "rb") as reader:
+        return reader.getnframes() / reader.getframerate()
+
+
+def test_play_does_not_block_and_keeps_the_order():
+    sink = RecordingSink(realtime=True)
+    with Player(sink) as player:
+        start = time.perf_counter()
+        utterance = player.play(tone(2))
+        assert player.play(tone(1), utterance) == utterance
+        assert time.perf_counter() - start < 0.1
+        assert player.wait(timeout=5)
+    assert [round(seconds(c), 2) for c in sink.clips] == [0.2, 0.1]
+    assert round(seconds(sink.wav()), 2) == 0.3
+
+
+def test_cancel_stops_the_current_utterance():
+    sink = RecordingSink(realtime=True)
+    with Player(sink) as player:
+        first = player.play(tone(10))
+        player.play(tone(10), first)
+        second = player.play(tone(1))
+        time.sleep(0.2)
+        player.cancel()
+        # 止めた返答の続きは再生しない
+        player.play(tone(10), first)
+        assert player.wait(timeout=5)
+    assert len(sink.clips) == 2
+    assert seconds(sink.clips[0]) < 0.5
+    assert round(seconds(sink.clips[1]), 2) == 0.1
+    assert second != first
+
+
+def test_cancelled_utterances_are_forgotten_once_superseded():
+    sink = NullSink()
+    with Player(sink) as player:
+        for _ in range(100):
+            utterance = player.play(tone(1))
+            player.cancel(utterance)
+        last = player.play(tone(1))
+        assert player.wait(timeout=5)
+        # 古い返答の遅れて届いた文は再生しない
+        player.play(tone(5), utterance)
+        assert player.wait(timeout=5)
+        assert len(player._Player__cancelled) <= 1
+        assert not player.busy
+    assert last > utterance
+    assert round(sink.seconds, 2) == 0.1
+
+
+def test_null_sink_counts_the_played_audio():
+    sink = NullSink()
+    with Player(sink) as player:
+        for n in (1, 2, 3):
+            player.play(tone(n))
+        player.wait()
+    assert round(sink.seconds, 2) == 0.6
@@ -0,0 +1,82 @@
+import numpy as np
+
+from michat.lib.transcript import AudioTranscriber, FrameIngestor, Preprocessor, Resampler, get_backend, preprocess_pcm
+
+
+def tone(freq, rate, seconds, level=8000):
+    t = np.arange(int(rate * seconds)) / rate
+    return level * np.sin(2 * np.pi * freq * t)
+
+
+def rms(x):
+    return np.sqrt(np.mean(np.asarray(x, dtype=np.float64) ** 2))
+
+
+def test_resampler_streams_the_same_as_one_shot():
+    x = tone(1000, 48000, 1.0)
+    whole = Resampler(48000).process(x)
+    resampler = Resampler(48000)
+    chunks = np.concatenate([resampler.process(x[i : i + 960]) for i in range(0, len(x), 960)])
+    assert len(whole) == len(chunks) == 16000
+    assert np.allclose(whole, chunks, atol=1e-2)
+    # 周波数と振幅はそのまま
+    assert np.argmax(np.abs(np.fft.rfft(whole))) == 1000
+    assert abs(rms(whole[100:]) / rms(x) - 1) < 0.01
+
+
+def test_resampler_removes_what_16k_cannot_hold():
+    assert rms(Resampler(48000).process(tone(12000, 48000, 0.5))[200:]) < 1
+    odd = Resampler(44100)
+    y = np.concatenate([odd.process(c) for c in np.array_split(tone(440, 44100, 1.0), 37)])
+    assert len(y) == 16000
+    assert np.argmax(np.abs(np.fft.rfft(y))) == 440
+
+
+def test_preprocessor_downmixes_and_removes_dc():
+    left = tone(300, 48000, 1.0) + 3000
+    stereo = np.stack([left, left], axis=1).astype(np.int16).reshape(-1)
+    preprocessor = Preprocessor()
+    out = np.concatenate(
+        [preprocessor.process(stereo[i : i + 1920], 48000, 2) for i in range(0, len(stereo), 1920)]
+    )
+    assert out.dtype == np.int16
+    assert len(out) == 16000
+    assert abs(out[8000:].mean()) < 50
+
+
+def test_normalize_brings_quiet_speech_up():
+    quiet = tone(300, 16000, 2.0, level=1000).astype(np.int16)
+    out = preprocess_pcm(quiet, 16000, normalize=True)
+    level = 20 * np.log10(rms(out[16000:]) / 32768)
+    assert -22 < level < -18
+
+
+def test_ingested_utterances_are_16k_mono():
+    ingestor = FrameIngestor()
+
+    class Frame:
+        sample_rate = 48000
+
+        class layout:
+            channels = [None, None]
+
+        def __init__(self, samples):
+            self.samples = samples
+
+        def to_ndarray(self):
+            return self.samples.reshape(1, -1)
+
+    rng = np.random.default_rng(0)
+    mono = np.concatenate([rng.standard_normal(48000) * 30, tone(220, 48000, 0.8), rng.standard_normal(48000) * 30])
+    stereo = np.repeat(mono.astype(np.int16), 2)
+    for i in range(0, len(stereo), 1920):
+        ingestor.feed(Frame(stereo[i : i + 1920]))
+    utterance = ingestor.get(timeout=0)
+    assert ingestor.sample_rate == 16000
+    assert 0.8 <= len(utterance) / 16000 < 1.2
+
+
+def test_transcriber_sends_16k():
+    ts = AudioTranscriber(backend=get_backend("stub"))
+    pcm = tone(220, 48000, 1.5).astype(np.int16)
+    assert ts.listen(pcm.tobytes(), 48000) == "1.50秒の音声"
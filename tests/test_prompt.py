@@ -0,0 +1,23 @@
+import os
+
+from michat.lib.speak import ChatGPTFeature, PromptRegistry, system_text
+
+
+def test_system_text_discovers_personas():
+    for feature in ChatGPTFeature:
+        assert system_text(feature)
+
+
+def test_prompt_registry_precomposes_and_reloads(tmp_path):
+    (tmp_path / "system-zundamon.txt").write_text("ずんだもん")
+    (tmp_path / "system-emotion.txt").write_text("+感情")
+    registry = PromptRegistry(ChatGPTFeature, root=tmp_path, interval=0)
+    assert registry.personas == [ChatGPTFeature.ZUNDAMON]
+    persona = registry.system(ChatGPTFeature.ZUNDAMON)
+    assert registry.with_emotion(persona) is registry.with_emotion(persona)
+    assert registry.with_emotion(persona) == "ずんだもん+感情"
+
+    path = tmp_path / "system-emotion.txt"
+    path.write_text("+感情2")
+    os.utime(path, (0, path.stat().st_mtime + 10))
+    assert registry.with_emotion(persona) == "ずんだもん+感情2"
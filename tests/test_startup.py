@@ -0,0 +1,74 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from michat.lib.startup import StartupProfiler, lazy_import
+
+
+def test_lazy_import_loads_on_first_use(monkeypatch):
+    monkeypatch.delitem(sys.modules, "colorsys", raising=False)
+    colorsys = lazy_import("colorsys")
+    assert "colorsys" not in sys.modules
+    assert colorsys.rgb_to_hsv(1.0, 0.0, 0.0) == (0.0, 1.0, 1.0)
+    assert "colorsys" in sys.modules
+
+
+def test_missing_module_fails_only_when_used():
+    missing = lazy_import("michat_no_such_module")
+    with pytest.raises(ImportError):
+        missing.anything
+
+
+def test_heavy_backends_are_not_imported_up_front():
+    code = (
+        "import sys\n"
+        "from michat.lib.speak import Audio, ChatGPTWithEmotion, llm_backend_names, warm_up\n"
+        "from michat.lib.transcript import LISTENING_TEXT, backend_names\n"
+        "llm_backend_names(); backend_names()\n"
+        "heavy = ['openai', 'aiohttp', 'voicevox_core', 'playsound', 'dotenv', 'speech_recognition', 'numpy']\n"
+        "print([m for m in heavy if m in sys.modules])\n"
+    )
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == "[]"
+
+
+def test_profiler_reports_imports_and_phases(monkeypatch, tmp_path):
+    monkeypatch.delitem(sys.modules, "colorsys", raising=False)
+    profiler = StartupProfiler().start()
+    with profiler.phase("init"):
+        import colorsys  # noqa: F401
+    path = tmp_path / "startup.json"
+    profiler.finish(path)
+    assert not profiler.running
+
+    report = json.loads(path.read_text())
+    assert [p["phase"] for p in report["phases"]] == ["init"]
+    modules = {m["module"]: m for m in report["modules"]}
+    assert modules["colorsys"]["cumulative"] >= modules["colorsys"]["self"] > 0
+    assert report["packages"]["colorsys"] > 0
+    assert report["total"] >= report["imports"]
+
+
+def test_cli_profiles_the_project_imports(tmp_path):
+    script = Path(__file__).resolve().parents[1] / "michat" / "transcript.py"
+    report = tmp_path / "startup.json"
+    subprocess.run(
+        [sys.executable, str(script), "--profile-startup", str(report)]
+        + ["-i", str(tmp_path), "-o", str(tmp_path / "out.jsonl"), "-b", "stub"],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=tmp_path,
+    )
+    modules = {m["module"] for m in json.loads(report.read_text())["modules"]}
+    assert {"lib.transcript", "lib.transcript.batch", "numpy"} <= modules
+
+
+def test_profiler_starts_only_with_the_flag():
+    assert not StartupProfiler.from_argv(["-i", "recordings"]).running
+    profiler = StartupProfiler.from_argv(["--profile-startup=startup.json"])
+    assert profiler.running
+    profiler.stop()
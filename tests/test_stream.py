@@ -0,0 +1,63 @@
+import openai
+
+from michat.lib.speak import ChatGPTWithEmotion, EmotionParser, split_sentences
+from michat.lib.stub import FakeOpenAIServer
+
+
+def test_split_sentences():
+    chunks = ["こんに", "ちは！ぼくは", "ずんだもんなのだ。", "よろしく", "なのだ♪\n", "またね"]
+    wanted = ["こんにちは！", "ぼくはずんだもんなのだ。", "よろしくなのだ♪", "またね"]
+    assert list(split_sentences(chunks)) == wanted
+
+
+def test_split_sentences_keeps_trailing_delimiters():
+    chunks = ["本当", "？", "！", "うん"]
+    assert list(split_sentences(chunks)) == ["本当？！", "うん"]
+
+
+def test_chat_with_emotion_stream(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    with FakeOpenAIServer(chunk_size=3) as server:
+        monkeypatch.setattr(openai, "api_base", server.url)
+        chat = ChatGPTWithEmotion(512)
+        stream = chat.generate_stream("system", "こんにちは")
+        sentences = list(stream.sentences())
+
+    assert sentences == ["こんにちは！", "ぼくはずんだもんなのだ。", "今日もよろしくなのだ♪"]
+    assert stream.params == {"喜び": 3, "楽しさ": 2}
+    assert stream.text == "こんにちは！ぼくはずんだもんなのだ。今日もよろしくなのだ♪"
+    assert stream.history[-1]["role"] == "assistant"
+    assert server.requests[0]["stream"] is True
+
+
+def feed(parser, text, size):
+    out = [parser.feed(text[i : i + size]) for i in range(0, len(text), size)]
+    return "".join(out) + parser.close()
+
+
+def test_emotion_parser_emits_params_before_the_body():
+    seen = []
+    parser = EmotionParser(on_params=seen.append)
+    assert parser.feed('感情パラメーター\n{"喜び": 3,') == ""
+    assert seen == []
+    assert parser.feed(' "楽しさ": 2}\nこんに') == "こんに"
+    assert seen == [{"喜び": 3, "楽しさ": 2}]
+    assert parser.feed("ちは") == "ちは"
+
+
+def test_emotion_parser_handles_any_chunking():
+    text = 'チャットボットの現在の感情パラメーター\n{"喜び": 3, "怒り": 0}\n\nこんにちは！\nまたね'
+    for size in (1, 2, 5, len(text)):
+        parser = EmotionParser()
+        assert feed(parser, text, size) == "こんにちは！\nまたね"
+        assert parser.params == {"喜び": 3, "怒り": 0}
+
+
+def test_emotion_parser_with_malformed_or_missing_header():
+    parser = EmotionParser()
+    assert feed(parser, "感情パラメーター: {'喜び'： 4, 悲しみ: 1,}\nうれしいのだ", 3) == "うれしいのだ"
+    assert parser.params == {"喜び": 4, "悲しみ": 1}
+
+    parser = EmotionParser()
+    assert feed(parser, "{笑}ヘッダなしなのだ\n{閉じない", 2) == "{笑}ヘッダなしなのだ\n{閉じない"
+    assert parser.params is None
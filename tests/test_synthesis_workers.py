@@ -0,0 +1,65 @@
+import io
+import threading
+import wave
+
+import pytest
+
+from michat.lib.speak import Audio, PendingQuery, SynthesisWorkerPool
+from michat.lib.stub import FakeEngine
+
+
+def frames(wav):
+    with wave.open(io.BytesIO(wav), "rb") as reader:
+        return reader.getnframes()
+
+
+@pytest.fixture(scope="module")
+def pool():
+    kwargs = {"latency": 0.02, "seconds_per_char": 0.01}
+    with SynthesisWorkerPool(2, engine_factory=FakeEngine, engine_kwargs=kwargs) as pool:
+        yield pool
+
+
+def test_results_keep_the_request_order(pool):
+    texts = ["あ" * n for n in range(1, 9)]
+    wavs = list(pool.map(texts, 3))
+    assert [frames(w) for w in wavs] == [240 * n for n in range(1, 9)]
+
+
+def test_speakers_stick_to_a_worker(pool):
+    pool.submit("こんにちは", 1).result()
+    pool.submit("こんにちは", 2).result()
+    first = pool.worker_of(1)
+    assert pool.worker_of(1) is first
+    assert pool.worker_of(2) is not first
+
+
+def test_pending_requests_are_batched(pool):
+    before = sum(s["batches"] for s in pool.stats)
+    futures = [pool.submit("あ" * (i % 3 + 1), 7) for i in range(12)]
+    assert [frames(f.result()) for f in futures] == [240 * (i % 3 + 1) for i in range(12)]
+    assert sum(s["batches"] for s in pool.stats) - before < 12
+
+
+def test_audio_through_the_pool(pool):
+    audio = Audio(3, pool=pool, cache=False, speed_scale=2.0)
+    audio.transform("こんにちは")
+    assert isinstance(audio.audio_query, PendingQuery)
+    assert audio.audio_query.params == {"speed_scale": 2.0}
+    assert frames(audio.get_wav()) == 600
+
+
+def test_concurrent_callers(pool):
+    results = {}
+
+    def speak(speaker_id):
+        audio = Audio(speaker_id, pool=pool, cache=False)
+        audio.transform("あ" * speaker_id)
+        results[speaker_id] = frames(audio.get_wav())
+
+    threads = [threading.Thread(target=speak, args=(i,)) for i in range(1, 7)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == {i: 240 * i for i in range(1, 7)}
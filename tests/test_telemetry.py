@@ -0,0 +1,69 @@
+import json
+
+import pytest
+
+from michat.lib import telemetry
+from michat.lib.speak import Audio, ChatGPT, get_llm_backend
+from michat.lib.stub import FakeEngine, FakeOpenAIServer
+
+
+@pytest.fixture
+def trace(tmp_path):
+    path = tmp_path / "trace.jsonl"
+    telemetry.enable(path)
+    yield path
+    telemetry.disable()
+
+
+def spans(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def test_disabled_span_is_a_noop():
+    telemetry.disable()
+    with telemetry.span("synthesis") as s:
+        s.set(audio_seconds=1.0)
+    assert not s
+    assert telemetry.prometheus_text() == ""
+
+
+def test_audio_stages(trace):
+    audio = Audio(3, pool=FakeEngine(seconds_per_char=0.1), cache=False)
+    audio.transform("こんにちは")
+    audio.get_wav()
+
+    records = spans(trace)
+    assert [r["name"] for r in records] == ["query", "synthesis"]
+    assert records[1]["audio_seconds"] == pytest.approx(0.5)
+
+    text = telemetry.prometheus_text()
+    assert "# TYPE michat_stage_seconds histogram" in text
+    assert 'michat_stage_seconds_count{stage="synthesis"} 1' in text
+    assert 'michat_audio_seconds_total{stage="synthesis"} 0.5' in text
+    assert 'michat_realtime_factor_bucket{stage="synthesis",le="+Inf"} 1' in text
+
+
+def test_stream_tokens(trace):
+    with FakeOpenAIServer(reply="こんにちは。") as server:
+        backend = get_llm_backend("openai", api_key="test", api_base=server.url)
+        chat = ChatGPT(64, completion_cache=False, backend=backend)
+        stream = chat.generate_stream("system", "やあ")
+        assert list(stream.sentences()) == ["こんにちは。"]
+
+    record = spans(trace)[0]
+    assert record["name"] == "generate"
+    assert record["stream"] is True
+    assert 0 < record["first_token"] <= record["duration"]
+    assert record["completion_tokens"] > 0
+    assert 'michat_tokens_total{kind="completion"}' in telemetry.prometheus_text()
+
+
+def test_histogram_buckets():
+    histogram = telemetry.Histogram("latency", buckets=(0.1, 1.0))
+    for v in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(v, stage="x")
+    samples = dict(histogram.samples())
+    assert samples['latency_bucket{stage="x",le="0.1"}'] == 2
+    assert samples['latency_bucket{stage="x",le="1.0"}'] == 3
+    assert samples['latency_bucket{stage="x",le="+Inf"}'] == 4
+    assert samples['latency_count{stage="x"}'] == 4
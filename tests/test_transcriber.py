@@ -0,0 +1,123 @@
+import contextlib
+import time
+
+import numpy as np
+import pytest
+
+from michat.lib.transcript import (
+    GOODBYE_TEXT,
+    UNKNOWN_VALUE_TEXT,
+    AudioTranscriber,
+    VoiceActivityDetector,
+    VoiceTranscriber,
+    backend_names,
+    get_backend,
+    pcm_audio_data,
+    to_wav,
+)
+
+
+def test_backend_registry():
+    assert {"google", "stub", "whisper"} <= set(backend_names())
+    with pytest.raises(ValueError):
+        get_backend("unknown")
+
+
+def test_audio_transcriber_accepts_pcm():
+    ts = AudioTranscriber(backend="stub")
+    samples = np.zeros(16000, dtype=np.int16)
+    assert ts.listen(samples, 16000) == "1.00秒の音声"
+    assert ts.listen(samples.tobytes(), 8000) == "2.00秒の音声"
+    assert ts.listen(np.zeros(0, dtype=np.int16), 16000) == UNKNOWN_VALUE_TEXT
+
+
+def test_audio_transcriber_accepts_wav():
+    ts = AudioTranscriber(backend=get_backend("stub", text="こんにちは"))
+    assert ts.listen(to_wav(np.zeros(1600, dtype=np.int16), 16000)) == "こんにちは"
+
+
+def test_pcm_audio_data_is_zero_copy_for_mono():
+    samples = np.arange(100, dtype=np.int16)
+    audio = pcm_audio_data(samples, 16000)
+    assert np.shares_memory(np.frombuffer(audio.frame_data, dtype=np.int16), samples)
+    assert len(pcm_audio_data(np.repeat(samples, 2), 16000, 2).frame_data) == 200
+
+
+class ScriptedTranscriber(VoiceTranscriber):
+    def __init__(self, count, **kwargs):
+        super().__init__(vad=object(), **kwargs)
+        self.count = count
+
+    def utterances(self, source):
+        for i in range(self.count):
+            yield pcm_audio_data(np.zeros(1600 * (i + 1), dtype=np.int16), 16000)
+
+
+def test_voice_transcriber_recognizes_concurrently_in_order():
+    backend = get_backend("stub", delay=0.1)
+    ts = ScriptedTranscriber(4, backend=backend, workers=4)
+    start = time.perf_counter()
+    texts = list(ts.listen(contextlib.nullcontext()))
+    elapsed = time.perf_counter() - start
+    assert texts == ["Listening...", "0.10秒の音声", "0.20秒の音声", "0.30秒の音声", "0.40秒の音声"]
+    assert elapsed < 0.3
+    assert ts.stats["recognized"] == 4
+    assert ts.stats["latency_avg"] >= 0.1
+
+
+def test_voice_transcriber_is_serial_by_default():
+    ts = ScriptedTranscriber(2, backend=get_backend("stub"))
+    texts = ts.listen(contextlib.nullcontext())
+    assert next(texts) == "Listening..."
+    assert next(texts) == "0.10秒の音声"
+    # 結果を受け取っている間は次の発話を取りにいかない
+    assert ts.workers == 0 and ts.queue_depth == 0
+    assert list(texts) == ["0.20秒の音声"]
+
+
+# sr.Microphone の代わり。(音声, 再生中か) の並びを CHUNK ずつ返し、尽きたら Ctrl-C と同じく止める
+class ScriptedMicrophone:
+    CHUNK = 320
+    SAMPLE_RATE = 16000
+
+    def __init__(self, script):
+        self.chunks = [
+            (samples[i : i + self.CHUNK].tobytes(), playing)
+            for samples, playing in script
+            for i in range(0, len(samples), self.CHUNK)
+        ]
+        self.stream = self
+
+    @property
+    def playing(self):
+        return bool(self.chunks) and self.chunks[0][1]
+
+    def read(self, size):
+        if not self.chunks:
+            raise KeyboardInterrupt
+        return self.chunks.pop(0)[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+def test_voice_transcriber_skips_audio_while_paused():
+    rng = np.random.default_rng(0)
+
+    def silence(seconds):
+        return (rng.standard_normal(int(16000 * seconds)) * 30).astype(np.int16)
+
+    def tone(seconds):
+        return (np.sin(2 * np.pi * 220 * np.arange(int(16000 * seconds)) / 16000) * 8000).astype(np.int16)
+
+    mic = ScriptedMicrophone(
+        [(silence(1), False), (tone(1.5), True), (silence(1), True), (tone(0.5), False), (silence(1), False)]
+    )
+    ts = VoiceTranscriber(VoiceActivityDetector(), backend=get_backend("stub"), paused=lambda: mic.playing)
+    texts = list(ts.listen(mic))
+    # 再生中に拾った音（1.5秒）は認識に回さない
+    assert len(texts) == 3 and texts[-1] == GOODBYE_TEXT
+    assert float(texts[1][: -len("秒の音声")]) < 1.0
@@ -0,0 +1,56 @@
+from michat.lib.speak import Audio, TTSCache
+
+
+class FakePool:
+    def __init__(self):
+        self.calls = 0
+
+    def audio_query(self, text, speaker_id):
+        self.calls += 1
+        return text
+
+    def synthesis(self, audio_query, speaker_id):
+        self.calls += 1
+        return "{}:{}".format(audio_query, speaker_id).encode()
+
+
+def test_tts_cache_key_normalizes_text():
+    assert TTSCache.key("ばいばい、 またね ", 3) == TTSCache.key("ばいばい、　またね", "3")
+    assert TTSCache.key("ばいばい", 3) != TTSCache.key("ばいばい", 1)
+    assert TTSCache.key("ばいばい", 3) != TTSCache.key("ばいばい", 3, {"speed_scale": 1.2})
+
+
+def test_audio_uses_cached_wav(tmp_path):
+    pool = FakePool()
+    cache = TTSCache(tmp_path)
+    audio = Audio(3, pool=pool, cache=cache)
+    audio.transform("よくわかりません...")
+    first = audio.get_wav()
+    audio.transform("よくわかりません...")
+    assert audio.get_wav() == first
+    assert pool.calls == 2
+    assert cache.stats["hits"] == 1
+    assert cache.stats["misses"] == 1
+
+
+def test_tts_cache_persists_and_evicts(tmp_path):
+    cache = TTSCache(tmp_path, memory_size=0, disk_limit=10)
+    cache.put("aa01", b"12345")
+    cache.put("bb02", b"67890")
+    assert TTSCache(tmp_path).get("aa01") == b"12345"
+    cache.put("cc03", b"abcde")
+    assert cache.get("cc03") == b"abcde"
+    assert cache.stats["disk_bytes"] <= 10
+
+
+def test_tts_cache_shares_dir_between_processes(tmp_path):
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(2) as executor:
+        list(executor.map(_put, [tmp_path] * 8, [bytes([i]) * 1000 for i in range(8)]))
+    assert len(TTSCache(tmp_path).get("aa01")) == 1000
+    assert not list(tmp_path.glob("*/*.tmp"))
+
+
+def _put(root, wav):
+    TTSCache(root, memory_size=0).put("aa01", wav)
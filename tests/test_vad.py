@@ -0,0 +1,49 @@
+import numpy as np
+
+from michat.lib.transcript import VoiceActivityDetector
+
+RATE = 16000
+
+
+def silence(seconds, level=30):
+    rng = np.random.default_rng(0)
+    return (rng.standard_normal(int(RATE * seconds)) * level).astype(np.int16)
+
+
+def tone(seconds, freq=220, level=8000):
+    t = np.arange(int(RATE * seconds)) / RATE
+    return (np.sin(2 * np.pi * freq * t) * level).astype(np.int16)
+
+
+def feed(vad, samples, chunk=320):
+    segments = []
+    for i in range(0, len(samples), chunk):
+        segments.extend(vad.feed(samples[i : i + chunk], RATE))
+    return segments
+
+
+def test_vad_splits_utterances():
+    vad = VoiceActivityDetector()
+    samples = np.concatenate([silence(1), tone(0.8), silence(1), tone(0.5), silence(1)])
+    segments = feed(vad, samples)
+    assert len(segments) == 2
+    # 無音は前後の短い余白だけ残す
+    assert 0.8 <= len(segments[0]) / RATE < 1.2
+    assert vad.flush() is None
+
+
+def test_vad_ignores_short_noise_and_flushes():
+    vad = VoiceActivityDetector()
+    segments = feed(vad, np.concatenate([silence(1), tone(0.1), silence(1), tone(0.6)]))
+    assert segments == []
+    assert len(vad.flush()) / RATE >= 0.6
+
+
+def test_vad_downmixes_stereo():
+    vad = VoiceActivityDetector()
+    mono = np.concatenate([silence(1), tone(0.8), silence(1)])
+    stereo = np.repeat(mono, 2)
+    segments = []
+    for i in range(0, len(stereo), 640):
+        segments.extend(vad.feed(stereo[i : i + 640], RATE, 2))
+    assert len(segments) == 1
@@ -0,0 +1,37 @@
+import json
+
+from michat.lib.speak import Audio, TTSCache, load_manifest, warm_up
+from michat.lib.stub import FakeEngine
+from michat.lib.transcript import UNKNOWN_VALUE_TEXT
+
+
+def test_load_manifest(tmp_path):
+    path = tmp_path / "canned.json"
+    path.write_text(json.dumps({"speakers": ["1", 3], "phrases": ["こんにちは", UNKNOWN_VALUE_TEXT]}))
+    speakers, phrases = load_manifest(path)
+    assert speakers == [1, 3]
+    assert phrases.count(UNKNOWN_VALUE_TEXT) == 1
+    assert phrases[-1] == "こんにちは"
+    assert load_manifest(tmp_path / "missing.json")[0] == []
+
+
+def test_warm_up_renders_phrases_once(tmp_path):
+    engine = FakeEngine()
+    cache = TTSCache(root=tmp_path / "tts")
+    phrases = ["こんにちは", "またね"]
+
+    def factory(speaker_id):
+        return Audio(speaker_id, pool=engine, cache=cache)
+
+    report = warm_up([1, 3], phrases, audio_factory=factory)
+    assert report["speakers"][1]["rendered"] == 2
+    # 空の推論1回と決まり文句2つずつ
+    assert engine.syntheses == 2 * 3
+
+    report = warm_up([1], phrases, audio_factory=factory)
+    assert report["speakers"][1] == dict(report["speakers"][1], rendered=0, cached=2)
+    assert report["total"] > 0
+
+    audio = factory(3)
+    audio.transform("またね")
+    assert audio.wav is not None